@@ -1,15 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, abort, stream_with_context
 from datetime import datetime
-from werkzeug.security import check_password_hash
 from functools import wraps
 from dotenv import load_dotenv
 
+import click
+import hmac
+import json
 import os
+import time
+import arquivamento
+import auditoria
+import backup
 import db as database
+import eventos
+import exportacao
+import importacao
+import limitador
+import metricas
+import paginas
+import relatorios
+import senhas
+import sessoes
+import tarefas
 
 app = Flask(__name__)
 load_dotenv()
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
+app.session_interface = sessoes.InterfaceSessaoServidor()
 
 def login_required(f):
     @wraps(f)
@@ -20,29 +37,131 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def nivel_requerido(*niveis):
+    # O nível de acesso vem da sessão (mantida em dia pelo banco), sem consulta extra.
+    def decorador(f):
+        @wraps(f)
+        @login_required
+        def decorated_function(*args, **kwargs):
+            if session.get('nivel_acesso') not in niveis:
+                flash('Você não tem permissão para acessar esta página.', 'danger')
+                return redirect(url_for('dashboard'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorador
+
+def parametros_paginacao():
+    limite = database.limitar_pagina(request.args.get('limite', database.TAMANHO_PAGINA_PADRAO, type=int))
+    apos = database.decodificar_cursor(request.args.get('cursor'))
+    return apos, limite
+
+@app.template_global()
+def url_pagina(cursor=None):
+    argumentos = request.args.to_dict()
+    argumentos.pop('cursor', None)
+    if cursor:
+        argumentos['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **argumentos)
+
+if os.getenv("METRICS_ENABLED", "1") == "1":
+    metricas.instrumentar(app, database)
+
+auditoria.ativar()
+
 with app.app_context():
     database.criar_tabelas()
 
+senhas.iniciar()
+
+# Tentativas de login por IP (todas) e por conta (só as que falharam).
+limite_login_ip = limitador.LimitadorTentativas(
+    int(os.getenv("LOGIN_MAX_ATTEMPTS_IP", "30")), float(os.getenv("LOGIN_WINDOW", "300")))
+limite_login_conta = limitador.LimitadorTentativas(
+    int(os.getenv("LOGIN_MAX_FAILURES_ACCOUNT", "5")), float(os.getenv("LOGIN_WINDOW", "300")))
+
+@app.before_request
+def abrir_escopo_banco():
+    database.iniciar_escopo_requisicao()
+    database.definir_usuario_atual(session.get('user_id'))
+
+@app.teardown_appcontext
+def fechar_escopo_banco(exc):
+    database.encerrar_escopo_requisicao()
+    database.definir_usuario_atual(None)
+
+# Coletores (Prometheus) mandam "Authorization: Bearer <METRICS_TOKEN>"; sem o
+# token, /metrics só abre para administradores logados.
+token_metricas = os.getenv("METRICS_TOKEN", "")
+
+def metricas_autorizadas(f):
+    protegida = nivel_requerido('Administrador')(f)
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        autorizacao = request.headers.get('Authorization', '')
+        if token_metricas and hmac.compare_digest(autorizacao.encode(), f"Bearer {token_metricas}".encode()):
+            return f(*args, **kwargs)
+        if autorizacao:
+            abort(401)
+        return protegida(*args, **kwargs)
+    return decorated_function
+
+@app.route('/metrics')
+@metricas_autorizadas
+def metrics():
+    return Response(metricas.exportar_prometheus(database, backup.metricas() + tarefas.metricas() + auditoria.metricas()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/status/banco')
+@nivel_requerido('Administrador')
+def status_banco():
+    return jsonify({'pool': database.estatisticas_pool(), 'cache': database.estatisticas_cache(),
+                    'paginas': paginas.estatisticas(), 'eventos': eventos.obter_difusor().estatisticas(),
+                    'tarefas': database.contar_tarefas(),
+                    'auditoria': auditoria.obter_auditor().estatisticas()})
+
 @app.route('/')
 @login_required
+@paginas.condicional('equipamentos', 'movimentacoes', 'usuarios', 'clientes', 'estatisticas')
 def dashboard():
-    estatisticas = database.obter_estatisticas()
-    ultimas_movimentacoes = database.listar_ultimas_movimentacoes()
-    return render_template('dashboard.html', stats=estatisticas, ultimas_movimentacoes=ultimas_movimentacoes, active_page='dashboard')
+    estatisticas = paginas.fragmento('_dashboard_estatisticas.html',
+                                     ('equipamentos', 'movimentacoes', 'usuarios', 'estatisticas'),
+                                     lambda: {'stats': database.obter_estatisticas()})
+    atividades = paginas.fragmento('_dashboard_atividades.html', ('movimentacoes', 'equipamentos', 'usuarios', 'clientes'),
+                                   lambda: {'ultimas_movimentacoes': database.listar_ultimas_movimentacoes()})
+    return render_template('dashboard.html', estatisticas=estatisticas, atividades=atividades, active_page='dashboard')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
             email = request.form['email']
             senha = request.form['senha']
+            conta = email.strip().lower()
+            espera = max(limite_login_ip.espera(request.remote_addr), limite_login_conta.espera(conta))
+            if espera:
+                flash(f'Muitas tentativas de login. Tente novamente em {espera} segundo(s).', 'danger')
+                return render_template('login.html'), 429, {'Retry-After': str(espera)}
+            limite_login_ip.registrar(request.remote_addr)
             usuario = database.obter_usuario_por_email(email)
-            if usuario and check_password_hash(usuario['senha'], senha):
+            try:
+                valida = usuario is not None and senhas.verificar_senha(usuario['senha'], senha)
+            except senhas.FilaSenhasCheia:
+                flash('Servidor ocupado. Tente novamente em instantes.', 'warning')
+                return render_template('login.html'), 503, {'Retry-After': '5'}
+            if valida:
+                limite_login_conta.limpar(conta)
+                if senhas.precisa_atualizar(usuario['senha']):
+                    try:
+                        database.atualizar_hash_senha(usuario['id_usuario'], senhas.gerar_hash(senha))
+                    except senhas.FilaSenhasCheia:
+                        # A atualização do hash é opcional; fica para o próximo login.
+                        pass
                 session.clear()
                 session['user_id'] = usuario['id_usuario']
                 session['user_name'] = usuario['nome_usuario']
+                session['nivel_acesso'] = usuario['nivel_acesso']
                 flash(f"Bem-vindo, {usuario['nome_usuario']}!", 'success')
                 return redirect(url_for('dashboard'))
             else:
+                limite_login_conta.registrar(conta)
                 flash('Email ou senha inválidos.', 'danger')
     return render_template('login.html')
 
@@ -54,9 +173,17 @@ def logout():
     
 @app.route('/equipamentos')
 @login_required
+@paginas.condicional('equipamentos')
 def listar_equipamentos():
-    lista_de_equipamentos = database.listar_equipamentos()
-    return render_template('equipamentos.html', equipamentos=lista_de_equipamentos, active_page='equipamentos')
+    nome = request.args.get('nome', '').strip()
+
+    def carregar():
+        apos, limite = parametros_paginacao()
+        lista_de_equipamentos = database.listar_equipamentos(prefixo=nome, apos=apos, limite=limite)
+        cursor = database.proximo_cursor(lista_de_equipamentos, limite, 'nome_equipamento', 'id_equipamento')
+        return {'equipamentos': lista_de_equipamentos, 'proximo_cursor': cursor}
+    tabela = paginas.fragmento('_tabela_equipamentos.html', ('equipamentos',), carregar)
+    return render_template('equipamentos.html', tabela=tabela, nome=nome, active_page='equipamentos')
 
 @app.route('/equipamentos/novo', methods=['GET', 'POST'])
 @login_required
@@ -65,7 +192,8 @@ def novo_equipamento():
         nome = request.form['nome_equipamento']
         descricao = request.form['descricao_equipamento']
         quantidade = request.form['quantidade_estoque']
-        database.adicionar_equipamento(nome, descricao, quantidade)
+        estoque_minimo = request.form.get('estoque_minimo', 0, type=int)
+        database.adicionar_equipamento(nome, descricao, quantidade, estoque_minimo)
         flash(f"Equipamento '{nome}' cadastrado com sucesso!", 'success')
         return redirect(url_for('listar_equipamentos'))
     return render_template('adicionar_equipamento.html', active_page='equipamentos')
@@ -81,7 +209,8 @@ def editar_equipamento(id_equipamento):
         nome = request.form['nome_equipamento']
         descricao = request.form['descricao_equipamento']
         quantidade = request.form['quantidade_estoque']
-        database.atualizar_equipamento(id_equipamento, nome, descricao, quantidade)
+        estoque_minimo = request.form.get('estoque_minimo', type=int)
+        database.atualizar_equipamento(id_equipamento, nome, descricao, quantidade, estoque_minimo)
         flash('Equipamento atualizado com sucesso!', 'success')
         return redirect(url_for('listar_equipamentos'))
     return render_template('editar_equipamento.html', equipamento=equipamento, active_page='equipamentos')
@@ -101,13 +230,23 @@ def excluir_equipamento_rota(id_equipamento):
     return redirect(url_for('listar_equipamentos'))
 
 @app.route('/usuarios')
-@login_required
+@nivel_requerido('Administrador')
+@paginas.condicional('usuarios')
 def listar_usuarios():
-    lista_de_usuarios = database.listar_usuarios()
-    return render_template('usuarios.html', usuarios=lista_de_usuarios, active_page='usuarios')
+    nome = request.args.get('nome', '').strip()
+    nivel_acesso = request.args.get('nivel_acesso') or None
+
+    def carregar():
+        apos, limite = parametros_paginacao()
+        lista_de_usuarios = database.listar_usuarios(prefixo=nome, nivel_acesso=nivel_acesso, apos=apos, limite=limite)
+        cursor = database.proximo_cursor(lista_de_usuarios, limite, 'nome_usuario', 'id_usuario')
+        return {'usuarios': lista_de_usuarios, 'proximo_cursor': cursor}
+    tabela = paginas.fragmento('_tabela_usuarios.html', ('usuarios',), carregar)
+    return render_template('usuarios.html', tabela=tabela, nome=nome, nivel_acesso=nivel_acesso,
+                           active_page='usuarios')
 
 @app.route('/usuarios/novo', methods=['GET', 'POST'])
-@login_required
+@nivel_requerido('Administrador')
 def novo_usuario():
     if request.method == 'POST':
         nome = request.form['nome_usuario']
@@ -115,13 +254,17 @@ def novo_usuario():
         senha = request.form['senha']
         cargo = request.form['cargo']
         nivel_acesso = request.form['nivel_acesso']
-        database.adicionar_usuario(nome, email, senha, cargo, nivel_acesso)
+        try:
+            database.adicionar_usuario(nome, email, senha, cargo, nivel_acesso)
+        except senhas.FilaSenhasCheia:
+            flash('Servidor ocupado. Tente novamente em instantes.', 'warning')
+            return render_template('adicionar_usuario.html', active_page='usuarios'), 503
         flash(f"Usuário '{nome}' cadastrado com sucesso!", 'success')
         return redirect(url_for('listar_usuarios'))
     return render_template('adicionar_usuario.html', active_page='usuarios')
 
 @app.route('/usuarios/editar/<int:id_usuario>', methods=['GET', 'POST'])
-@login_required
+@nivel_requerido('Administrador')
 def editar_usuario(id_usuario):
     usuario = database.obter_usuario_por_id(id_usuario)
     if not usuario:
@@ -133,13 +276,17 @@ def editar_usuario(id_usuario):
         senha = request.form['senha']
         cargo = request.form['cargo']
         nivel_acesso = request.form['nivel_acesso']
-        database.atualizar_usuario(id_usuario, nome, email, senha, cargo, nivel_acesso)
+        try:
+            database.atualizar_usuario(id_usuario, nome, email, senha, cargo, nivel_acesso)
+        except senhas.FilaSenhasCheia:
+            flash('Servidor ocupado. Tente novamente em instantes.', 'warning')
+            return render_template('editar_usuario.html', usuario=usuario, active_page='usuarios'), 503
         flash('Usuário atualizado com sucesso!', 'success')
         return redirect(url_for('listar_usuarios'))
     return render_template('editar_usuario.html', usuario=usuario, active_page='usuarios')
 
 @app.route('/usuarios/excluir/<int:id_usuario>', methods=['POST'])
-@login_required
+@nivel_requerido('Administrador')
 def excluir_usuario_rota(id_usuario):
     sucesso = database.excluir_usuario(id_usuario)
     if sucesso:
@@ -151,8 +298,22 @@ def excluir_usuario_rota(id_usuario):
 @app.route('/movimentacoes')
 @login_required
 def listar_movimentacoes():
-    movimentacoes_abertas = database.listar_movimentacoes_abertas()
-    return render_template('movimentacoes.html', movimentacoes=movimentacoes_abertas, active_page='movimentacoes')
+    apos, limite = parametros_paginacao()
+    data_inicio = request.args.get('data_inicio') or None
+    data_fim = request.args.get('data_fim') or None
+    movimentacoes_abertas = database.listar_movimentacoes_abertas(data_inicio, data_fim, apos=apos, limite=limite)
+    cursor = database.proximo_cursor(movimentacoes_abertas, limite, 'data_retirada', 'id_movimentacao')
+    return render_template('movimentacoes.html', movimentacoes=movimentacoes_abertas,
+                           data_inicio=data_inicio, data_fim=data_fim,
+                           proximo_cursor=cursor, active_page='movimentacoes')
+
+@app.route('/eventos')
+@login_required
+def fluxo_eventos():
+    # Sem stream_with_context: o fluxo fica aberto por horas e não deve prender o escopo do banco.
+    ultimo_id = eventos.ultimo_id_da_requisicao(request.headers.get('Last-Event-ID'))
+    return Response(eventos.fluxo(ultimo_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/movimentacoes/retirada', methods=['GET', 'POST'])
 @login_required
@@ -162,17 +323,18 @@ def registrar_retirada():
         id_usuario = request.form['id_usuario']
         id_cliente = request.form['id_cliente']
         observacao = request.form['observacao']
-        total_registrado = 0
-        for id_equipamento in ids_equipamentos:
-            quantidade = 1 
-            equipamento = database.obter_equipamento_por_id(id_equipamento)
-            if equipamento and equipamento['quantidade_estoque'] >= quantidade:
-                database.registrar_retirada(id_equipamento, id_usuario, id_cliente, quantidade, observacao)
-                total_registrado += 1
-            else:
-                flash(f"Não foi possível registrar '{equipamento['nome_equipamento']}' por falta de estoque.", 'warning')
-        if total_registrado > 0:
-            flash(f'{total_registrado} equipamento(s) registrado(s) com sucesso!', 'success')
+        if database.obter_configuracao()['tarefas_em_segundo_plano']:
+            # A retirada vira uma tarefa; a página da tarefa mostra o resultado quando o trabalhador terminar.
+            id_tarefa = tarefas.enfileirar('retiradas', {'ids_equipamentos': ids_equipamentos, 'id_usuario': id_usuario,
+                                                         'id_cliente': id_cliente, 'observacao': observacao},
+                                           tarefas.PRIORIDADE_INTERATIVA, session['user_id'])
+            if id_tarefa is None:
+                flash('Erro ao registrar a retirada. Nenhum equipamento foi registrado.', 'danger')
+                return redirect(url_for('listar_movimentacoes'))
+            return redirect(url_for('tarefa_detalhe', id_tarefa=id_tarefa))
+        resultados = database.registrar_retiradas_em_lote(ids_equipamentos, id_usuario, id_cliente, observacao)
+        for mensagem, categoria in mensagens_retirada(resultados):
+            flash(mensagem, categoria)
         return redirect(url_for('listar_movimentacoes'))
     equipamentos = database.listar_equipamentos()
     usuarios = database.listar_usuarios()
@@ -183,18 +345,107 @@ def registrar_retirada():
                            clientes=clientes,
                            active_page='movimentacoes')
 
+def mensagens_retirada(resultados):
+    mensagens = []
+    total_registrado = 0
+    for resultado in resultados:
+        if resultado['registrado']:
+            total_registrado += 1
+        elif resultado['motivo'] == 'sem_estoque':
+            mensagens.append((f"Não foi possível registrar '{resultado['nome_equipamento']}' por falta de estoque.", 'warning'))
+        elif resultado['motivo'] == 'nao_encontrado':
+            mensagens.append((f"Equipamento {resultado['id_equipamento']} não encontrado ou inativo.", 'warning'))
+        else:
+            mensagens.append(('Erro ao registrar a retirada. Nenhum equipamento foi registrado.', 'danger'))
+            break
+    if total_registrado > 0:
+        mensagens.append((f'{total_registrado} equipamento(s) registrado(s) com sucesso!', 'success'))
+    return mensagens
+
+def obter_tarefa_permitida(id_tarefa):
+    # Cada usuário vê as próprias tarefas; o administrador vê todas.
+    tarefa = database.obter_tarefa(id_tarefa)
+    if tarefa is None or (session.get('nivel_acesso') != 'Administrador' and tarefa['id_usuario'] != session['user_id']):
+        abort(404)
+    return tarefa
+
+@app.route('/tarefas/<int:id_tarefa>')
+@login_required
+def tarefa_detalhe(id_tarefa):
+    tarefa = tarefas.serializavel(obter_tarefa_permitida(id_tarefa))
+    mensagens = []
+    if tarefa['tipo'] == 'retiradas' and tarefa['estado'] == 'concluida':
+        mensagens = mensagens_retirada(tarefa['resultado'])
+    return render_template('tarefa.html', tarefa=tarefa, mensagens=mensagens, active_page='movimentacoes')
+
+@app.route('/api/tarefas/<int:id_tarefa>')
+@login_required
+def api_tarefa(id_tarefa):
+    return jsonify(tarefas.serializavel(obter_tarefa_permitida(id_tarefa)))
+
+@app.route('/api/tarefas', methods=['GET', 'POST'])
+@nivel_requerido('Administrador')
+def api_tarefas():
+    if request.method == 'POST':
+        dados = request.get_json(silent=True) or {}
+        try:
+            id_tarefa = tarefas.enfileirar(dados.get('tipo'), dados.get('argumentos') or {},
+                                           int(dados.get('prioridade', tarefas.PRIORIDADE_MANUTENCAO)), session['user_id'])
+        except (tarefas.ErroTarefa, TypeError, ValueError) as e:
+            return jsonify({'erro': str(e)}), 400
+        if id_tarefa is None:
+            return jsonify({'erro': 'Não foi possível enfileirar a tarefa.'}), 503
+        return jsonify({'id_tarefa': id_tarefa}), 202, {'Location': url_for('api_tarefa', id_tarefa=id_tarefa)}
+    estado = request.args.get('estado', 'pendente')
+    limite = request.args.get('limite', database.TAMANHO_PAGINA_PADRAO, type=int)
+    return jsonify([tarefas.serializavel(tarefa) for tarefa in database.listar_tarefas(estado, limite)])
+
+def momento_do_parametro(nome):
+    # Aceita data (AAAA-MM-DD) ou data e hora ISO; devolve segundos desde 1970.
+    texto = request.args.get(nome)
+    if not texto:
+        return None
+    try:
+        return datetime.fromisoformat(texto).timestamp()
+    except ValueError:
+        abort(400)
+
+@app.route('/api/auditoria')
+@nivel_requerido('Administrador')
+def api_auditoria():
+    tabela = request.args.get('tabela') or None
+    if tabela and tabela not in database.TABELAS_AUDITADAS:
+        abort(404)
+    limite = database.limitar_pagina(request.args.get('limite', database.TAMANHO_PAGINA_PADRAO, type=int))
+    registros = database.listar_auditoria(
+        tabela, request.args.get('id_registro', type=int), request.args.get('id_usuario', type=int),
+        momento_do_parametro('inicio'), momento_do_parametro('fim'),
+        database.decodificar_cursor(request.args.get('cursor')), limite)
+    return jsonify({'registros': [auditoria.serializavel(registro) for registro in registros],
+                    'proximo_cursor': database.proximo_cursor(registros, limite, 'momento', 'id_auditoria')})
+
 @app.route('/movimentacoes/devolver/<int:id_movimentacao>', methods=['POST'])
 @login_required
 def registrar_devolucao_rota(id_movimentacao):
-    database.registrar_devolucao(id_movimentacao)
-    flash('Devolução registrada com sucesso!', 'success')
+    if database.registrar_devolucao(id_movimentacao):
+        flash('Devolução registrada com sucesso!', 'success')
+    else:
+        flash('Movimentação não encontrada ou já devolvida.', 'warning')
     return redirect(url_for('listar_movimentacoes'))
 
 @app.route('/clientes')
 @login_required
+@paginas.condicional('clientes')
 def listar_clientes():
-    lista_de_clientes = database.listar_clientes()
-    return render_template('clientes.html', clientes=lista_de_clientes, active_page='clientes')
+    nome = request.args.get('nome', '').strip()
+
+    def carregar():
+        apos, limite = parametros_paginacao()
+        lista_de_clientes = database.listar_clientes(prefixo=nome, apos=apos, limite=limite)
+        cursor = database.proximo_cursor(lista_de_clientes, limite, 'nome_cliente', 'id_cliente')
+        return {'clientes': lista_de_clientes, 'proximo_cursor': cursor}
+    tabela = paginas.fragmento('_tabela_clientes.html', ('clientes',), carregar)
+    return render_template('clientes.html', tabela=tabela, nome=nome, active_page='clientes')
 
 @app.route('/clientes/novo', methods=['GET', 'POST'])
 @login_required
@@ -211,8 +462,251 @@ def novo_cliente():
 @login_required
 def cliente_detalhe(id_cliente):
     cliente = database.obter_cliente_por_id(id_cliente)
-    movimentacoes = database.listar_movimentacoes_por_cliente(id_cliente)
-    return render_template('cliente_detalhe.html', cliente=cliente, movimentacoes=movimentacoes, active_page='clientes')
+    limite = database.TAMANHO_PAGINA_PADRAO
+    movimentacoes = database.listar_movimentacoes_por_cliente(id_cliente, limite=limite)
+    return render_template('cliente_detalhe.html', cliente=cliente, movimentacoes=movimentacoes,
+                           limite=limite, active_page='clientes')
+
+@app.route('/busca')
+@login_required
+def busca():
+    termo = request.args.get('q', '').strip()
+    pagina = max(1, request.args.get('pagina', 1, type=int))
+    resultados = {tipo: database.buscar(tipo, termo, pagina, limite=20) for tipo in database.SQL_BUSCA}
+    return render_template('busca.html', termo=termo, pagina=pagina, resultados=resultados, active_page='busca')
+
+@app.route('/api/busca')
+@login_required
+def api_busca():
+    termo = request.args.get('q', '').strip()
+    pagina = max(1, request.args.get('pagina', 1, type=int))
+    limite = request.args.get('limite', 10, type=int)
+    tipo = request.args.get('tipo')
+    if tipo and tipo not in database.SQL_BUSCA:
+        abort(404)
+    tipos = [tipo] if tipo else list(database.SQL_BUSCA)
+    return jsonify({t: database.buscar(t, termo, pagina, limite) for t in tipos})
+
+def painel_relatorios():
+    # Leitura pura: serve o que já foi consolidado; o resto fica para a tarefa
+    # atualizar_relatorios (fila ou flask atualizar-relatorios).
+    limite = database.limitar_pagina(request.args.get('limite', relatorios.LIMITE_PADRAO, type=int))
+    return relatorios.montar_painel(request.args.get('data_inicio') or None, request.args.get('data_fim') or None,
+                                    limite)
+
+@app.route('/relatorios')
+@login_required
+def relatorios_pagina():
+    return render_template('relatorios.html', painel=painel_relatorios(), active_page='relatorios')
+
+@app.route('/api/relatorios')
+@app.route('/api/relatorios/<secao>')
+@login_required
+def api_relatorios(secao=None):
+    painel = painel_relatorios()
+    if secao is not None:
+        if secao not in painel:
+            abort(404)
+        painel = {secao: painel[secao]}
+    return jsonify(relatorios.serializavel(painel))
+
+@app.route('/importar', methods=['GET', 'POST'])
+@nivel_requerido('Administrador')
+def importar():
+    tipo = request.values.get('tipo', 'equipamentos')
+    if tipo not in importacao.TIPOS:
+        abort(404)
+    relatorio = None
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename:
+            flash('Selecione um arquivo CSV.', 'warning')
+        else:
+            relatorio = importacao.importar_csv(arquivo.stream, tipo)
+            if relatorio['ja_concluida']:
+                flash('Este arquivo já foi importado anteriormente.', 'info')
+            else:
+                flash(f"{relatorio['importadas']} registro(s) importado(s) "
+                      f"({relatorio['linhas_por_segundo']:.0f} linhas/s).", 'success')
+    return render_template('importar.html', tipo=tipo, tipos=importacao.TIPOS, relatorio=relatorio,
+                           active_page=tipo)
+
+@app.route('/exportar/movimentacoes.<formato>')
+@login_required
+def exportar_movimentacoes(formato):
+    if formato not in exportacao.FORMATOS:
+        abort(404)
+    filtros = {
+        'id_cliente': request.args.get('id_cliente', type=int),
+        'id_equipamento': request.args.get('id_equipamento', type=int),
+        'data_inicio': request.args.get('data_inicio') or None,
+        'data_fim': request.args.get('data_fim') or None,
+    }
+    _, tipo_conteudo = exportacao.FORMATOS[formato]
+    return Response(stream_with_context(exportacao.exportar_movimentacoes(formato, **filtros)),
+                    content_type=tipo_conteudo,
+                    headers={'Content-Disposition': f'attachment; filename=movimentacoes.{formato}'})
+
+@app.cli.command('reconciliar-estatisticas')
+@click.option('--somente-verificar', is_flag=True, help='Apenas relata as divergências, sem corrigir.')
+def reconciliar_estatisticas_comando(somente_verificar):
+    divergencias = database.reconciliar_estatisticas(corrigir=not somente_verificar)
+    if not divergencias:
+        click.echo('Contadores do dashboard consistentes.')
+        return
+    for chave, valores in divergencias.items():
+        click.echo(f"{chave}: armazenado={valores['armazenado']} calculado={valores['calculado']}")
+    if not somente_verificar:
+        click.echo('Contadores corrigidos.')
+
+@app.cli.command('snapshot-estoque')
+@click.option('--somente-verificar', is_flag=True, help='Não lança ajustes para as divergências encontradas.')
+@click.option('--manter', type=int, help='Remove snapshots antigos, mantendo os N mais recentes.')
+def snapshot_estoque_comando(somente_verificar, manter):
+    resultado = database.criar_snapshot_estoque(corrigir=not somente_verificar)
+    for id_equipamento, valores in resultado['divergencias'].items():
+        click.echo(f"Equipamento {id_equipamento}: razão={valores['razao']} estoque={valores['estoque']}")
+    click.echo(f"Snapshot de {resultado['data']} com {resultado['equipamentos']} equipamento(s).")
+    if manter:
+        click.echo(f"{database.podar_snapshots_estoque(manter)} linha(s) de snapshots antigos removida(s).")
+
+@app.cli.command('estoque-em')
+@click.argument('momento')
+@click.option('--equipamento', 'id_equipamento', type=int)
+def estoque_em_comando(momento, id_equipamento):
+    if id_equipamento is not None:
+        click.echo(database.obter_estoque_equipamento_em(id_equipamento, momento))
+        return
+    for item in database.obter_estoque_em(momento):
+        click.echo(f"{item.id_equipamento}\t{item.quantidade}\t{item.nome_equipamento}")
+
+@app.cli.command('atualizar-relatorios')
+def atualizar_relatorios_comando():
+    inicio = time.perf_counter()
+    avanco = relatorios.atualizar()
+    click.echo(f"{avanco} lançamento(s) processado(s) em {time.perf_counter() - inicio:.2f}s.")
+
+@app.cli.command('arquivar-movimentacoes')
+@click.option('--dias', 'horizonte_dias', type=int, help='Arquiva as devolvidas há mais de N dias (padrão: ARCHIVE_AFTER_DAYS).')
+@click.option('--lote', 'tamanho_lote', type=int, help='Movimentações por transação (padrão: ARCHIVE_BATCH_SIZE).')
+def arquivar_movimentacoes_comando(horizonte_dias, tamanho_lote):
+    relatorio = arquivamento.arquivar(horizonte_dias, tamanho_lote)
+    click.echo(f"Arquivadas: {relatorio['arquivadas']} em {relatorio['lotes']} lote(s), {relatorio['segundos']:.2f}s")
+    for particao in relatorio['particoes']:
+        click.echo(f"{particao.tabela}: {particao.linhas} linha(s)")
+
+@app.cli.command('backup')
+def backup_comando():
+    manifesto = backup.criar_snapshot()
+    click.echo(f"Snapshot {manifesto['nome']}: {manifesto['tamanho']} bytes em {manifesto['segundos']:.2f}s "
+               f"({manifesto['bytes_por_segundo'] / 1024 / 1024:.1f} MiB/s)")
+    click.echo(f"Blocos novos: {manifesto['blocos_novos']} de {len(manifesto['blocos'])} ({manifesto['bytes_novos']} bytes)")
+    if manifesto['removidos']:
+        click.echo(f"{manifesto['removidos']} snapshot(s) antigo(s) removido(s).")
+
+@app.cli.command('listar-backups')
+def listar_backups_comando():
+    for manifesto in backup.listar_snapshots():
+        click.echo(f"{manifesto['nome']}\t{manifesto['tamanho']}\t{manifesto['sha256'][:16]}")
+
+@app.cli.command('verificar-backup')
+@click.argument('nome', required=False)
+@click.option('--completo', is_flag=True, help='Também roda o integrity_check na cópia remontada.')
+def verificar_backup_comando(nome, completo):
+    try:
+        manifesto = backup.verificar(nome, completo)
+    except backup.ErroBackup as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Snapshot {manifesto['nome']} íntegro.")
+
+@app.cli.command('restaurar-backup')
+@click.argument('nome', required=False)
+@click.option('--destino', help='Grava o snapshot neste arquivo em vez de substituir o banco em uso.')
+def restaurar_backup_comando(nome, destino):
+    if destino is None:
+        click.confirm('Substituir o conteúdo do banco em uso pelo snapshot?', abort=True)
+    try:
+        manifesto = backup.restaurar(nome, destino)
+    except backup.ErroBackup as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Snapshot {manifesto['nome']} restaurado.")
+
+@app.cli.command('trabalhador')
+@click.option('--processos', type=int, help='Processos trabalhadores (padrão: JOBS_WORKERS).')
+def trabalhador_comando(processos):
+    tarefas.iniciar_trabalhadores(processos)
+
+@app.cli.command('enfileirar-tarefa')
+@click.argument('tipo', type=click.Choice(sorted(tarefas.TIPOS)))
+@click.option('--argumentos', default='{}', help='Argumentos da tarefa em JSON.')
+@click.option('--prioridade', type=int, default=tarefas.PRIORIDADE_MANUTENCAO)
+def enfileirar_tarefa_comando(tipo, argumentos, prioridade):
+    id_tarefa = tarefas.enfileirar(tipo, json.loads(argumentos), prioridade)
+    click.echo(f"Tarefa {id_tarefa} enfileirada.")
+
+@app.cli.command('limpar-tarefas')
+def limpar_tarefas_comando():
+    retencao = database.obter_configuracao()['tarefas_retencao_horas'] * 3600
+    removidas = database.limpar_tarefas_encerradas(time.time() - retencao)
+    click.echo(f'{removidas} tarefa(s) encerrada(s) removida(s).')
+
+@app.cli.command('auditoria')
+@click.option('--tabela', type=click.Choice(sorted(database.TABELAS_AUDITADAS)))
+@click.option('--id', 'id_registro', type=int, help='Id do registro na tabela (exige --tabela).')
+@click.option('--usuario', 'id_usuario', type=int)
+@click.option('--inicio', type=click.DateTime(), help='A partir de (AAAA-MM-DD[ HH:MM:SS]).')
+@click.option('--fim', type=click.DateTime(), help='Antes de (AAAA-MM-DD[ HH:MM:SS]).')
+@click.option('--limite', type=int, default=50)
+def auditoria_comando(tabela, id_registro, id_usuario, inicio, fim, limite):
+    registros = database.listar_auditoria(tabela, id_registro, id_usuario, inicio and inicio.timestamp(),
+                                          fim and fim.timestamp(), limite=limite)
+    for registro in registros:
+        momento = datetime.fromtimestamp(registro['momento']).strftime('%d/%m/%Y %H:%M:%S')
+        click.echo(f"{momento}\t{registro['id_usuario'] or '-'}\t{registro['tabela']}:{registro['id_registro']}\t"
+                   f"{registro['acao']}\t{registro['antes'] or ''} -> {registro['depois'] or ''}")
+
+@app.cli.command('limpar-sessoes')
+def limpar_sessoes_comando():
+    removidas = database.limpar_sessoes_expiradas(time.time())
+    click.echo(f'{removidas} sessão(ões) expirada(s) removida(s).')
+
+@app.cli.command('limpar-requisicoes')
+def limpar_requisicoes_comando():
+    validade = database.obter_configuracao()['validade_requisicoes_horas'] * 3600
+    removidas = database.limpar_requisicoes_expiradas(time.time() - validade)
+    click.echo(f'{removidas} requisição(ões) idempotente(s) expirada(s) removida(s).')
+
+@app.cli.command('limpar-eventos')
+def limpar_eventos_comando():
+    retencao = database.obter_configuracao()['eventos_retencao_horas'] * 3600
+    removidos = database.limpar_eventos(time.time() - retencao)
+    click.echo(f'{removidos} evento(s) antigo(s) removido(s).')
+
+@app.cli.command('exportar-movimentacoes')
+@click.option('--formato', type=click.Choice(sorted(exportacao.FORMATOS)), default='csv')
+@click.option('--saida', type=click.File('w', encoding='utf-8'), default='-', help='Arquivo de saída (padrão: stdout).')
+@click.option('--cliente', 'id_cliente', type=int)
+@click.option('--equipamento', 'id_equipamento', type=int)
+@click.option('--inicio', 'data_inicio', help='Data inicial da retirada (AAAA-MM-DD).')
+@click.option('--fim', 'data_fim', help='Data final da retirada (AAAA-MM-DD).')
+def exportar_movimentacoes_comando(formato, saida, **filtros):
+    for trecho in exportacao.exportar_movimentacoes(formato, **filtros):
+        saida.write(trecho)
+
+@app.cli.command('importar')
+@click.argument('tipo', type=click.Choice(sorted(importacao.TIPOS)))
+@click.argument('arquivo', type=click.File('rb'))
+@click.option('--lote', 'tamanho_lote', type=int, help='Linhas por transação (padrão: IMPORT_BATCH_SIZE).')
+def importar_comando(tipo, arquivo, tamanho_lote):
+    relatorio = importacao.importar_csv(arquivo, tipo, tamanho_lote)
+    if relatorio['ja_concluida']:
+        click.echo('Arquivo já importado anteriormente; nada a fazer.')
+        return
+    for erro in relatorio['erros']:
+        click.echo(f"Linha {erro['linha']}: {erro['erro']}", err=True)
+    click.echo(f"Importadas: {relatorio['importadas']}  Ignoradas (já importadas): {relatorio['ignoradas']}  "
+               f"Com erro: {relatorio['com_erro']}")
+    click.echo(f"Tempo: {relatorio['segundos']:.2f}s  ({relatorio['linhas_por_segundo']:.0f} linhas/s)")
 
 if __name__ == '__main__': 
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+import db as database
+import relatorios
+
+def arquivar(horizonte_dias=None, tamanho_lote=None, pausa=None, maximo_lotes=None):
+    config = database.obter_configuracao()
+    horizonte_dias = config['arquivar_apos_dias'] if horizonte_dias is None else horizonte_dias
+    tamanho_lote = tamanho_lote or config['tamanho_lote_arquivamento']
+    pausa = config['pausa_arquivamento'] if pausa is None else pausa
+    relatorio = {'arquivadas': 0, 'lotes': 0, 'segundos': 0.0, 'particoes': []}
+    inicio = time.perf_counter()
+
+    # Os relatórios buscam cliente e data de retirada em movimentacoes. O limite é fixado antes
+    # da atualização, então toda devolução que será arquivada já entra nos totais.
+    limite = str(database.obter_hora_atual() - timedelta(days=horizonte_dias))
+    relatorios.atualizar()
+    while maximo_lotes is None or relatorio['lotes'] < maximo_lotes:
+        movidas = database.arquivar_lote_movimentacoes(limite, tamanho_lote)
+        if not movidas:
+            break
+        relatorio['arquivadas'] += movidas
+        relatorio['lotes'] += 1
+        if movidas == tamanho_lote and pausa:
+            # Entre um lote e outro a trava de escrita fica livre para as requisições.
+            time.sleep(pausa)
+
+    relatorio['segundos'] = time.perf_counter() - inicio
+    relatorio['particoes'] = database.listar_particoes_arquivo()
+    return relatorio
@@ -0,0 +1,231 @@
+# Modo de serviço assíncrono (ASGI). Requer asgiref e um servidor ASGI:
+#
+#     pip install asgiref uvicorn
+#     uvicorn asgi:aplicacao --host 0.0.0.0 --port 5000
+#
+# As rotas de retirada e devolução usadas pelos coletores são atendidas direto
+# no event loop, com o banco acessado via db_async; conexões ociosas não ocupam
+# nenhuma thread. O restante das páginas continua sendo o app Flask, executado
+# pelo adaptador WSGI do asgiref.
+#
+# Os lotes aceitam um id de requisição (campo "id_requisicao" ou cabeçalho
+# Idempotency-Key): reenviar o mesmo lote devolve a resposta original.
+#
+#     POST /api/retiradas    {"id_equipamentos": [3, 7], "id_cliente": 2, "id_requisicao": "c1-0042"}
+#     POST /api/devolucoes   {"id_movimentacoes": [120, 121, 125], "id_requisicao": "c1-0043"}
+#
+# O fluxo de eventos ao vivo (GET /eventos) também fica no event loop: cada
+# painel aberto é só uma tarefa esperando o próximo lote do difusor.
+
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+
+from asgiref.wsgi import WsgiToAsgi
+
+import db as database
+import db_async
+import eventos
+import sessoes
+from app import app
+
+TAMANHO_MAXIMO_CORPO = 1024 * 1024
+MAXIMO_ITENS_LOTE = 1000
+TAMANHO_MAXIMO_CHAVE = 200
+
+aplicacao_flask = WsgiToAsgi(app)
+
+async def _usuario_da_sessao(scope):
+    # Usa o mesmo cookie de sessão que o Flask grava no login (ver sessoes.py).
+    cabecalhos = dict(scope.get('headers') or [])
+    cookies = SimpleCookie()
+    try:
+        cookies.load(cabecalhos.get(b'cookie', b'').decode('latin-1'))
+    except Exception:
+        return None
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    return await db_async.executar(sessoes.usuario_da_sessao, morsel.value)
+
+async def _ler_json(receive):
+    corpo = b''
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return None
+        corpo += mensagem.get('body', b'')
+        if len(corpo) > TAMANHO_MAXIMO_CORPO:
+            raise ValueError("Corpo da requisição muito grande.")
+        if not mensagem.get('more_body'):
+            break
+    if not corpo:
+        return {}
+    try:
+        return json.loads(corpo)
+    except ValueError:
+        raise ValueError("JSON inválido.")
+
+async def _responder(send, status, dados):
+    corpo = json.dumps(dados, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                    (b'content-length', str(len(corpo)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': corpo})
+
+def _eh_json(scope):
+    # Um formulário de outro site só consegue enviar text/plain, form-urlencoded ou multipart sem
+    # passar pelo preflight de CORS; exigir application/json fecha essas rotas para CSRF.
+    tipo = dict(scope.get('headers') or []).get(b'content-type', b'')
+    return tipo.split(b';')[0].strip().lower() == b'application/json'
+
+def _validar_lote(dados, campo):
+    itens = dados.get(campo)
+    if not isinstance(itens, list) or not itens:
+        return f'Informe {campo} (lista).'
+    if len(itens) > MAXIMO_ITENS_LOTE:
+        return f'No máximo {MAXIMO_ITENS_LOTE} itens por lote.'
+    chave = dados.get('id_requisicao')
+    if chave is not None and (not isinstance(chave, str) or not chave or len(chave) > TAMANHO_MAXIMO_CHAVE):
+        return f'id_requisicao deve ser um texto de até {TAMANHO_MAXIMO_CHAVE} caracteres.'
+    return None
+
+async def api_retiradas(id_usuario, dados):
+    erro = _validar_lote(dados, 'id_equipamentos')
+    if erro or dados.get('id_cliente') is None:
+        return 400, {'erro': erro or 'Informe id_equipamentos (lista) e id_cliente.'}
+    quantidade = dados.get('quantidade', 1)
+    if not isinstance(quantidade, int) or quantidade < 1:
+        return 400, {'erro': 'quantidade deve ser um inteiro positivo.'}
+    try:
+        resultados = await db_async.registrar_retiradas_em_lote(
+            dados['id_equipamentos'], id_usuario, dados['id_cliente'], dados.get('observacao') or '', quantidade,
+            chave=dados.get('id_requisicao'))
+    except database.ErroChaveIdempotencia as e:
+        return 409, {'erro': str(e)}
+    if any(resultado['motivo'] == 'erro' for resultado in resultados):
+        return 500, {'erro': 'Erro ao registrar a retirada. Nenhum equipamento foi registrado.'}
+    return 200, {
+        'registrados': sum(1 for resultado in resultados if resultado['registrado']),
+        'resultados': resultados,
+    }
+
+async def api_devolucoes(id_usuario, dados):
+    erro = _validar_lote(dados, 'id_movimentacoes')
+    if erro:
+        return 400, {'erro': erro}
+    try:
+        resultados = await db_async.registrar_devolucoes_em_lote(
+            dados['id_movimentacoes'], id_usuario, chave=dados.get('id_requisicao'))
+    except database.ErroChaveIdempotencia as e:
+        return 409, {'erro': str(e)}
+    if any(resultado['motivo'] == 'erro' for resultado in resultados):
+        return 500, {'erro': 'Erro ao registrar a devolução. Nenhuma movimentação foi devolvida.'}
+    return 200, {
+        'devolvidas': sum(1 for resultado in resultados if resultado['devolvida']),
+        'resultados': resultados,
+    }
+
+async def api_devolucao(id_usuario, dados, id_movimentacao):
+    resultado = (await db_async.registrar_devolucoes_em_lote([int(id_movimentacao)], id_usuario))[0]
+    if resultado['motivo'] == 'ja_devolvida':
+        return 409, {'erro': f'Movimentação {id_movimentacao} já foi devolvida.'}
+    if resultado['motivo'] == 'nao_encontrada':
+        return 404, {'erro': f'Movimentação {id_movimentacao} não encontrada.'}
+    if not resultado['devolvida']:
+        return 500, {'erro': 'Erro ao registrar a devolução.'}
+    return 200, {'id_movimentacao': int(id_movimentacao), 'devolvida': True}
+
+ROTAS_ASSINCRONAS = [
+    ('POST', re.compile(r'^/api/retiradas$'), api_retiradas),
+    ('POST', re.compile(r'^/api/devolucoes$'), api_devolucoes),
+    ('POST', re.compile(r'^/api/devolucoes/(\d+)$'), api_devolucao),
+]
+
+async def _aguardar_desconexao(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _transmitir_eventos(scope, receive, send):
+    if await _usuario_da_sessao(scope) is None:
+        return await _responder(send, 401, {'erro': 'Faça login para acessar a API.'})
+    cabecalhos = dict(scope.get('headers') or [])
+    ultimo_id = eventos.ultimo_id_da_requisicao(cabecalhos.get(b'last-event-id', b'').decode('latin-1'))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')],
+    })
+    desconexao = asyncio.ensure_future(_aguardar_desconexao(receive))
+    fluxo = eventos.fluxo_assincrono(ultimo_id)
+    try:
+        while True:
+            proximo = asyncio.ensure_future(fluxo.__anext__())
+            await asyncio.wait({proximo, desconexao}, return_when=asyncio.FIRST_COMPLETED)
+            if desconexao.done():
+                # O gerador só pode ser fechado depois que a espera em andamento terminar.
+                proximo.cancel()
+                await asyncio.gather(proximo, return_exceptions=True)
+                return
+            try:
+                pedaco = proximo.result()
+            except StopAsyncIteration:
+                break
+            await send({'type': 'http.response.body', 'body': pedaco.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        desconexao.cancel()
+        await fluxo.aclose()
+
+async def _tratar_ciclo_de_vida(receive, send):
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            db_async.obter_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            db_async.encerrar_executor()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def aplicacao(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _tratar_ciclo_de_vida(receive, send)
+    if scope['type'] == 'http':
+        if scope['path'] == '/eventos' and scope['method'] == 'GET':
+            return await _transmitir_eventos(scope, receive, send)
+        for metodo, padrao, rota in ROTAS_ASSINCRONAS:
+            encontrada = padrao.match(scope['path'])
+            if not encontrada:
+                continue
+            if scope['method'] != metodo:
+                return await _responder(send, 405, {'erro': 'Método não permitido.'})
+            id_usuario = await _usuario_da_sessao(scope)
+            if id_usuario is None:
+                return await _responder(send, 401, {'erro': 'Faça login para acessar a API.'})
+            if not _eh_json(scope):
+                return await _responder(send, 415, {'erro': 'Envie o corpo como application/json.'})
+            database.definir_usuario_atual(id_usuario)
+            try:
+                dados = await _ler_json(receive)
+            except ValueError as e:
+                return await _responder(send, 400, {'erro': str(e)})
+            if dados is None:
+                return
+            if not isinstance(dados, dict):
+                return await _responder(send, 400, {'erro': 'O corpo deve ser um objeto JSON.'})
+            chave = dict(scope.get('headers') or []).get(b'idempotency-key')
+            if chave:
+                dados.setdefault('id_requisicao', chave.decode('latin-1'))
+            status, resposta = await rota(id_usuario, dados, *encontrada.groups())
+            return await _responder(send, status, resposta)
+    return await aplicacao_flask(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(aplicacao, host="0.0.0.0", port=5000)
@@ -0,0 +1,145 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import db as database
+
+# Gravação adiada da trilha de auditoria. As alterações recolhidas pelo db.py ficam
+# num buffer em memória e vão para a tabela auditoria em lotes, numa transação por
+# lote, quando o buffer chega a AUDIT_BATCH_SIZE ou a cada AUDIT_FLUSH_INTERVAL
+# segundos. Uma escrita da aplicação não espera por isso.
+#
+# Limite de perda: o buffer nunca passa de AUDIT_MAX_PENDING entradas. Ao chegar
+# nele, quem escreve tenta gravar o buffer antes de seguir; se o banco recusar os
+# lotes, as entradas mais antigas são descartadas e contadas em "descartadas".
+# Se o processo morrer sem encerrar (kill -9, falta de energia), perde-se o que
+# estava no buffer: com o banco saudável, as alterações do último intervalo; no
+# pior caso, AUDIT_MAX_PENDING entradas. No encerramento normal o buffer é
+# gravado pelo atexit.
+
+class Auditor:
+
+    def __init__(self, tamanho_lote=500, intervalo=1.0, maximo_pendentes=5000):
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.maximo_pendentes = maximo_pendentes
+        self._pendentes = []
+        self._trava = threading.Lock()
+        self._gravacao = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._contadores = {'registradas': 0, 'gravadas': 0, 'lotes': 0, 'falhas': 0, 'gravacoes_forcadas': 0,
+                            'descartadas': 0}
+
+    def _verificar_fork(self):
+        # Depois de um fork a thread não passa para o processo filho, e o buffer herdado é do pai
+        # (que o grava); o filho começa vazio.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pendentes = []
+            self._thread = None
+
+    def registrar(self, entradas):
+        with self._trava:
+            self._verificar_fork()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._acompanhar, name='auditoria', daemon=True)
+                self._thread.start()
+            self._pendentes.extend(entradas)
+            self._contadores['registradas'] += len(entradas)
+            cheio = len(self._pendentes) >= self.maximo_pendentes
+            if cheio:
+                self._contadores['gravacoes_forcadas'] += 1
+            total = len(self._pendentes)
+        if cheio and not self.descarregar():
+            with self._trava:
+                self._limitar()
+        elif total >= self.tamanho_lote:
+            self._acordar.set()
+
+    def _limitar(self):
+        # Chamado com self._trava: descarta as mais antigas além do limite.
+        excesso = len(self._pendentes) - self.maximo_pendentes
+        if excesso > 0:
+            del self._pendentes[:excesso]
+            self._contadores['descartadas'] += excesso
+
+    def descarregar(self):
+        # Grava tudo o que estiver no buffer, um lote por transação. Se o banco falhar, o lote
+        # volta para o começo do buffer e é tentado de novo na próxima vez.
+        with self._gravacao:
+            while True:
+                with self._trava:
+                    self._verificar_fork()
+                    lote = self._pendentes[:self.tamanho_lote]
+                    del self._pendentes[:self.tamanho_lote]
+                if not lote:
+                    return True
+                if not database.gravar_auditoria(lote):
+                    with self._trava:
+                        self._pendentes[:0] = lote
+                        self._contadores['falhas'] += 1
+                        self._limitar()
+                    return False
+                with self._trava:
+                    self._contadores['gravadas'] += len(lote)
+                    self._contadores['lotes'] += 1
+
+    def _acompanhar(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            if not self.descarregar():
+                # Banco indisponível: espera um intervalo inteiro antes de tentar de novo.
+                time.sleep(self.intervalo)
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self._contadores)
+            dados['pendentes'] = len(self._pendentes)
+        return dados
+
+_auditor = None
+_auditor_trava = threading.Lock()
+
+def obter_auditor():
+    global _auditor
+    if _auditor is None:
+        with _auditor_trava:
+            if _auditor is None:
+                config = database.obter_configuracao()
+                _auditor = Auditor(config['auditoria_lote'], config['auditoria_intervalo'],
+                                   config['auditoria_maximo_pendentes'])
+    return _auditor
+
+def ativar():
+    if not database.obter_configuracao()['auditoria_ativa']:
+        return None
+    auditor = obter_auditor()
+    database.definir_auditor(auditor)
+    atexit.register(auditor.descarregar)
+    return auditor
+
+def encerrar():
+    # Para processos que saem sem passar pelo atexit (ex.: filhos do multiprocessing).
+    if _auditor is not None:
+        _auditor.descarregar()
+
+def serializavel(registro):
+    dados = dict(zip(registro.keys(), registro))
+    for campo in ('antes', 'depois'):
+        if dados[campo] is not None:
+            dados[campo] = json.loads(dados[campo])
+    return dados
+
+def metricas():
+    if _auditor is None:
+        return []
+    dados = _auditor.estatisticas()
+    return [
+        ('controle_auditoria', 'Contadores da gravação adiada da auditoria.',
+         [({'tipo': chave}, valor) for chave, valor in sorted(dados.items())]),
+    ]
@@ -0,0 +1,254 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import db as database
+
+# Backup online do banco com a API de backup do SQLite: a cópia anda em passos de
+# poucas páginas com uma pausa entre eles, então as escritas continuam entre um passo
+# e outro. Em modo WAL a cópia lê um único snapshot do começo ao fim (uma transação de
+# leitura aberta na origem), sem bloquear quem escreve e sem recomeçar a cada escrita.
+#
+# Cada snapshot é guardado em blocos endereçados pelo sha256 do conteúdo; só os blocos
+# que mudaram desde o snapshot anterior são gravados. O manifesto do snapshot lista os
+# blocos em ordem, com o sha256 do arquivo inteiro para a verificação.
+#
+#   backups/blocos/ab/abcdef...     conteúdo dos blocos
+#   backups/snapshots/AAAAMMDD-HHMMSS.json
+#   backups/.trava                  trava entre processos (ver _travar)
+
+class ErroBackup(Exception):
+    pass
+
+def _pastas(pasta=None):
+    pasta = pasta or database.obter_configuracao()['backup_pasta']
+    return os.path.join(pasta, 'blocos'), os.path.join(pasta, 'snapshots')
+
+@contextmanager
+def _travar(snapshots, exclusiva):
+    # Quem grava blocos e manifestos (criar_snapshot) e quem apaga (aplicar_retencao) pega a trava
+    # exclusiva; quem só lê blocos (verificar, restaurar) pega a compartilhada. Sem ela a retenção
+    # de um processo apagaria os blocos que outro acabou de reaproveitar, antes do manifesto dele.
+    os.makedirs(snapshots, exist_ok=True)
+    with open(os.path.join(os.path.dirname(snapshots), '.trava'), 'a') as arquivo:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+
+def _caminho_bloco(blocos, resumo):
+    return os.path.join(blocos, resumo[:2], resumo)
+
+def _gravar_atomico(caminho, dados):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'wb') as arquivo:
+        arquivo.write(dados)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+
+def _copiar_online(caminho_origem, caminho_destino, paginas, pausa):
+    origem = sqlite3.connect(caminho_origem, isolation_level=None)
+    destino = sqlite3.connect(caminho_destino)
+    passos = []
+    try:
+        em_wal = origem.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        if em_wal:
+            # A leitura fixa o snapshot: as escritas de outras conexões vão para o WAL e não
+            # obrigam a cópia a recomeçar. No modo rollback isso bloquearia as escritas.
+            origem.execute("BEGIN")
+            origem.execute("SELECT COUNT(*) FROM sqlite_schema").fetchone()
+        origem.backup(destino, pages=paginas, sleep=pausa,
+                      progress=lambda status, restantes, total: passos.append(total))
+        if em_wal:
+            origem.execute("COMMIT")
+        # A cópia é um arquivo único, sem -wal ao lado.
+        destino.execute("PRAGMA journal_mode = DELETE")
+        if destino.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+            raise ErroBackup("A cópia não passou no quick_check.")
+    finally:
+        destino.close()
+        origem.close()
+    # Com o snapshot fixo o total de páginas não muda; se mudou, a cópia recomeçou.
+    return {'passos': len(passos), 'reinicios': sum(1 for a, b in zip(passos, passos[1:]) if a != b)}
+
+def _gravar_blocos(caminho, blocos, tamanho_bloco):
+    resumo_total = hashlib.sha256()
+    lista, novos, bytes_novos = [], 0, 0
+    with open(caminho, 'rb') as arquivo:
+        while True:
+            dados = arquivo.read(tamanho_bloco)
+            if not dados:
+                break
+            resumo_total.update(dados)
+            resumo = hashlib.sha256(dados).hexdigest()
+            lista.append(resumo)
+            destino = _caminho_bloco(blocos, resumo)
+            if not os.path.exists(destino):
+                _gravar_atomico(destino, dados)
+                novos += 1
+                bytes_novos += len(dados)
+    return lista, resumo_total.hexdigest(), novos, bytes_novos
+
+def criar_snapshot(pasta=None):
+    config = database.obter_configuracao()
+    blocos, snapshots = _pastas(pasta)
+    os.makedirs(snapshots, exist_ok=True)
+    inicio = time.perf_counter()
+    criado_em = datetime.now()
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(snapshots)) as temporaria:
+        copia = os.path.join(temporaria, 'controle.db')
+        copiado = _copiar_online(config['caminho'], copia, config['backup_paginas_por_passo'],
+                                 config['backup_pausa'])
+        # A cópia fica fora da trava; dos blocos até a retenção, um snapshot por vez.
+        with _travar(snapshots, exclusiva=True):
+            nome = criado_em.strftime('%Y%m%d-%H%M%S')
+            if os.path.exists(os.path.join(snapshots, f"{nome}.json")):
+                nome += criado_em.strftime('-%f')
+            lista, resumo, novos, bytes_novos = _gravar_blocos(copia, blocos, config['backup_tamanho_bloco'])
+            tamanho = os.path.getsize(copia)
+            segundos = time.perf_counter() - inicio
+            manifesto = {
+                'nome': nome,
+                'criado_em': criado_em.timestamp(),
+                'tamanho': tamanho,
+                'sha256': resumo,
+                'tamanho_bloco': config['backup_tamanho_bloco'],
+                'blocos': lista,
+                'blocos_novos': novos,
+                'bytes_novos': bytes_novos,
+                'segundos': segundos,
+                'bytes_por_segundo': tamanho / segundos if segundos else 0.0,
+                'passos': copiado['passos'],
+                'reinicios': copiado['reinicios'],
+            }
+            # O manifesto é gravado por último: um snapshot só existe depois que todos os blocos estão no disco.
+            _gravar_atomico(os.path.join(snapshots, f"{nome}.json"), json.dumps(manifesto).encode('utf-8'))
+            manifesto['removidos'] = _remover_antigos(config['backup_manter'], blocos, snapshots, pasta)
+    return manifesto
+
+def listar_snapshots(pasta=None):
+    _, snapshots = _pastas(pasta)
+    if not os.path.isdir(snapshots):
+        return []
+    manifestos = []
+    for arquivo in sorted(os.listdir(snapshots)):
+        if arquivo.endswith('.json'):
+            with open(os.path.join(snapshots, arquivo), encoding='utf-8') as entrada:
+                manifestos.append(json.load(entrada))
+    # Pela data de criação: dois snapshots no mesmo segundo têm nomes ("...-HHMMSS" e
+    # "...-HHMMSS-ffffff") que, como arquivos, ficam fora de ordem.
+    manifestos.sort(key=lambda manifesto: (manifesto['criado_em'], manifesto['nome']))
+    return manifestos
+
+def _obter_manifesto(nome, pasta=None):
+    manifestos = listar_snapshots(pasta)
+    if not manifestos:
+        raise ErroBackup("Nenhum snapshot encontrado.")
+    if nome is None:
+        return manifestos[-1]
+    for manifesto in manifestos:
+        if manifesto['nome'] == nome:
+            return manifesto
+    raise ErroBackup(f"Snapshot {nome} não encontrado.")
+
+def aplicar_retencao(manter, pasta=None):
+    blocos, snapshots = _pastas(pasta)
+    with _travar(snapshots, exclusiva=True):
+        return _remover_antigos(manter, blocos, snapshots, pasta)
+
+def _remover_antigos(manter, blocos, snapshots, pasta):
+    # Chamada com a trava exclusiva.
+    manifestos = listar_snapshots(pasta)
+    antigos = manifestos[:-manter] if manter > 0 else []
+    for manifesto in antigos:
+        os.remove(os.path.join(snapshots, f"{manifesto['nome']}.json"))
+    if not antigos:
+        return 0
+    # Blocos que nenhum snapshot restante usa são apagados.
+    em_uso = {resumo for manifesto in manifestos[len(antigos):] for resumo in manifesto['blocos']}
+    for subpasta in os.listdir(blocos):
+        for resumo in os.listdir(os.path.join(blocos, subpasta)):
+            if resumo not in em_uso:
+                os.remove(os.path.join(blocos, subpasta, resumo))
+    return len(antigos)
+
+def _montar(manifesto, caminho, blocos):
+    # Remonta o arquivo a partir dos blocos, conferindo cada um e o arquivo inteiro.
+    resumo_total = hashlib.sha256()
+    with open(caminho, 'wb') as saida:
+        for resumo in manifesto['blocos']:
+            try:
+                with open(_caminho_bloco(blocos, resumo), 'rb') as arquivo:
+                    dados = arquivo.read()
+            except FileNotFoundError:
+                raise ErroBackup(f"Bloco {resumo} ausente.")
+            if hashlib.sha256(dados).hexdigest() != resumo:
+                raise ErroBackup(f"Bloco {resumo} corrompido.")
+            resumo_total.update(dados)
+            saida.write(dados)
+    if resumo_total.hexdigest() != manifesto['sha256']:
+        raise ErroBackup(f"Checksum do snapshot {manifesto['nome']} não confere.")
+
+def verificar(nome=None, completo=False, pasta=None):
+    # Confere os checksums dos blocos e do arquivo; `completo` também abre a cópia e roda o
+    # integrity_check do SQLite. Levanta ErroBackup no primeiro problema.
+    blocos, snapshots = _pastas(pasta)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(snapshots)) as temporaria:
+        copia = os.path.join(temporaria, 'controle.db')
+        with _travar(snapshots, exclusiva=False):
+            manifesto = _obter_manifesto(nome, pasta)
+            _montar(manifesto, copia, blocos)
+        if completo:
+            conn = sqlite3.connect(copia)
+            try:
+                resultado = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                conn.close()
+            if resultado != 'ok':
+                raise ErroBackup(f"integrity_check falhou: {resultado}")
+    return manifesto
+
+def restaurar(nome=None, destino=None, pasta=None):
+    # Sem `destino`, o conteúdo do banco em uso é substituído pelo do snapshot; com `destino`, o
+    # snapshot vira um arquivo novo nesse caminho e o banco em uso não é tocado.
+    blocos, snapshots = _pastas(pasta)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(snapshots)) as temporaria:
+        copia = os.path.join(temporaria, 'controle.db')
+        with _travar(snapshots, exclusiva=False):
+            manifesto = _obter_manifesto(nome, pasta)
+            _montar(manifesto, copia, blocos)
+        if destino is None:
+            database.restaurar_de_copia(copia)
+        else:
+            shutil.move(copia, destino)
+    return manifesto
+
+def metricas(pasta=None):
+    # Medidores para o /metrics. O atraso é a idade do último snapshot: quanto de escrita
+    # seria perdido se o banco sumisse agora.
+    manifestos = listar_snapshots(pasta)
+    medidores = [('controle_backup_snapshots', 'Snapshots guardados.', [({}, len(manifestos))])]
+    if manifestos:
+        ultimo = manifestos[-1]
+        medidores += [
+            ('controle_backup_ultimo_sucesso_timestamp', 'Momento do último snapshot (época Unix).',
+             [({}, ultimo['criado_em'])]),
+            ('controle_backup_atraso_segundos', 'Idade do último snapshot.',
+             [({}, time.time() - ultimo['criado_em'])]),
+            ('controle_backup_duracao_segundos', 'Duração do último snapshot.', [({}, ultimo['segundos'])]),
+            ('controle_backup_bytes_por_segundo', 'Vazão do último snapshot.', [({}, ultimo['bytes_por_segundo'])]),
+            ('controle_backup_tamanho_bytes', 'Tamanho do banco no último snapshot.', [({}, ultimo['tamanho'])]),
+            ('controle_backup_bytes_novos', 'Bytes gravados pelo último snapshot.', [({}, ultimo['bytes_novos'])]),
+        ]
+    return medidores
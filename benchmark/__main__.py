@@ -0,0 +1,129 @@
+# Uso:
+#   python -m benchmark gerar --escala 1m
+#   python -m benchmark executar --banco benchmark/dados/1m.db --baseline benchmark/baseline.json
+#   python -m benchmark senhas --metodo scrypt --metodo pbkdf2:sha256:600000
+#   python -m benchmark comparar benchmark/resultados/atual.json benchmark/baseline.json
+
+import os
+import shutil
+import sys
+import tempfile
+
+import click
+
+from benchmark import resultados
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.option('--escala', type=click.Choice(['10k', '1m', '10m']), default='10k')
+@click.option('--semente', type=int, default=42, show_default=True)
+@click.option('--saida', help='Arquivo do banco gerado (padrão: benchmark/dados/<escala>.db).')
+def gerar(escala, semente, saida):
+    from benchmark import gerador
+    saida = saida or os.path.join(PASTA, 'dados', f'{escala}.db')
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    relatorio = gerador.gerar(saida, escala, semente)
+    click.echo(f"Banco {saida} gerado em {relatorio['segundos']:.1f}s: "
+               + ', '.join(f"{tabela}={total}" for tabela, total in relatorio['volumes'].items()))
+
+@cli.command()
+@click.option('--banco', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='Banco gerado por "gerar"; os testes rodam numa cópia dele.')
+@click.option('--somente', type=click.Choice(['micro', 'carga']))
+@click.option('--filtro', help='Executa só os casos cujo nome contém este texto.')
+@click.option('--repeticoes', type=int, default=100, show_default=True, help='Repetições por micro-benchmark.')
+@click.option('--requisicoes', type=int, default=200, show_default=True, help='Requisições por cenário de carga.')
+@click.option('--concorrencia', type=int, default=1, show_default=True, help='Clientes simultâneos na carga.')
+@click.option('--com-cache', is_flag=True, help='Mantém o cache de leitura ligado (padrão: desligado).')
+@click.option('--saida', help='Arquivo JSON de resultados (padrão: benchmark/resultados/ultimo.json).')
+@click.option('--baseline', type=click.Path(dir_okay=False), help='Resultado anterior para comparação.')
+@click.option('--tolerancia', type=float, default=resultados.TOLERANCIA_PADRAO, show_default=True,
+              help='Piora relativa da mediana aceita antes de acusar regressão.')
+@click.option('--atualizar-baseline', is_flag=True, help='Grava o resultado desta execução como baseline.')
+def executar(banco, somente, filtro, repeticoes, requisicoes, concorrencia, com_cache, saida, baseline,
+             tolerancia, atualizar_baseline):
+    pasta_temporaria = tempfile.mkdtemp(prefix='benchmark-')
+    copia = os.path.join(pasta_temporaria, 'controle.db')
+    shutil.copyfile(banco, copia)
+    # A configuração do db.py é lida na primeira conexão, então o ambiente
+    # precisa estar pronto antes de importar db/app.
+    os.environ['DB_PATH'] = copia
+    os.environ.setdefault('METRICS_ENABLED', '0')
+    if not com_cache:
+        os.environ['CACHE_MAX_ENTRIES'] = '0'
+    try:
+        resultado = {'metadados': resultados.metadados(
+            banco=os.path.basename(banco), repeticoes=repeticoes, requisicoes=requisicoes,
+            concorrencia=concorrencia, cache=com_cache)}
+        if somente in (None, 'micro'):
+            from benchmark import micro
+            resultado['micro'] = micro.executar(repeticoes, filtro=filtro)
+        if somente in (None, 'carga'):
+            from benchmark import carga
+            resultado['carga'] = carga.executar(requisicoes, concorrencia, filtro=filtro)
+    finally:
+        shutil.rmtree(pasta_temporaria, ignore_errors=True)
+
+    saida = saida or os.path.join(PASTA, 'resultados', 'ultimo.json')
+    resultados.salvar(resultado, saida)
+    comparacoes = []
+    if baseline and os.path.exists(baseline) and not atualizar_baseline:
+        comparacoes = resultados.comparar(resultado, resultados.carregar(baseline), tolerancia)
+    resultados.imprimir_tabela(resultado, comparacoes)
+    click.echo(f"\nResultados em {saida}")
+    if atualizar_baseline:
+        destino = baseline or os.path.join(PASTA, 'baseline.json')
+        resultados.salvar(resultado, destino)
+        click.echo(f"Baseline atualizada em {destino}")
+    _encerrar_se_regrediu(comparacoes, tolerancia)
+
+@cli.command('senhas')
+@click.option('--metodo', 'metodos', multiple=True,
+              help='Método do werkzeug (ex.: scrypt, pbkdf2:sha256:600000); pode repetir.')
+@click.option('--repeticoes', type=int, default=10, show_default=True)
+@click.option('--requisicoes', type=int, default=50, show_default=True, help='Verificações no teste de pico.')
+@click.option('--concorrencia', type=int, default=8, show_default=True, help='Threads no teste de pico.')
+@click.option('--saida', help='Arquivo JSON de resultados (padrão: benchmark/resultados/senhas.json).')
+@click.option('--baseline', type=click.Path(dir_okay=False), help='Resultado anterior para comparação.')
+@click.option('--tolerancia', type=float, default=resultados.TOLERANCIA_PADRAO, show_default=True)
+def senhas_comando(metodos, repeticoes, requisicoes, concorrencia, saida, baseline, tolerancia):
+    from benchmark import senhas
+    resultado = {
+        'metadados': resultados.metadados(repeticoes=repeticoes, requisicoes=requisicoes, concorrencia=concorrencia),
+        'senhas': senhas.executar(list(metodos) or None, repeticoes, requisicoes, concorrencia),
+    }
+    saida = saida or os.path.join(PASTA, 'resultados', 'senhas.json')
+    resultados.salvar(resultado, saida)
+    comparacoes = []
+    if baseline and os.path.exists(baseline):
+        comparacoes = resultados.comparar(resultado, resultados.carregar(baseline), tolerancia)
+    resultados.imprimir_tabela(resultado, comparacoes)
+    click.echo(f"\nResultados em {saida}")
+    _encerrar_se_regrediu(comparacoes, tolerancia)
+
+@cli.command()
+@click.argument('atual', type=click.Path(exists=True, dir_okay=False))
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tolerancia', type=float, default=resultados.TOLERANCIA_PADRAO, show_default=True)
+def comparar(atual, baseline, tolerancia):
+    resultado = resultados.carregar(atual)
+    comparacoes = resultados.comparar(resultado, resultados.carregar(baseline), tolerancia)
+    resultados.imprimir_tabela(resultado, comparacoes)
+    _encerrar_se_regrediu(comparacoes, tolerancia)
+
+def _encerrar_se_regrediu(comparacoes, tolerancia):
+    regressoes = [c for c in comparacoes if c['regressao']]
+    if regressoes:
+        click.echo(f"\n{len(regressoes)} regressão(ões) acima de {tolerancia:.0%}:", err=True)
+        for c in regressoes:
+            click.echo(f"  {c['grupo']}/{c['caso']}: {c['baseline_ms']:.3f}ms -> {c['atual_ms']:.3f}ms "
+                       f"({c['variacao']:+.1%})", err=True)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
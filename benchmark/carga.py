@@ -0,0 +1,113 @@
+import itertools
+import json
+import threading
+import time
+
+import db as database
+from app import app
+from benchmark.medicao import resumir
+
+def _cliente_autenticado(id_usuario):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = id_usuario
+        sessao['user_name'] = 'benchmark'
+        sessao['nivel_acesso'] = 'Administrador'
+    return cliente
+
+def _amostrar_ids():
+    conn = database.conectar()
+    try:
+        id_usuario = conn.execute("SELECT MIN(id_usuario) FROM usuarios").fetchone()[0]
+        clientes = [linha[0] for linha in conn.execute("SELECT id_cliente FROM clientes ORDER BY id_cliente LIMIT 100")]
+        equipamentos = [linha[0] for linha in conn.execute('''
+            SELECT id_equipamento FROM equipamentos WHERE status = 'Ativo' ORDER BY id_equipamento LIMIT 100
+        ''')]
+        abertas = [linha[0] for linha in conn.execute('''
+            SELECT id_movimentacao FROM movimentacoes WHERE data_devolucao IS NULL ORDER BY id_movimentacao
+        ''')]
+        # Estoque alto para que as retiradas do cenário não falhem por falta de unidades.
+        with database.transacao_escrita('equipamentos') as escrita:
+            escrita.execute("UPDATE equipamentos SET quantidade_estoque = 1000000 WHERE id_equipamento IN "
+                            "(SELECT value FROM json_each(?))", (json.dumps(equipamentos),))
+    finally:
+        conn.close()
+    return id_usuario, clientes, equipamentos, abertas
+
+def _montar_cenarios(id_usuario, clientes, equipamentos, abertas):
+    proximo_cliente = itertools.cycle(clientes)
+    proximo_equipamento = itertools.cycle(equipamentos)
+    proxima_aberta = itertools.cycle(abertas)
+    trava = threading.Lock()
+
+    def proximo(iterador):
+        with trava:
+            return next(iterador)
+
+    def retirada(cliente):
+        return cliente.post('/movimentacoes/retirada', data={
+            'id_equipamentos': [proximo(proximo_equipamento), proximo(proximo_equipamento)],
+            'id_usuario': id_usuario,
+            'id_cliente': proximo(proximo_cliente),
+            'observacao': 'benchmark',
+        })
+
+    cenarios = {
+        'dashboard': lambda cliente: cliente.get('/'),
+        'listar_equipamentos': lambda cliente: cliente.get('/equipamentos'),
+        'listar_clientes': lambda cliente: cliente.get('/clientes'),
+        'listar_usuarios': lambda cliente: cliente.get('/usuarios'),
+        'listar_movimentacoes': lambda cliente: cliente.get('/movimentacoes'),
+        'cliente_detalhe': lambda cliente: cliente.get(f'/clientes/{proximo(proximo_cliente)}'),
+        'formulario_retirada': lambda cliente: cliente.get('/movimentacoes/retirada'),
+        'retirada': retirada,
+    }
+    if abertas:
+        cenarios['devolucao'] = lambda cliente: cliente.post(f'/movimentacoes/devolver/{proximo(proxima_aberta)}')
+    return cenarios
+
+def _executar_cenario(requisicao, id_usuario, requisicoes, concorrencia):
+    duracoes = []
+    erros = []
+    trava = threading.Lock()
+    restantes = iter(range(requisicoes))
+
+    def trabalhador():
+        cliente = _cliente_autenticado(id_usuario)
+        while True:
+            with trava:
+                if next(restantes, None) is None:
+                    return
+            inicio = time.perf_counter()
+            resposta = requisicao(cliente)
+            duracao = time.perf_counter() - inicio
+            resposta.close()
+            with trava:
+                duracoes.append(duracao)
+                if resposta.status_code >= 400:
+                    erros.append(resposta.status_code)
+
+    inicio = time.perf_counter()
+    trabalhadores = [threading.Thread(target=trabalhador) for _ in range(concorrencia)]
+    for t in trabalhadores:
+        t.start()
+    for t in trabalhadores:
+        t.join()
+    resumo = resumir(duracoes, time.perf_counter() - inicio)
+    resumo['concorrencia'] = concorrencia
+    resumo['erros'] = len(erros)
+    return resumo
+
+def executar(requisicoes=200, concorrencia=1, aquecimento=3, filtro=None):
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'benchmark'
+    id_usuario, clientes, equipamentos, abertas = _amostrar_ids()
+    cenarios = _montar_cenarios(id_usuario, clientes, equipamentos, abertas)
+    resultados = {}
+    for nome, requisicao in cenarios.items():
+        if filtro and filtro not in nome:
+            continue
+        cliente = _cliente_autenticado(id_usuario)
+        for _ in range(aquecimento):
+            requisicao(cliente).close()
+        resultados[nome] = _executar_cenario(requisicao, id_usuario, requisicoes, concorrencia)
+    return resultados
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import db as database
+
+# Volumes de cada escala. As movimentações dominam o tamanho do banco; os
+# cadastros crescem bem menos, como acontece na operação real.
+ESCALAS = {
+    '10k': {'movimentacoes': 10_000, 'equipamentos': 300, 'clientes': 200, 'usuarios': 10},
+    '1m': {'movimentacoes': 1_000_000, 'equipamentos': 5_000, 'clientes': 3_000, 'usuarios': 50},
+    '10m': {'movimentacoes': 10_000_000, 'equipamentos': 20_000, 'clientes': 15_000, 'usuarios': 200},
+}
+
+SEMENTE_PADRAO = 42
+SENHA_PADRAO = 'benchmark'
+# Data fixa para que a mesma semente gere sempre o mesmo banco.
+DATA_REFERENCIA = datetime(2025, 1, 1, 18, 0, tzinfo=database.FUSO_HORARIO_SP)
+DIAS_HISTORICO = 730
+# Expoente da distribuição de Zipf: poucos clientes e equipamentos concentram
+# a maior parte das movimentações.
+EXPOENTE_ZIPF = 1.1
+TAMANHO_LOTE = 10_000
+
+TIPOS_EQUIPAMENTO = ['Notebook', 'Monitor', 'Projetor', 'Roteador', 'Switch', 'Impressora', 'Nobreak',
+                     'Teclado', 'Mouse', 'Headset', 'Webcam', 'Tablet', 'Servidor', 'Access Point']
+MARCAS = ['Dell', 'Lenovo', 'HP', 'Epson', 'Cisco', 'TP-Link', 'Logitech', 'Samsung', 'LG', 'Intelbras']
+PREFIXOS_CLIENTE = ['Escola', 'Clínica', 'Mercado', 'Escritório', 'Prefeitura', 'Hotel', 'Padaria',
+                    'Farmácia', 'Academia', 'Oficina']
+NOMES = ['Silva', 'Souza', 'Oliveira', 'Santos', 'Pereira', 'Costa', 'Almeida', 'Ferreira', 'Rodrigues',
+         'Gomes', 'Martins', 'Araújo', 'Barbosa', 'Ribeiro', 'Carvalho']
+OBSERVACOES = [None, None, None, 'Manutenção preventiva', 'Troca temporária', 'Evento', 'Instalação']
+
+def pesos_zipf(rng, quantidade):
+    # Os ids são embaralhados para que os "populares" não sejam sempre os primeiros.
+    ids = list(range(1, quantidade + 1))
+    rng.shuffle(ids)
+    return ids, list(accumulate(1 / (posicao ** EXPOENTE_ZIPF) for posicao in range(1, quantidade + 1)))
+
+def _aplicar_migracoes(conn, ate=None, desde=0):
+    for migracao in database.MIGRACOES:
+        if migracao['versao'] <= desde or (ate is not None and migracao['versao'] > ate):
+            continue
+        for comando in migracao['comandos']:
+            conn.execute(comando)
+        database.verificar_planos(conn, migracao['consultas_verificadas'])
+        conn.execute(f"PRAGMA user_version = {migracao['versao']}")
+
+def _inserir_em_lotes(conn, sql, linhas):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= TAMANHO_LOTE:
+            conn.executemany(sql, lote)
+            lote = []
+    if lote:
+        conn.executemany(sql, lote)
+
+def _usuarios(rng, quantidade):
+    # Um único hash para todos, no formato do werkzeug, com sal derivado da
+    # semente para que o banco gerado seja sempre idêntico.
+    sal = '%016x' % rng.getrandbits(64)
+    iteracoes = 600000
+    derivada = hashlib.pbkdf2_hmac('sha256', SENHA_PADRAO.encode(), sal.encode(), iteracoes).hex()
+    senha = f"pbkdf2:sha256:{iteracoes}${sal}${derivada}"
+    for n in range(1, quantidade + 1):
+        nivel = 'Administrador' if n == 1 or rng.random() < 0.1 else 'Técnico'
+        yield (f"{rng.choice(NOMES)} {rng.choice(NOMES)} {n}", f"usuario{n}@benchmark.local", senha,
+               'Analista' if nivel == 'Administrador' else 'Técnico de campo', nivel)
+
+def _equipamentos(rng, quantidade):
+    for n in range(1, quantidade + 1):
+        tipo = rng.choice(TIPOS_EQUIPAMENTO)
+        marca = rng.choice(MARCAS)
+        cadastro = DATA_REFERENCIA - timedelta(days=DIAS_HISTORICO + rng.randint(0, 365))
+        status = 'Inativo' if rng.random() < 0.05 else 'Ativo'
+        yield (f"{tipo} {marca} {n}", f"{tipo} {marca} modelo {rng.randint(100, 999)}",
+               rng.randint(0, 100), cadastro, status)
+
+def _clientes(rng, quantidade):
+    for n in range(1, quantidade + 1):
+        yield (f"{rng.choice(PREFIXOS_CLIENTE)} {rng.choice(NOMES)} {n}", f"(11) 9{rng.randint(1000, 9999)}-{n % 10000:04d}")
+
+def _movimentacoes(rng, escala):
+    total = escala['movimentacoes']
+    equipamentos, pesos_equipamentos = pesos_zipf(rng, escala['equipamentos'])
+    clientes, pesos_clientes = pesos_zipf(rng, escala['clientes'])
+    usuarios = range(1, escala['usuarios'] + 1)
+    inicio = DATA_REFERENCIA - timedelta(days=DIAS_HISTORICO)
+    passo = DIAS_HISTORICO * 86400 / total
+    # Retiradas recentes têm mais chance de ainda estarem abertas.
+    limite_recente = DATA_REFERENCIA - timedelta(days=30)
+    gerados = 0
+    while gerados < total:
+        quantidade = min(TAMANHO_LOTE, total - gerados)
+        lote_equipamentos = rng.choices(equipamentos, cum_weights=pesos_equipamentos, k=quantidade)
+        lote_clientes = rng.choices(clientes, cum_weights=pesos_clientes, k=quantidade)
+        for i in range(quantidade):
+            retirada = inicio + timedelta(seconds=(gerados + i) * passo + rng.random() * passo)
+            chance_aberta = 0.5 if retirada >= limite_recente else 0.005
+            devolucao = None
+            if rng.random() >= chance_aberta:
+                devolucao = min(retirada + timedelta(hours=rng.expovariate(1 / 72)), DATA_REFERENCIA)
+            yield (lote_equipamentos[i], rng.choice(usuarios), lote_clientes[i], retirada,
+                   rng.choice((1, 1, 1, 1, 2, 3)), devolucao, rng.choice(OBSERVACOES))
+        gerados += quantidade
+
+def gerar(caminho, escala='10k', semente=SEMENTE_PADRAO):
+    volumes = ESCALAS[escala]
+    rng = random.Random(semente)
+    for sufixo in ('', '-wal', '-shm'):
+        if os.path.exists(caminho + sufixo):
+            os.remove(caminho + sufixo)
+    inicio = time.perf_counter()
+    conn = sqlite3.connect(caminho, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        # Só as tabelas primeiro: índices, gatilhos e FTS são criados pelas
+        # migrações seguintes sobre os dados já carregados, o que é bem mais rápido.
+        _aplicar_migracoes(conn, ate=1)
+        _inserir_em_lotes(conn, '''
+            INSERT INTO usuarios (nome_usuario, email, senha, cargo, nivel_acesso) VALUES (?, ?, ?, ?, ?)
+        ''', _usuarios(rng, volumes['usuarios']))
+        _inserir_em_lotes(conn, '''
+            INSERT INTO equipamentos (nome_equipamento, descricao_equipamento, quantidade_estoque, data_cadastro, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', _equipamentos(rng, volumes['equipamentos']))
+        _inserir_em_lotes(conn, "INSERT INTO clientes (nome_cliente, contato) VALUES (?, ?)",
+                          _clientes(rng, volumes['clientes']))
+        _inserir_em_lotes(conn, '''
+            INSERT INTO movimentacoes (id_equipamento, id_usuario, id_cliente, data_retirada,
+                                       quantidade_retirada, data_devolucao, observacao)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', _movimentacoes(rng, volumes))
+        _aplicar_migracoes(conn, desde=1)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+    return {
+        'caminho': caminho,
+        'escala': escala,
+        'semente': semente,
+        'volumes': volumes,
+        'segundos': time.perf_counter() - inicio,
+    }
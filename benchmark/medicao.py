@@ -0,0 +1,45 @@
+import statistics
+import time
+import tracemalloc
+
+def resumir(duracoes, segundos_totais=None):
+    # `duracoes` em segundos; o resumo sai em milissegundos.
+    ordenadas = sorted(duracoes)
+    total = len(ordenadas)
+    if not total:
+        return {'amostras': 0}
+    segundos_totais = segundos_totais if segundos_totais is not None else sum(ordenadas)
+    return {
+        'amostras': total,
+        'min_ms': ordenadas[0] * 1000,
+        'mediana_ms': statistics.median(ordenadas) * 1000,
+        'p95_ms': ordenadas[min(total - 1, int(total * 0.95))] * 1000,
+        'max_ms': ordenadas[-1] * 1000,
+        'media_ms': statistics.fmean(ordenadas) * 1000,
+        'operacoes_por_segundo': total / segundos_totais if segundos_totais > 0 else None,
+    }
+
+def medir(funcao, repeticoes, aquecimento=3):
+    for _ in range(aquecimento):
+        funcao()
+    duracoes = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracoes.append(time.perf_counter() - inicio)
+    return resumir(duracoes)
+
+def medir_memoria(funcao):
+    # Memória ainda alocada pelo resultado de uma chamada; para listas, dividida
+    # pelo número de linhas devolvidas.
+    tracemalloc.start()
+    try:
+        resultado = funcao()
+        retida, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    medida = {'bytes_retidos': retida, 'bytes_pico': pico}
+    if isinstance(resultado, list) and resultado:
+        medida['linhas'] = len(resultado)
+        medida['bytes_por_linha'] = retida / len(resultado)
+    return medida
@@ -0,0 +1,137 @@
+import itertools
+from datetime import date, timedelta
+
+import db as database
+import relatorios
+from benchmark.medicao import medir, medir_memoria
+
+def amostrar_contexto():
+    # Ids e termos reais do banco, escolhidos uma vez para que todas as
+    # execuções meçam as mesmas consultas.
+    conn = database.conectar()
+    try:
+        cliente_popular = conn.execute('''
+            SELECT id_cliente FROM movimentacoes GROUP BY id_cliente ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()[0]
+        equipamento_popular = conn.execute('''
+            SELECT id_equipamento FROM movimentacoes WHERE data_devolucao IS NULL
+            GROUP BY id_equipamento ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()[0]
+        equipamento_retirada = conn.execute('''
+            SELECT id_equipamento, nome_equipamento, descricao_equipamento FROM equipamentos
+            WHERE status = 'Ativo' ORDER BY id_equipamento LIMIT 1
+        ''').fetchone()
+        email = conn.execute("SELECT email FROM usuarios ORDER BY id_usuario LIMIT 1").fetchone()[0]
+        id_usuario = conn.execute("SELECT MIN(id_usuario) FROM usuarios").fetchone()[0]
+        data_recente = date.fromisoformat(conn.execute("SELECT MAX(data_retirada) FROM movimentacoes").fetchone()[0][:10])
+        nome_equipamento = conn.execute("SELECT nome_equipamento FROM equipamentos LIMIT 1").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        'id_cliente': cliente_popular,
+        'id_equipamento': equipamento_popular,
+        'equipamento_retirada': tuple(equipamento_retirada),
+        'email': email,
+        'id_usuario': id_usuario,
+        'periodo': ((data_recente - timedelta(days=30)).isoformat(), data_recente.isoformat()),
+        'termo_busca': nome_equipamento.split()[0][:4].lower(),
+    }
+
+def _consumir(lotes):
+    for _ in lotes:
+        pass
+
+def _preparar_retirada(contexto):
+    # Estoque alto o bastante para que nenhuma repetição caia em "sem estoque".
+    id_equipamento, nome, descricao = contexto['equipamento_retirada']
+    database.atualizar_equipamento(id_equipamento, nome, descricao, 10_000_000)
+    return lambda: database.registrar_retiradas_em_lote(
+        [id_equipamento], contexto['id_usuario'], contexto['id_cliente'], 'benchmark')
+
+def _preparar_devolucao(contexto):
+    conn = database.conectar()
+    try:
+        ids = [linha[0] for linha in conn.execute('''
+            SELECT id_movimentacao FROM movimentacoes WHERE data_devolucao IS NULL
+            ORDER BY id_movimentacao
+        ''')]
+    finally:
+        conn.close()
+    proximos = itertools.cycle(ids)
+    return lambda: database.registrar_devolucao(next(proximos))
+
+def _preparar_devolucoes_em_lote(contexto):
+    # Lotes de 50 ids em aberto; depois da primeira volta o caso mede o caminho "já devolvida".
+    conn = database.conectar()
+    try:
+        ids = [linha[0] for linha in conn.execute('''
+            SELECT id_movimentacao FROM movimentacoes WHERE data_devolucao IS NULL
+            ORDER BY id_movimentacao
+        ''')]
+    finally:
+        conn.close()
+    lotes = itertools.cycle([ids[inicio:inicio + 50] for inicio in range(0, len(ids), 50)] or [[0]])
+    return lambda: database.registrar_devolucoes_em_lote(next(lotes))
+
+def _preparar_estoque_atual(contexto):
+    # Com um snapshot recente, o saldo atual quase não refaz lançamentos.
+    database.criar_snapshot_estoque()
+    return database.obter_estoque_em
+
+def _preparar_relatorios(contexto):
+    # Processa o razão inteiro antes; o caso mede só a leitura dos totais já acumulados.
+    relatorios.atualizar()
+    return lambda: relatorios.montar_painel(*contexto['periodo'])
+
+# Cada caso recebe o contexto e devolve a função a ser cronometrada.
+CASOS = {
+    'obter_estatisticas': lambda c: database.obter_estatisticas,
+    'listar_ultimas_movimentacoes': lambda c: database.listar_ultimas_movimentacoes,
+    'listar_equipamentos': lambda c: lambda: database.listar_equipamentos(limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_equipamentos_prefixo': lambda c: lambda: database.listar_equipamentos(
+        prefixo=c['termo_busca'][:2], limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_equipamentos_completo': lambda c: database.listar_equipamentos,
+    'listar_clientes': lambda c: lambda: database.listar_clientes(limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_usuarios': lambda c: lambda: database.listar_usuarios(limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_movimentacoes_abertas': lambda c: lambda: database.listar_movimentacoes_abertas(
+        limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_movimentacoes_abertas_periodo': lambda c: lambda: database.listar_movimentacoes_abertas(
+        *c['periodo'], limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_movimentacoes_abertas_completo': lambda c: database.listar_movimentacoes_abertas,
+    'listar_movimentacoes_por_cliente': lambda c: lambda: database.listar_movimentacoes_por_cliente(
+        c['id_cliente'], limite=database.TAMANHO_PAGINA_PADRAO),
+    'listar_movimentacoes_por_cliente_completo': lambda c: lambda: database.listar_movimentacoes_por_cliente(
+        c['id_cliente']),
+    'obter_equipamento_por_id': lambda c: lambda: database.obter_equipamento_por_id(c['id_equipamento']),
+    'obter_cliente_por_id': lambda c: lambda: database.obter_cliente_por_id(c['id_cliente']),
+    'obter_usuario_por_email': lambda c: lambda: database.obter_usuario_por_email(c['email']),
+    'verificar_movimentacoes_abertas_equipamento': lambda c: lambda: (
+        database.verificar_movimentacoes_abertas_equipamento(c['id_equipamento'])),
+    'buscar_equipamentos': lambda c: lambda: database.buscar('equipamentos', c['termo_busca']),
+    'buscar_clientes': lambda c: lambda: database.buscar('clientes', 'silva'),
+    'iterar_movimentacoes_cliente': lambda c: lambda: _consumir(
+        database.iterar_movimentacoes(id_cliente=c['id_cliente'])),
+    'obter_estoque_em_historico': lambda c: lambda: database.obter_estoque_em(c['periodo'][0]),
+    'obter_estoque_equipamento_em': lambda c: lambda: database.obter_estoque_equipamento_em(
+        c['id_equipamento'], c['periodo'][0]),
+    'serie_estoque': lambda c: lambda: database.serie_estoque(c['id_equipamento'], *c['periodo']),
+    'obter_estoque_em_snapshot': _preparar_estoque_atual,
+    'montar_painel_relatorios': _preparar_relatorios,
+    'registrar_retiradas_em_lote': _preparar_retirada,
+    'registrar_devolucao': _preparar_devolucao,
+    'registrar_devolucoes_em_lote': _preparar_devolucoes_em_lote,
+}
+
+def executar(repeticoes=100, aquecimento=3, filtro=None):
+    contexto = amostrar_contexto()
+    resultados = {}
+    for nome, preparar in CASOS.items():
+        if filtro and filtro not in nome:
+            continue
+        funcao = preparar(contexto)
+        resultado = medir(funcao, repeticoes, aquecimento)
+        resultado.update(medir_memoria(funcao))
+        if 'linhas' in resultado and resultado['operacoes_por_segundo']:
+            resultado['linhas_por_segundo'] = resultado['linhas'] * resultado['operacoes_por_segundo']
+        resultados[nome] = resultado
+    return resultados
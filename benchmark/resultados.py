@@ -0,0 +1,72 @@
+import json
+import os
+import platform
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+TOLERANCIA_PADRAO = 0.20
+# A mediana é a métrica comparada: é estável entre execuções e pouco afetada
+# por pausas isoladas do sistema operacional.
+METRICA_COMPARADA = 'mediana_ms'
+GRUPOS = ('micro', 'carga', 'senhas')
+
+def metadados(**extras):
+    dados = {
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'processador': platform.processor() or platform.machine(),
+    }
+    dados.update(extras)
+    return dados
+
+def salvar(resultado, caminho):
+    pasta = os.path.dirname(caminho)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2, sort_keys=True)
+        arquivo.write('\n')
+
+def carregar(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def comparar(atual, baseline, tolerancia=TOLERANCIA_PADRAO):
+    # Devolve uma linha por caso presente nos dois resultados; 'regressao'
+    # indica que a mediana piorou mais do que a tolerância.
+    comparacoes = []
+    for grupo in GRUPOS:
+        anteriores = baseline.get(grupo, {})
+        for nome, medida in sorted(atual.get(grupo, {}).items()):
+            anterior = anteriores.get(nome)
+            if not anterior or not anterior.get(METRICA_COMPARADA) or METRICA_COMPARADA not in medida:
+                continue
+            variacao = medida[METRICA_COMPARADA] / anterior[METRICA_COMPARADA] - 1
+            comparacoes.append({
+                'grupo': grupo,
+                'caso': nome,
+                'baseline_ms': anterior[METRICA_COMPARADA],
+                'atual_ms': medida[METRICA_COMPARADA],
+                'variacao': variacao,
+                'regressao': variacao > tolerancia,
+            })
+    return comparacoes
+
+def imprimir_tabela(resultado, comparacoes=None, saida=sys.stdout):
+    por_caso = {(c['grupo'], c['caso']): c for c in comparacoes or []}
+    for grupo in GRUPOS:
+        medidas = resultado.get(grupo)
+        if not medidas:
+            continue
+        saida.write(f"\n{grupo}\n")
+        saida.write(f"  {'caso':<45} {'mediana':>10} {'p95':>10} {'op/s':>10} {'vs baseline':>12}\n")
+        for nome, medida in sorted(medidas.items()):
+            comparacao = por_caso.get((grupo, nome))
+            variacao = ''
+            if comparacao:
+                variacao = f"{comparacao['variacao']:+.1%}" + (' !' if comparacao['regressao'] else '')
+            saida.write(f"  {nome:<45} {medida['mediana_ms']:>8.3f}ms {medida['p95_ms']:>8.3f}ms "
+                        f"{medida['operacoes_por_segundo'] or 0:>10.0f} {variacao:>12}\n")
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import senhas
+from benchmark.medicao import medir, resumir
+
+METODOS_PADRAO = ['scrypt', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000']
+SENHA = 'senha-de-benchmark'
+
+def _carga_no_pool(senha_hash, requisicoes, concorrencia):
+    # Simula um pico de logins: `concorrencia` threads disputando o pool de processos.
+    duracoes = []
+    recusadas = []
+    trava = threading.Lock()
+    restantes = iter(range(requisicoes))
+
+    def trabalhador():
+        while True:
+            with trava:
+                if next(restantes, None) is None:
+                    return
+            inicio = time.perf_counter()
+            try:
+                senhas.verificar_senha(senha_hash, SENHA)
+            except senhas.FilaSenhasCheia:
+                with trava:
+                    recusadas.append(1)
+                continue
+            with trava:
+                duracoes.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    trabalhadores = [threading.Thread(target=trabalhador) for _ in range(concorrencia)]
+    for t in trabalhadores:
+        t.start()
+    for t in trabalhadores:
+        t.join()
+    resumo = resumir(duracoes, time.perf_counter() - inicio)
+    resumo['concorrencia'] = concorrencia
+    resumo['recusadas'] = len(recusadas)
+    return resumo
+
+def executar(metodos=None, repeticoes=10, requisicoes=50, concorrencia=8):
+    senhas.iniciar()
+    processos = senhas.obter_configuracao()['processos']
+    resultados = {}
+    for metodo in metodos or METODOS_PADRAO:
+        senha_hash = senhas._gerar(SENHA, metodo)
+        resultados[f'gerar[{metodo}]'] = medir(lambda: senhas._gerar(SENHA, metodo), repeticoes, aquecimento=1)
+        resultados[f'verificar[{metodo}]'] = medir(lambda: senhas._verificar(senha_hash, SENHA), repeticoes,
+                                                   aquecimento=1)
+        resultados[f'verificar_pool[{metodo}] {processos}p/{concorrencia}t'] = _carga_no_pool(
+            senha_hash, requisicoes, concorrencia)
+    senhas.encerrar()
+    return resultados
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+class CacheLeitura:
+    # LRU com TTL. Cada entrada guarda as versões das tabelas de que depende;
+    # se alguma versão mudou desde o preenchimento, a entrada é descartada.
+
+    def __init__(self, ttl=30.0, max_entradas=256, max_itens=5000):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_itens = max_itens
+        self._entradas = OrderedDict()
+        self._trava = threading.Lock()
+        self._contadores = {'hits': 0, 'misses': 0, 'expiradas': 0, 'invalidadas': 0, 'despejadas': 0}
+
+    def obter(self, chave, versoes):
+        agora = time.monotonic()
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self._contadores['misses'] += 1
+                return False, None
+            tabelas, versoes_entrada, expira_em, valor = entrada
+            if versoes_entrada != versoes:
+                del self._entradas[chave]
+                self._contadores['invalidadas'] += 1
+                self._contadores['misses'] += 1
+                return False, None
+            if expira_em < agora:
+                del self._entradas[chave]
+                self._contadores['expiradas'] += 1
+                self._contadores['misses'] += 1
+                return False, None
+            self._entradas.move_to_end(chave)
+            self._contadores['hits'] += 1
+            return True, valor
+
+    def guardar(self, chave, tabelas, versoes, valor):
+        if self.max_entradas <= 0:
+            return
+        if isinstance(valor, list) and (not valor or len(valor) > self.max_itens):
+            return
+        with self._trava:
+            self._entradas[chave] = (tabelas, versoes, time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self._contadores['despejadas'] += 1
+
+    def invalidar(self, *tabelas):
+        with self._trava:
+            if not tabelas:
+                removidas = len(self._entradas)
+                self._entradas.clear()
+            else:
+                chaves = [chave for chave, entrada in self._entradas.items()
+                          if any(tabela in entrada[0] for tabela in tabelas)]
+                for chave in chaves:
+                    del self._entradas[chave]
+                removidas = len(chaves)
+            self._contadores['invalidadas'] += removidas
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self._contadores)
+            dados['entradas'] = len(self._entradas)
+        dados['max_entradas'] = self.max_entradas
+        return dados
@@ -1,6 +1,20 @@
+import base64
+import binascii
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import re
 import sqlite3
-from datetime import datetime
-from werkzeug.security import generate_password_hash
+import threading
+import time
+import senhas
+from cache import CacheLeitura
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import wraps
+from operator import itemgetter
 from zoneinfo import ZoneInfo
 
 FUSO_HORARIO_SP = ZoneInfo("America/Sao_Paulo")
@@ -8,96 +22,1948 @@ FUSO_HORARIO_SP = ZoneInfo("America/Sao_Paulo")
 def obter_hora_atual():
     return datetime.now(FUSO_HORARIO_SP)
 
+# --- Registros ---
+# Linhas devolvidas pelas conexões do pool: tuplas com acesso por nome de
+# coluna (registro.nome_equipamento ou registro['nome_equipamento']), sem um
+# dict por linha. Uma classe é criada por conjunto de colunas e reaproveitada;
+# a conversão é feita pelo CursorPool sobre o lote inteiro de linhas.
+
+class Registro(tuple):
+    __slots__ = ()
+    _indices = {}
+
+    def __getitem__(self, chave):
+        if isinstance(chave, str):
+            return tuple.__getitem__(self, self._indices[chave])
+        return tuple.__getitem__(self, chave)
+
+    def get(self, chave, padrao=None):
+        indice = self._indices.get(chave)
+        return padrao if indice is None else tuple.__getitem__(self, indice)
+
+    def keys(self):
+        return list(self._indices)
+
+    def __repr__(self):
+        campos = ', '.join(f"{coluna}={valor!r}" for coluna, valor in zip(self._indices, self))
+        return f"Registro({campos})"
+
+_classes_registro = {}
+
+def classe_registro(colunas):
+    classe = _classes_registro.get(colunas)
+    if classe is None:
+        atributos = {'__slots__': (), '_indices': {coluna: indice for indice, coluna in enumerate(colunas)}}
+        for indice, coluna in enumerate(colunas):
+            if coluna.isidentifier() and not hasattr(Registro, coluna):
+                atributos[coluna] = property(itemgetter(indice))
+        classe = _classes_registro.setdefault(colunas, type('Registro', (Registro,), atributos))
+    return classe
+
+def converter_data_hora(valor):
+    # Colunas declaradas como DATETIME chegam como datetime (ver PARSE_DECLTYPES no pool).
+    texto = valor.decode()
+    try:
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        return texto
+
+sqlite3.register_converter('DATETIME', converter_data_hora)
+
+# --- Observação de Consultas ---
+# Quando um observador é definido (ver metricas.py), toda consulta feita pelas
+# conexões do pool é cronometrada e as linhas lidas são contadas.
+
+_observador = None
+
+def definir_observador(observador):
+    global _observador
+    _observador = observador
+
+class CursorPool(sqlite3.Cursor):
+    # Sem row_factory, o sqlite3 monta as tuplas em C; aqui elas só são
+    # reempacotadas na classe Registro da consulta com map(), sem uma chamada
+    # Python por linha. Um row_factory definido explicitamente tem precedência.
+    _descricao = None
+    _classe = None
+
+    def _classe_registro(self):
+        # description é o mesmo objeto até o próximo execute.
+        descricao = self.description
+        if descricao is not self._descricao:
+            self._classe = classe_registro(tuple(coluna[0] for coluna in descricao))
+            self._descricao = descricao
+        return self._classe
+
+    def fetchone(self):
+        linha = super().fetchone()
+        if linha is None or self.row_factory is not None:
+            return linha
+        return self._classe_registro()(linha)
+
+    def fetchmany(self, *args, **kwargs):
+        linhas = super().fetchmany(*args, **kwargs)
+        if not linhas or self.row_factory is not None:
+            return linhas
+        return list(map(self._classe_registro(), linhas))
+
+    def fetchall(self):
+        linhas = super().fetchall()
+        if not linhas or self.row_factory is not None:
+            return linhas
+        return list(map(self._classe_registro(), linhas))
+
+    def __next__(self):
+        linha = super().__next__()
+        if self.row_factory is not None:
+            return linha
+        return self._classe_registro()(linha)
+
+class CursorObservado(CursorPool):
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            if _observador is not None:
+                _observador.consulta(self.connection, sql, parametros, time.perf_counter() - inicio)
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            if _observador is not None:
+                _observador.consulta(self.connection, sql, None, time.perf_counter() - inicio)
+
+    def _contar(self, quantidade):
+        if _observador is not None and quantidade:
+            _observador.linhas(quantidade)
+
+    def fetchone(self):
+        linha = super().fetchone()
+        self._contar(0 if linha is None else 1)
+        return linha
+
+    def fetchmany(self, *args, **kwargs):
+        linhas = super().fetchmany(*args, **kwargs)
+        self._contar(len(linhas))
+        return linhas
+
+    def fetchall(self):
+        linhas = super().fetchall()
+        self._contar(len(linhas))
+        return linhas
+
+# --- Pool de Conexões ---
+
+class ConexaoPool(sqlite3.Connection):
+    # close() devolve a conexão ao pool em vez de fechá-la; fechar() encerra de fato.
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.devolver(self)
+
+    def fechar(self):
+        super().close()
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = CursorObservado if _observador is not None else CursorPool
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+class PoolConexoes:
+    def __init__(self, caminho, tamanho=5, timeout=10.0, pragmas=None):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self._livres = queue.LifoQueue()
+        self._trava = threading.Lock()
+        self._escopo = threading.local()
+        self._criadas = 0
+        self._pid = os.getpid()
+        self._contadores = {'hits': 0, 'misses': 0, 'waits': 0, 'descartadas': 0}
+
+    def _contar(self, nome):
+        with self._trava:
+            self._contadores[nome] += 1
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.caminho, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                               check_same_thread=False, factory=ConexaoPool)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        for nome, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nome} = {valor};")
+        conn.pool = self
+        return conn
+
+    def _saudavel(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conn):
+        with self._trava:
+            self._criadas -= 1
+            self._contadores['descartadas'] += 1
+        try:
+            conn.fechar()
+        except sqlite3.Error:
+            pass
+
+    def _verificar_fork(self):
+        # Conexões herdadas de outro processo (ex.: gunicorn com preload) não podem ser reutilizadas.
+        if os.getpid() != self._pid:
+            self._livres = queue.LifoQueue()
+            self._escopo = threading.local()
+            self._criadas = 0
+            self._pid = os.getpid()
+
+    def obter(self):
+        self._verificar_fork()
+        conn = getattr(self._escopo, 'conexao', None)
+        if conn is not None:
+            return conn
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+                self._contar('hits')
+            except queue.Empty:
+                with self._trava:
+                    pode_criar = self._criadas < self.tamanho
+                    if pode_criar:
+                        self._criadas += 1
+                if pode_criar:
+                    self._contar('misses')
+                    try:
+                        conn = self._abrir()
+                    except sqlite3.Error:
+                        with self._trava:
+                            self._criadas -= 1
+                        raise
+                else:
+                    self._contar('waits')
+                    try:
+                        conn = self._livres.get(timeout=self.timeout)
+                    except queue.Empty:
+                        raise sqlite3.OperationalError("Pool de conexões esgotado.")
+            if self._saudavel(conn):
+                break
+            self._descartar(conn)
+        if getattr(self._escopo, 'ativo', False):
+            self._escopo.conexao = conn
+        return conn
+
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            self._descartar(conn)
+            return
+        if conn is getattr(self._escopo, 'conexao', None):
+            return
+        self._livres.put(conn)
+
+    def iniciar_escopo(self):
+        self._escopo.ativo = True
+
+    def encerrar_escopo(self):
+        conn = getattr(self._escopo, 'conexao', None)
+        self._escopo.ativo = False
+        self._escopo.conexao = None
+        if conn is not None:
+            self.devolver(conn)
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self._contadores)
+            dados['abertas'] = self._criadas
+        dados['livres'] = self._livres.qsize()
+        dados['tamanho'] = self.tamanho
+        return dados
+
+    def fechar_todas(self):
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+_pool = None
+_pool_trava = threading.Lock()
+_configuracao = None
+
+def obter_configuracao():
+    global _configuracao
+    if _configuracao is None:
+        _configuracao = carregar_configuracao()
+    return _configuracao
+
+def carregar_configuracao():
+    return {
+        'caminho': os.getenv("DB_PATH", "controle.db"),
+        'tamanho_pool': int(os.getenv("DB_POOL_SIZE", "5")),
+        'timeout_pool': float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        'tentativas_escrita': int(os.getenv("DB_WRITE_RETRIES", "5")),
+        'espera_escrita': float(os.getenv("DB_WRITE_BACKOFF", "0.05")),
+        'pragmas': {
+            'journal_mode': os.getenv("DB_JOURNAL_MODE", "WAL"),
+            'synchronous': os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+            'busy_timeout': int(os.getenv("DB_BUSY_TIMEOUT", "5000")),
+            'cache_size': int(os.getenv("DB_CACHE_SIZE", "-16000")),
+            'mmap_size': int(os.getenv("DB_MMAP_SIZE", "268435456")),
+        },
+        'cache_ttl': float(os.getenv("CACHE_TTL", "30")),
+        'cache_max_entradas': int(os.getenv("CACHE_MAX_ENTRIES", "256")),
+        'cache_max_itens': int(os.getenv("CACHE_MAX_ROWS", "5000")),
+        'tamanho_lote_importacao': int(os.getenv("IMPORT_BATCH_SIZE", "1000")),
+        'busca_max_candidatos': int(os.getenv("SEARCH_MAX_CANDIDATES", "1000")),
+        'prazo_devolucao_dias': int(os.getenv("OVERDUE_DAYS", "30")),
+        'tamanho_lote_relatorios': int(os.getenv("REPORTS_BATCH_SIZE", "20000")),
+        'arquivar_apos_dias': int(os.getenv("ARCHIVE_AFTER_DAYS", "365")),
+        'tamanho_lote_arquivamento': int(os.getenv("ARCHIVE_BATCH_SIZE", "500")),
+        'pausa_arquivamento': float(os.getenv("ARCHIVE_PAUSE", "0.05")),
+        'validade_requisicoes_horas': float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")),
+        'cache_paginas_ttl': float(os.getenv("PAGE_CACHE_TTL", "300")),
+        'cache_paginas_max_entradas': int(os.getenv("PAGE_CACHE_MAX_ENTRIES", "512")),
+        'eventos_intervalo': float(os.getenv("EVENTS_POLL_INTERVAL", "0.5")),
+        'eventos_heartbeat': float(os.getenv("EVENTS_HEARTBEAT", "15")),
+        'eventos_fila': int(os.getenv("EVENTS_QUEUE_SIZE", "100")),
+        'eventos_retencao_horas': float(os.getenv("EVENTS_RETENTION_HOURS", "24")),
+        'backup_pasta': os.getenv("BACKUP_DIR", "backups"),
+        'backup_paginas_por_passo': int(os.getenv("BACKUP_PAGES_PER_STEP", "256")),
+        'backup_pausa': float(os.getenv("BACKUP_STEP_PAUSE", "0.005")),
+        'backup_tamanho_bloco': int(os.getenv("BACKUP_BLOCK_SIZE", str(1024 * 1024))),
+        'backup_manter': int(os.getenv("BACKUP_KEEP", "14")),
+        'tarefas_em_segundo_plano': os.getenv("JOBS_BACKGROUND", "0") == "1",
+        'tarefas_trabalhadores': int(os.getenv("JOBS_WORKERS", "1")),
+        'tarefas_intervalo': float(os.getenv("JOBS_POLL_INTERVAL", "0.5")),
+        'tarefas_reserva': float(os.getenv("JOBS_LEASE_SECONDS", "300")),
+        'tarefas_tentativas': int(os.getenv("JOBS_MAX_ATTEMPTS", "5")),
+        'tarefas_espera_base': float(os.getenv("JOBS_BACKOFF_BASE", "5")),
+        'tarefas_espera_maxima': float(os.getenv("JOBS_BACKOFF_MAX", "600")),
+        'tarefas_retencao_horas': float(os.getenv("JOBS_RETENTION_HOURS", "168")),
+        'auditoria_ativa': os.getenv("AUDIT_ENABLED", "1") == "1",
+        'auditoria_lote': int(os.getenv("AUDIT_BATCH_SIZE", "500")),
+        'auditoria_intervalo': float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0")),
+        'auditoria_maximo_pendentes': int(os.getenv("AUDIT_MAX_PENDING", "5000")),
+    }
+
+def obter_pool():
+    global _pool
+    if _pool is None:
+        with _pool_trava:
+            if _pool is None:
+                config = obter_configuracao()
+                _pool = PoolConexoes(
+                    config['caminho'],
+                    tamanho=config['tamanho_pool'],
+                    timeout=config['timeout_pool'],
+                    pragmas=config['pragmas'],
+                )
+    return _pool
+
 def conectar():
-    conn = sqlite3.connect("controle.db", detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    return obter_pool().obter()
 
-def criar_tabelas():
-    conn = conectar()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id_usuario INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_usuario TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            senha TEXT NOT NULL,
-            cargo TEXT,
-            nivel_acesso TEXT NOT NULL CHECK (nivel_acesso IN ('Administrador', 'Técnico'))
+def iniciar_escopo_requisicao():
+    obter_pool().iniciar_escopo()
+
+def encerrar_escopo_requisicao():
+    obter_pool().encerrar_escopo()
+
+def estatisticas_pool():
+    return obter_pool().estatisticas()
+
+def restaurar_de_copia(caminho_copia):
+    # Troca o conteúdo do banco em uso pelo da cópia com a API de backup, com as escritas deste
+    # processo paradas; as demais conexões (e processos) passam a ler o banco restaurado. Versões
+    # de tabela e ids de eventos nunca voltam atrás: os caches e os painéis ao vivo dependem disso.
+    with _trava_escrita:
+        conn = sqlite3.connect(obter_configuracao()['caminho'], isolation_level=None)
+        copia = sqlite3.connect(caminho_copia)
+        try:
+            tabelas = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_schema WHERE type = 'table'")}
+            versoes = conn.execute("SELECT tabela, versao FROM versoes_tabelas").fetchall() \
+                if 'versoes_tabelas' in tabelas else []
+            sequencias = conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall() \
+                if 'sqlite_sequence' in tabelas else []
+            copia.backup(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            for tabela, versao in versoes:
+                conn.execute("UPDATE versoes_tabelas SET versao = MAX(versao, ?) + 1 WHERE tabela = ?", (versao, tabela))
+            for nome, seq in sequencias:
+                conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq, nome))
+            conn.execute("COMMIT")
+        finally:
+            copia.close()
+            conn.close()
+    # A cópia pode ser de um esquema mais antigo.
+    aplicar_migracoes()
+    obter_cache().invalidar()
+
+# --- Escritas Serializadas ---
+
+# Uma escrita por vez neste processo; entre processos, o BEGIN IMMEDIATE
+# reserva o lock de escrita do SQLite logo no início da transação.
+_trava_escrita = threading.Lock()
+
+def _banco_ocupado(erro):
+    mensagem = str(erro).lower()
+    return 'locked' in mensagem or 'busy' in mensagem
+
+@contextmanager
+def transacao_escrita(*tabelas):
+    config = obter_configuracao()
+    tentativas = config['tentativas_escrita']
+    espera = config['espera_escrita']
+    with _trava_escrita:
+        conn = conectar()
+        try:
+            if _auditor is not None:
+                _preparar_auditoria(conn)
+            for tentativa in range(tentativas):
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    if not _banco_ocupado(e) or tentativa == tentativas - 1:
+                        raise
+                    time.sleep(espera * (2 ** tentativa))
+            yield conn
+            alteracoes = _coletar_auditoria(conn)
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+            if tabelas:
+                obter_cache().invalidar(*tabelas)
+    # Fora da trava: com o buffer cheio, o auditor grava na hora (e precisa da trava para isso).
+    if alteracoes:
+        _auditor.registrar(alteracoes)
+
+# --- Auditoria ---
+# Gatilhos TEMP (só desta conexão, gravando numa tabela temporária em memória)
+# capturam o antes e o depois de toda alteração nas tabelas auditadas, venha de
+# qualquer função. No fim de cada transação de escrita as alterações são
+# recolhidas junto com o usuário que está agindo e entregues ao auditor (ver
+# auditoria.py), que as grava em lotes na tabela auditoria, fora da requisição.
+
+# Tabela: (coluna de id, operações auditadas, colunas que nunca vão para a auditoria).
+# A exclusão em movimentacoes só acontece no arquivamento, que move as linhas sem alterá-las.
+TABELAS_AUDITADAS = {
+    'equipamentos': ('id_equipamento', ('INSERT', 'UPDATE', 'DELETE'), ()),
+    'usuarios': ('id_usuario', ('INSERT', 'UPDATE', 'DELETE'), ('senha',)),
+    'clientes': ('id_cliente', ('INSERT', 'UPDATE', 'DELETE'), ()),
+    'movimentacoes': ('id_movimentacao', ('INSERT', 'UPDATE'), ()),
+}
+
+ACOES_AUDITORIA = {'INSERT': 'criacao', 'UPDATE': 'alteracao', 'DELETE': 'exclusao'}
+
+_usuario_atual = contextvars.ContextVar('usuario_atual', default=None)
+_auditor = None
+
+def definir_auditor(auditor):
+    global _auditor
+    _auditor = auditor
+
+def definir_usuario_atual(id_usuario):
+    # Quem está agindo na requisição, tarefa ou comando atual; vai em cada registro de auditoria.
+    _usuario_atual.set(id_usuario)
+
+def _json_linha(prefixo, colunas):
+    return "json_object(" + ", ".join(f"'{coluna}', {prefixo}.{coluna}" for coluna in colunas) + ")"
+
+def _preparar_auditoria(conn):
+    # Antes do BEGIN. Os gatilhos copiam a lista de colunas de cada tabela, então são refeitos
+    # sempre que o esquema muda (migrações, restauração de backup), inclusive nas conexões que
+    # já estavam abertas. Sem as tabelas auditadas (banco ainda vazio) não há o que capturar.
+    versao = conn.execute("PRAGMA main.schema_version").fetchone()[0]
+    if getattr(conn, 'auditoria_esquema', None) == versao:
+        return
+    antigos = [linha[0] for linha in conn.execute(
+        "SELECT name FROM temp.sqlite_schema WHERE type = 'trigger' AND name LIKE 'auditoria\\_%' ESCAPE '\\'")]
+    for nome in antigos:
+        conn.execute(f"DROP TRIGGER temp.{nome}")
+    existentes = {linha[0] for linha in conn.execute("SELECT name FROM main.sqlite_schema WHERE type = 'table'")}
+    conn.auditoria_esquema = versao
+    conn.auditoria_preparada = set(TABELAS_AUDITADAS) <= existentes
+    if not conn.auditoria_preparada:
+        return
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS auditoria_pendente (
+            tabela TEXT NOT NULL, id_registro INTEGER, acao TEXT NOT NULL,
+            antes TEXT, depois TEXT, momento REAL NOT NULL
         )
     ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS equipamentos (
-            id_equipamento INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_equipamento TEXT NOT NULL,
-            descricao_equipamento TEXT,
-            quantidade_estoque INTEGER NOT NULL DEFAULT 0,
-            data_cadastro DATETIME NOT NULL,
-            status TEXT NOT NULL DEFAULT 'Ativo'
-        )             
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clientes (
-            id_cliente INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_cliente TEXT NOT NULL,
-            contato TEXT
+    for tabela, (coluna_id, operacoes, ocultas) in TABELAS_AUDITADAS.items():
+        colunas = [linha[1] for linha in conn.execute(f"PRAGMA main.table_info({tabela})") if linha[1] not in ocultas]
+        for operacao in operacoes:
+            antes = _json_linha('OLD', colunas) if operacao != 'INSERT' else 'NULL'
+            depois = _json_linha('NEW', colunas) if operacao != 'DELETE' else 'NULL'
+            id_registro = f"{'OLD' if operacao == 'DELETE' else 'NEW'}.{coluna_id}"
+            quando = ""
+            if operacao == 'UPDATE':
+                quando = "WHEN " + " OR ".join(f"OLD.{coluna} IS NOT NEW.{coluna}" for coluna in colunas)
+            conn.execute(f'''
+                CREATE TEMP TRIGGER auditoria_{tabela}_{operacao.lower()}
+                AFTER {operacao} ON main.{tabela} {quando}
+                BEGIN
+                    INSERT INTO auditoria_pendente (tabela, id_registro, acao, antes, depois, momento)
+                    VALUES ('{tabela}', {id_registro}, '{ACOES_AUDITORIA[operacao]}', {antes}, {depois},
+                            {SQL_AGORA_EPOCA});
+                END
+            ''')
+
+def _coletar_auditoria(conn):
+    # Roda dentro da transação: se ela for desfeita, as linhas pendentes também são.
+    if _auditor is None or not getattr(conn, 'auditoria_preparada', False):
+        return None
+    linhas = conn.execute(
+        "SELECT tabela, id_registro, acao, antes, depois, momento FROM temp.auditoria_pendente ORDER BY rowid"
+    ).fetchall()
+    if not linhas:
+        return None
+    conn.execute("DELETE FROM temp.auditoria_pendente")
+    id_usuario = _usuario_atual.get()
+    return [(momento, id_usuario, tabela, id_registro, acao, antes, depois)
+            for tabela, id_registro, acao, antes, depois, momento in linhas]
+
+SQL_AUDITORIA_REGISTRO = '''
+    SELECT * FROM auditoria
+    WHERE tabela = ? AND id_registro = ? AND momento >= ? AND momento < ?
+    ORDER BY momento DESC, id_auditoria DESC
+    LIMIT ?
+'''
+
+SQL_AUDITORIA_USUARIO = '''
+    SELECT * FROM auditoria
+    WHERE id_usuario = ? AND momento >= ? AND momento < ?
+    ORDER BY momento DESC, id_auditoria DESC
+    LIMIT ?
+'''
+
+SQL_AUDITORIA_PERIODO = '''
+    SELECT * FROM auditoria
+    WHERE momento >= ? AND momento < ?
+    ORDER BY momento DESC, id_auditoria DESC
+    LIMIT ?
+'''
+
+def consulta_auditoria(tabela=None, id_registro=None, id_usuario=None, inicio=None, fim=None, apos=None, limite=None):
+    # Mais recentes primeiro. `apos` é o (momento, id_auditoria) do último registro da página anterior.
+    condicoes = ["momento >= ?", "momento < ?"]
+    parametros = [inicio if inicio is not None else 0, fim if fim is not None else float('inf')]
+    if tabela:
+        condicoes.append("tabela = ?")
+        parametros.append(tabela)
+    if id_registro is not None:
+        condicoes.append("id_registro = ?")
+        parametros.append(id_registro)
+    if id_usuario is not None:
+        condicoes.append("id_usuario = ?")
+        parametros.append(id_usuario)
+    if apos is not None:
+        condicoes.append("(momento, id_auditoria) < (?, ?)")
+        parametros.extend(apos)
+    sql = f'''
+        SELECT * FROM auditoria
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY momento DESC, id_auditoria DESC
+        LIMIT ?
+    '''
+    return sql, parametros + [limite or -1]
+
+# --- Cache de Leitura ---
+# As versões das tabelas ficam em versoes_tabelas e são incrementadas por
+# gatilhos, então uma escrita feita por qualquer processo invalida o cache de
+# todos os outros na próxima leitura.
+
+_cache = None
+
+def obter_cache():
+    global _cache
+    if _cache is None:
+        config = obter_configuracao()
+        _cache = CacheLeitura(config['cache_ttl'], config['cache_max_entradas'], config['cache_max_itens'])
+    return _cache
+
+def obter_versoes(tabelas):
+    conn = None
+    try:
+        conn = conectar()
+        versoes = dict(conn.execute("SELECT tabela, versao FROM versoes_tabelas").fetchall())
+        return tuple(versoes.get(tabela, 0) for tabela in tabelas)
+    except sqlite3.Error:
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def em_cache(*tabelas):
+    def decorador(funcao):
+        @wraps(funcao)
+        def envolvida(*args, **kwargs):
+            versoes = obter_versoes(tabelas)
+            if versoes is None:
+                return funcao(*args, **kwargs)
+            chave = json.dumps([funcao.__name__, args, kwargs], sort_keys=True, default=str)
+            cache = obter_cache()
+            encontrado, valor = cache.obter(chave, versoes)
+            if encontrado:
+                return list(valor)
+            valor = funcao(*args, **kwargs)
+            cache.guardar(chave, tabelas, versoes, valor)
+            return valor
+        return envolvida
+    return decorador
+
+def estatisticas_cache():
+    return obter_cache().estatisticas()
+
+# --- Consultas Críticas ---
+# Consultas de alto volume; as migrações verificam o plano de cada uma delas.
+
+SQL_MOVIMENTACOES_ABERTAS = '''
+    SELECT
+        m.id_movimentacao, m.data_retirada, m.quantidade_retirada,
+        e.nome_equipamento, u.nome_usuario, c.nome_cliente
+    FROM movimentacoes m
+    JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
+    JOIN usuarios u ON m.id_usuario = u.id_usuario
+    JOIN clientes c ON m.id_cliente = c.id_cliente
+    WHERE {condicoes}
+    ORDER BY m.data_retirada DESC, m.id_movimentacao DESC
+    LIMIT ?
+'''
+
+# Consultas de histórico: {tabela} é movimentacoes ou uma partição de arquivo (ver unir_particoes).
+SQL_MOVIMENTACOES_POR_CLIENTE = '''
+    SELECT m.data_retirada, m.data_devolucao, m.quantidade_retirada, m.observacao, e.nome_equipamento
+    FROM {tabela} m
+    JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
+    WHERE m.id_cliente = ?
+'''
+
+SQL_MOVIMENTACOES_ABERTAS_EQUIPAMENTO = '''
+    SELECT COUNT(id_movimentacao) FROM movimentacoes WHERE id_equipamento = ? AND data_devolucao IS NULL
+'''
+
+SQL_TOTAL_EM_USO = '''
+    SELECT SUM(quantidade_retirada) FROM movimentacoes WHERE data_devolucao IS NULL
+'''
+
+SQL_ULTIMAS_MOVIMENTACOES = '''
+    SELECT
+        m.data_retirada, m.data_devolucao, e.nome_equipamento,
+        u.nome_usuario, c.id_cliente, c.nome_cliente,
+        CASE
+            WHEN m.data_devolucao IS NOT NULL THEN 'Devolução'
+            ELSE 'Retirada'
+        END as tipo_movimentacao,
+        COALESCE(m.data_devolucao, m.data_retirada) AS "data_ordenacao [DATETIME]"
+    FROM movimentacoes m
+    JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
+    JOIN usuarios u ON m.id_usuario = u.id_usuario
+    JOIN clientes c ON m.id_cliente = c.id_cliente
+    ORDER BY COALESCE(m.data_devolucao, m.data_retirada) DESC
+    LIMIT ?
+'''
+
+COLUNAS_EXPORTACAO = [
+    'id_movimentacao', 'data_retirada', 'data_devolucao', 'quantidade_retirada', 'observacao',
+    'id_equipamento', 'nome_equipamento', 'id_usuario', 'nome_usuario', 'id_cliente', 'nome_cliente',
+]
+
+SQL_EXPORTACAO_MOVIMENTACOES = '''
+    SELECT
+        m.id_movimentacao, m.data_retirada, m.data_devolucao, m.quantidade_retirada, m.observacao,
+        e.id_equipamento, e.nome_equipamento, u.id_usuario, u.nome_usuario, c.id_cliente, c.nome_cliente
+    FROM {tabela} m
+    JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
+    JOIN usuarios u ON m.id_usuario = u.id_usuario
+    JOIN clientes c ON m.id_cliente = c.id_cliente
+    WHERE {condicoes}
+'''
+
+# Recalcula do zero os contadores mantidos pelos gatilhos da tabela estatisticas.
+SQL_ESTATISTICAS_CALCULADAS = '''
+    SELECT 'estoque_ativo', COALESCE(SUM(quantidade_estoque), 0) FROM equipamentos WHERE status = 'Ativo'
+    UNION ALL
+    SELECT 'em_uso', COALESCE(SUM(quantidade_retirada), 0) FROM movimentacoes WHERE data_devolucao IS NULL
+    UNION ALL
+    SELECT 'total_usuarios', COUNT(*) FROM usuarios
+'''
+
+# --- Paginação ---
+# Paginação por chave (keyset): o cursor guarda a chave de ordenação do último
+# item da página, então o custo de cada página não depende da posição dela.
+
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 200
+
+def limitar_pagina(limite):
+    if limite is None:
+        return None
+    return max(1, min(int(limite), TAMANHO_PAGINA_MAXIMO))
+
+def codificar_cursor(valores):
+    texto = json.dumps(valores, default=str)
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+def decodificar_cursor(texto):
+    if not texto:
+        return None
+    try:
+        texto += '=' * (-len(texto) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(texto.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(valores, list) or len(valores) != 2:
+        return None
+    return valores
+
+def proximo_cursor(itens, limite, coluna_ordem, coluna_id):
+    if limite is None or len(itens) < limite:
+        return None
+    ultimo = itens[-1]
+    return codificar_cursor([ultimo[coluna_ordem], ultimo[coluna_id]])
+
+def _filtro_prefixo(coluna, prefixo, condicoes, parametros):
+    if prefixo:
+        condicoes.append(f"{coluna} >= ? COLLATE NOCASE AND {coluna} < ? COLLATE NOCASE")
+        parametros.extend([prefixo, prefixo + '\U0010ffff'])
+
+def _filtro_apos_nome(coluna, coluna_id, apos, condicoes, parametros):
+    # Forma expandida de (nome, id) > (?, ?) para o SQLite usar o índice como faixa.
+    if apos:
+        condicoes.append(f"{coluna} >= ? COLLATE NOCASE AND ({coluna} > ? COLLATE NOCASE OR {coluna_id} > ?)")
+        parametros.extend([apos[0], apos[0], apos[1]])
+
+def consulta_equipamentos(prefixo=None, status='Ativo', apos=None, limite=None):
+    condicoes = ["status = ?"]
+    parametros = [status]
+    _filtro_prefixo("nome_equipamento", prefixo, condicoes, parametros)
+    _filtro_apos_nome("nome_equipamento", "id_equipamento", apos, condicoes, parametros)
+    sql = f'''
+        SELECT * FROM equipamentos
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY nome_equipamento COLLATE NOCASE, id_equipamento
+        LIMIT ?
+    '''
+    return sql, parametros + [limite or -1]
+
+def consulta_clientes(prefixo=None, apos=None, limite=None):
+    condicoes = ["1 = 1"]
+    parametros = []
+    _filtro_prefixo("nome_cliente", prefixo, condicoes, parametros)
+    _filtro_apos_nome("nome_cliente", "id_cliente", apos, condicoes, parametros)
+    sql = f'''
+        SELECT * FROM clientes
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY nome_cliente COLLATE NOCASE, id_cliente
+        LIMIT ?
+    '''
+    return sql, parametros + [limite or -1]
+
+def consulta_usuarios(prefixo=None, nivel_acesso=None, apos=None, limite=None):
+    condicoes = ["1 = 1"]
+    parametros = []
+    if nivel_acesso:
+        condicoes.append("nivel_acesso = ?")
+        parametros.append(nivel_acesso)
+    _filtro_prefixo("nome_usuario", prefixo, condicoes, parametros)
+    _filtro_apos_nome("nome_usuario", "id_usuario", apos, condicoes, parametros)
+    sql = f'''
+        SELECT id_usuario, nome_usuario, email, cargo, nivel_acesso FROM usuarios
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY nome_usuario COLLATE NOCASE, id_usuario
+        LIMIT ?
+    '''
+    return sql, parametros + [limite or -1]
+
+def unir_particoes(sql_parte, parametros, particoes, final):
+    # Repete a consulta em movimentacoes e em cada partição de arquivo. Com o ORDER BY no fim do
+    # UNION ALL, o SQLite intercala as partes já ordenadas pelos índices (MERGE), sem ordenar tudo.
+    tabelas = ('movimentacoes',) + tuple(particoes)
+    partes = [sql_parte.replace('{tabela}', tabela) for tabela in tabelas]
+    return '\n    UNION ALL\n'.join(partes) + final, list(parametros) * len(tabelas)
+
+def consulta_movimentacoes_por_cliente(id_cliente, limite=None, particoes=()):
+    sql, parametros = unir_particoes(SQL_MOVIMENTACOES_POR_CLIENTE, [id_cliente], particoes,
+                                     '    ORDER BY data_retirada DESC\n    LIMIT ?\n')
+    return sql, parametros + [limite or -1]
+
+def consulta_exportacao_movimentacoes(id_cliente=None, id_equipamento=None, data_inicio=None, data_fim=None,
+                                      particoes=()):
+    condicoes = ["1 = 1"]
+    parametros = []
+    if id_cliente:
+        condicoes.append("m.id_cliente = ?")
+        parametros.append(id_cliente)
+    if id_equipamento:
+        condicoes.append("m.id_equipamento = ?")
+        parametros.append(id_equipamento)
+    if data_inicio:
+        condicoes.append("m.data_retirada >= ?")
+        parametros.append(data_inicio)
+    if data_fim:
+        condicoes.append("m.data_retirada < date(?, '+1 day')")
+        parametros.append(data_fim)
+    return unir_particoes(SQL_EXPORTACAO_MOVIMENTACOES.replace('{condicoes}', ' AND '.join(condicoes)), parametros,
+                          particoes, '    ORDER BY data_retirada, id_movimentacao\n')
+
+def consulta_movimentacoes_abertas(data_inicio=None, data_fim=None, apos=None, limite=None):
+    condicoes = ["m.data_devolucao IS NULL"]
+    parametros = []
+    if data_inicio:
+        condicoes.append("m.data_retirada >= ?")
+        parametros.append(data_inicio)
+    if data_fim:
+        condicoes.append("m.data_retirada < date(?, '+1 day')")
+        parametros.append(data_fim)
+    if apos:
+        condicoes.append("(m.data_retirada, m.id_movimentacao) < (?, ?)")
+        parametros.extend(apos)
+    sql = SQL_MOVIMENTACOES_ABERTAS.format(condicoes=' AND '.join(condicoes))
+    return sql, parametros + [limite or -1]
+
+# --- Busca Textual ---
+# Tabelas FTS5 de conteúdo externo: o texto fica só na tabela original e os
+# gatilhos mantêm o índice. Atualizações de estoque não tocam no índice.
+
+INDICES_BUSCA = [
+    ('equipamentos', 'id_equipamento', ('nome_equipamento', 'descricao_equipamento')),
+    ('clientes', 'id_cliente', ('nome_cliente', 'contato')),
+]
+
+def _comandos_indice_busca(tabela, chave, colunas):
+    fts = f"{tabela}_fts"
+    lista = ', '.join(colunas)
+    novos = ', '.join(f"NEW.{coluna}" for coluna in colunas)
+    antigos = ', '.join(f"OLD.{coluna}" for coluna in colunas)
+    return [
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {lista}, content='{tabela}', content_rowid='{chave}',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
         )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS movimentacoes (
-            id_movimentacao INTEGER PRIMARY KEY AUTOINCREMENT,
+        ''',
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {tabela}
+        BEGIN
+            INSERT INTO {fts}(rowid, {lista}) VALUES (NEW.{chave}, {novos});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {tabela}
+        BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', OLD.{chave}, {antigos});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {lista} ON {tabela}
+        BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', OLD.{chave}, {antigos});
+            INSERT INTO {fts}(rowid, {lista}) VALUES (NEW.{chave}, {novos});
+        END
+        ''',
+    ]
+
+def _comandos_indice_busca_ativos(tabela, chave, colunas):
+    # Só os registros ativos ficam no índice: a busca não perde espaço na lista de candidatos
+    # com equipamentos desativados. Num índice de conteúdo externo o 'delete' precisa dos
+    # valores que foram indexados, então só é emitido para linhas que estavam no índice.
+    fts = f"{tabela}_fts"
+    lista = ', '.join(colunas)
+    novos = ', '.join(f"NEW.{coluna}" for coluna in colunas)
+    antigos = ', '.join(f"OLD.{coluna}" for coluna in colunas)
+    return [
+        f"DROP TRIGGER IF EXISTS trg_{fts}_insert",
+        f"DROP TRIGGER IF EXISTS trg_{fts}_delete",
+        f"DROP TRIGGER IF EXISTS trg_{fts}_update",
+        f"INSERT INTO {fts}({fts}) VALUES ('delete-all')",
+        f"INSERT INTO {fts}(rowid, {lista}) SELECT {chave}, {lista} FROM {tabela} WHERE status = 'Ativo'",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {tabela} WHEN NEW.status = 'Ativo'
+        BEGIN
+            INSERT INTO {fts}(rowid, {lista}) VALUES (NEW.{chave}, {novos});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {tabela} WHEN OLD.status = 'Ativo'
+        BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', OLD.{chave}, {antigos});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {lista}, status ON {tabela}
+        BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista})
+            SELECT 'delete', OLD.{chave}, {antigos} WHERE OLD.status = 'Ativo';
+            INSERT INTO {fts}(rowid, {lista})
+            SELECT NEW.{chave}, {novos} WHERE NEW.status = 'Ativo';
+        END
+        ''',
+    ]
+
+# Ordenar todas as ocorrências de um prefixo muito comum custa caro; a
+# relevância (bm25, nome com peso 10) é calculada sobre os melhores candidatos
+# (ORDER BY rank com LIMIT deixa o FTS5 manter só os N melhores), e só eles
+# passam pelo join com a tabela original.
+SQL_BUSCA = {
+    'equipamentos': '''
+        SELECT e.id_equipamento, e.nome_equipamento, e.descricao_equipamento, e.quantidade_estoque
+        FROM (SELECT rowid AS id, rank FROM equipamentos_fts WHERE equipamentos_fts MATCH ? ORDER BY rank LIMIT ?) f
+        JOIN equipamentos e ON e.id_equipamento = f.id
+        WHERE e.status = 'Ativo'
+        ORDER BY f.rank
+        LIMIT ? OFFSET ?
+    ''',
+    'clientes': '''
+        SELECT c.id_cliente, c.nome_cliente, c.contato
+        FROM (SELECT rowid AS id, rank FROM clientes_fts WHERE clientes_fts MATCH ? ORDER BY rank LIMIT ?) f
+        JOIN clientes c ON c.id_cliente = f.id
+        ORDER BY f.rank
+        LIMIT ? OFFSET ?
+    ''',
+}
+
+def montar_consulta_busca(termo):
+    # Cada palavra vira um prefixo entre aspas, então o texto digitado nunca é lido como sintaxe FTS5.
+    palavras = re.findall(r"\w+", termo or '')
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+# --- Razão de Estoque ---
+# estoque_lancamentos é só de inclusão: cada variação de quantidade_estoque
+# (cadastro, retirada, devolução, ajuste manual) vira uma linha. Os snapshots
+# guardam o saldo de cada equipamento antes de um instante; o saldo em T é o
+# snapshot mais recente até T somado aos lançamentos entre os dois. Todos os
+# limites de data são exclusivos e comparados como texto no formato gravado.
+
+ORIGENS_LANCAMENTO = ('inicial', 'cadastro', 'retirada', 'devolucao', 'ajuste')
+
+SQL_ULTIMO_SNAPSHOT = '''
+    SELECT MAX(data) FROM estoque_snapshots WHERE data <= ?
+'''
+
+# Parâmetros: snapshot, snapshot, limite. Equipamentos sem linha no snapshot têm saldo zero.
+SQL_SALDOS_ESTOQUE = '''
+    SELECT id_equipamento, SUM(quantidade) AS quantidade
+    FROM (
+        SELECT id_equipamento, quantidade FROM estoque_snapshots WHERE data = ?
+        UNION ALL
+        SELECT id_equipamento, variacao FROM estoque_lancamentos WHERE data >= ? AND data < ?
+    )
+    GROUP BY id_equipamento
+'''
+
+SQL_ESTOQUE_EM = f'''
+    SELECT s.id_equipamento, e.nome_equipamento, s.quantidade
+    FROM ({SQL_SALDOS_ESTOQUE}) s
+    JOIN equipamentos e ON e.id_equipamento = s.id_equipamento
+    ORDER BY e.nome_equipamento COLLATE NOCASE, s.id_equipamento
+'''
+
+SQL_ESTOQUE_EQUIPAMENTO_EM = '''
+    SELECT
+        COALESCE((SELECT quantidade FROM estoque_snapshots WHERE data = ? AND id_equipamento = ?), 0)
+        + COALESCE((SELECT SUM(variacao) FROM estoque_lancamentos
+                    WHERE id_equipamento = ? AND data >= ? AND data < ?), 0)
+'''
+
+SQL_SERIE_ESTOQUE = '''
+    SELECT data, origem, variacao, id_movimentacao,
+           ? + SUM(variacao) OVER (ORDER BY data, id_lancamento) AS quantidade
+    FROM estoque_lancamentos
+    WHERE id_equipamento = ? AND data >= ? AND data < ?
+    ORDER BY data, id_lancamento
+'''
+
+def _limite_momento(momento, fim_do_dia=True):
+    # Converte data/datetime (ou texto ISO) no limite exclusivo usado pelas consultas do razão.
+    # Uma data sozinha cobre o dia inteiro (fim_do_dia) ou começa nele; um instante se inclui.
+    if momento is None:
+        momento = obter_hora_atual()
+    if isinstance(momento, str):
+        momento = datetime.fromisoformat(momento) if len(momento) > 10 else date.fromisoformat(momento)
+    if not isinstance(momento, datetime):
+        dia = momento + timedelta(days=1) if fim_do_dia else momento
+        return str(datetime.combine(dia, datetime.min.time(), FUSO_HORARIO_SP))
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=FUSO_HORARIO_SP)
+    return str(momento.astimezone(FUSO_HORARIO_SP) + timedelta(microseconds=1))
+
+def _snapshot_anterior(conn, limite):
+    # '' é menor que qualquer data: sem snapshot, o saldo sai de todos os lançamentos.
+    return conn.execute(SQL_ULTIMO_SNAPSHOT, (limite,)).fetchone()[0] or ''
+
+# --- Relatórios ---
+# Totais diários por equipamento e por cliente e um histograma de duração dos
+# empréstimos, alimentados de forma incremental pelo razão de estoque: o
+# progresso guarda o último id_lancamento processado, então devoluções de
+# retiradas antigas também entram. Atrasos e estoque baixo são estado atual e
+# saem direto de índices parciais.
+
+SQL_RELATORIO_LANCAMENTOS = '''
+    SELECT MAX(id_lancamento) FROM (
+        SELECT id_lancamento FROM estoque_lancamentos WHERE id_lancamento > ? ORDER BY id_lancamento LIMIT ?
+    )
+'''
+
+SQL_ACUMULAR_DIARIO_EQUIPAMENTOS = '''
+    INSERT INTO relatorio_diario_equipamentos
+        (dia, id_equipamento, retiradas, quantidade_retirada, devolucoes, quantidade_devolvida)
+    SELECT substr(data, 1, 10), id_equipamento,
+           SUM(origem = 'retirada'), SUM(CASE WHEN origem = 'retirada' THEN -variacao ELSE 0 END),
+           SUM(origem = 'devolucao'), SUM(CASE WHEN origem = 'devolucao' THEN variacao ELSE 0 END)
+    FROM estoque_lancamentos
+    WHERE id_lancamento > ? AND id_lancamento <= ? AND origem IN ('retirada', 'devolucao')
+    GROUP BY 1, 2
+    ON CONFLICT (dia, id_equipamento) DO UPDATE SET
+        retiradas = retiradas + excluded.retiradas,
+        quantidade_retirada = quantidade_retirada + excluded.quantidade_retirada,
+        devolucoes = devolucoes + excluded.devolucoes,
+        quantidade_devolvida = quantidade_devolvida + excluded.quantidade_devolvida
+'''
+
+SQL_ACUMULAR_DIARIO_CLIENTES = '''
+    INSERT INTO relatorio_diario_clientes
+        (dia, id_cliente, retiradas, quantidade_retirada, devolucoes, quantidade_devolvida)
+    SELECT substr(l.data, 1, 10), m.id_cliente,
+           SUM(l.origem = 'retirada'), SUM(CASE WHEN l.origem = 'retirada' THEN -l.variacao ELSE 0 END),
+           SUM(l.origem = 'devolucao'), SUM(CASE WHEN l.origem = 'devolucao' THEN l.variacao ELSE 0 END)
+    FROM estoque_lancamentos l
+    JOIN movimentacoes m ON m.id_movimentacao = l.id_movimentacao
+    WHERE l.id_lancamento > ? AND l.id_lancamento <= ? AND l.origem IN ('retirada', 'devolucao')
+    GROUP BY 1, 2
+    ON CONFLICT (dia, id_cliente) DO UPDATE SET
+        retiradas = retiradas + excluded.retiradas,
+        quantidade_retirada = quantidade_retirada + excluded.quantidade_retirada,
+        devolucoes = devolucoes + excluded.devolucoes,
+        quantidade_devolvida = quantidade_devolvida + excluded.quantidade_devolvida
+'''
+
+# julianday() entende o fuso gravado nas datas, então a diferença já sai correta em segundos.
+SQL_DURACOES_DEVOLVIDAS = '''
+    SELECT l.id_equipamento, (julianday(l.data) - julianday(m.data_retirada)) * 86400
+    FROM estoque_lancamentos l
+    JOIN movimentacoes m ON m.id_movimentacao = l.id_movimentacao
+    WHERE l.id_lancamento > ? AND l.id_lancamento <= ? AND l.origem = 'devolucao'
+'''
+
+SQL_RELATORIO_DIARIO = '''
+    SELECT dia, SUM(retiradas) AS retiradas, SUM(quantidade_retirada) AS quantidade_retirada,
+           SUM(devolucoes) AS devolucoes, SUM(quantidade_devolvida) AS quantidade_devolvida
+    FROM relatorio_diario_equipamentos
+    WHERE dia >= ? AND dia <= ?
+    GROUP BY dia
+    ORDER BY dia
+'''
+
+SQL_RANKING_EQUIPAMENTOS = '''
+    SELECT r.id_equipamento, e.nome_equipamento, SUM(r.retiradas) AS retiradas,
+           SUM(r.quantidade_retirada) AS quantidade_retirada, SUM(r.devolucoes) AS devolucoes
+    FROM relatorio_diario_equipamentos r
+    JOIN equipamentos e ON e.id_equipamento = r.id_equipamento
+    WHERE r.dia >= ? AND r.dia <= ?
+    GROUP BY r.id_equipamento
+    ORDER BY quantidade_retirada DESC, r.id_equipamento
+    LIMIT ?
+'''
+
+SQL_RANKING_CLIENTES = '''
+    SELECT r.id_cliente, c.nome_cliente, SUM(r.retiradas) AS retiradas,
+           SUM(r.quantidade_retirada) AS quantidade_retirada, SUM(r.devolucoes) AS devolucoes
+    FROM relatorio_diario_clientes r
+    JOIN clientes c ON c.id_cliente = r.id_cliente
+    WHERE r.dia >= ? AND r.dia <= ?
+    GROUP BY r.id_cliente
+    ORDER BY quantidade_retirada DESC, r.id_cliente
+    LIMIT ?
+'''
+
+SQL_DURACOES = '''
+    SELECT d.id_equipamento, e.nome_equipamento, d.faixa, d.devolucoes, d.soma_segundos
+    FROM relatorio_duracoes d
+    JOIN equipamentos e ON e.id_equipamento = d.id_equipamento
+    ORDER BY d.id_equipamento, d.faixa
+'''
+
+SQL_TOTAL_ATRASADOS = '''
+    SELECT COUNT(*) AS movimentacoes, COALESCE(SUM(quantidade_retirada), 0) AS quantidade
+    FROM movimentacoes
+    WHERE data_devolucao IS NULL AND data_retirada < ?
+'''
+
+SQL_ESTOQUE_BAIXO = '''
+    SELECT id_equipamento, nome_equipamento, quantidade_estoque, estoque_minimo
+    FROM equipamentos
+    WHERE status = 'Ativo' AND quantidade_estoque < estoque_minimo
+    ORDER BY nome_equipamento COLLATE NOCASE
+    LIMIT ?
+'''
+
+# --- Arquivamento ---
+# Movimentações devolvidas há mais que o horizonte saem de movimentacoes para
+# uma tabela por ano da retirada (movimentacoes_arquivo_AAAA), no mesmo banco:
+# cópia e remoção de cada lote são uma única transação. O histórico por
+# cliente e a exportação leem as partições via unir_particoes.
+
+SQL_MOVIMENTACOES_ARQUIVAVEIS = '''
+    SELECT id_movimentacao, CAST(substr(data_retirada, 1, 4) AS INTEGER) AS ano
+    FROM movimentacoes
+    WHERE data_devolucao IS NOT NULL AND data_devolucao < ?
+    ORDER BY data_devolucao
+    LIMIT ?
+'''
+
+COLUNAS_MOVIMENTACOES = ('id_movimentacao, id_equipamento, id_usuario, id_cliente, data_retirada, '
+                         'quantidade_retirada, data_devolucao, observacao')
+
+def _comandos_particao(tabela):
+    return [
+        f'''
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            id_movimentacao INTEGER PRIMARY KEY,
             id_equipamento INTEGER NOT NULL,
             id_usuario INTEGER NOT NULL,
             id_cliente INTEGER NOT NULL,
             data_retirada DATETIME NOT NULL,
             quantidade_retirada INTEGER NOT NULL,
             data_devolucao DATETIME,
-            observacao TEXT,
-            FOREIGN KEY(id_equipamento) REFERENCES equipamentos(id_equipamento),
-            FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario),
-            FOREIGN KEY(id_cliente) REFERENCES clientes(id_cliente)
-        )                      
-    ''')
-    conn.commit()
-    conn.close()
+            observacao TEXT
+        )
+        ''',
+        f"CREATE INDEX IF NOT EXISTS idx_{tabela}_cliente_data ON {tabela} (id_cliente, data_retirada)",
+        f"CREATE INDEX IF NOT EXISTS idx_{tabela}_equipamento_data ON {tabela} (id_equipamento, data_retirada)",
+        f"CREATE INDEX IF NOT EXISTS idx_{tabela}_data ON {tabela} (data_retirada)",
+    ]
 
-def adicionar_equipamento(nome, descricao, quantidade):
-    conn = None
+def _ano(data, padrao):
+    return int(data[:4]) if data and data[:4].isdigit() else padrao
+
+def _particoes(conn, data_inicio=None, data_fim=None):
+    # Partições em ordem de ano; com um período, só as dos anos que ele cobre.
+    return [linha[0] for linha in conn.execute('''
+        SELECT tabela FROM particoes_movimentacoes WHERE ano >= ? AND ano <= ? ORDER BY ano
+    ''', (_ano(data_inicio, 0), _ano(data_fim, 9999)))]
+
+def _consultas_historico(particoes):
+    return [
+        consulta_movimentacoes_por_cliente(1, particoes=particoes)[0],
+        consulta_exportacao_movimentacoes(particoes=particoes)[0],
+        consulta_exportacao_movimentacoes(id_cliente=1, data_inicio='2000-01-01', particoes=particoes)[0],
+        consulta_exportacao_movimentacoes(id_equipamento=1, data_fim='2000-01-31', particoes=particoes)[0],
+    ]
+
+# --- Requisições Idempotentes ---
+# Os lotes da API aceitam um id de requisição escolhido pelo cliente. A resposta
+# é gravada na mesma transação do lote: um reenvio (o coletor perdeu a resposta)
+# recebe o resultado original em vez de repetir retiradas ou devoluções.
+
+class ErroChaveIdempotencia(Exception):
+    pass
+
+SQL_REQUISICAO_IDEMPOTENTE = '''
+    SELECT operacao, assinatura, resposta FROM requisicoes_idempotentes
+    WHERE id_usuario = ? AND chave = ?
+'''
+
+def _executar_idempotente(conn, id_usuario, chave, operacao, argumentos, executar):
+    # Sem chave, só executa. Com uma chave já usada devolve a resposta gravada; se os dados
+    # forem outros, a chave foi reaproveitada por engano e o lote não é aplicado.
+    if not chave:
+        return executar()
+    assinatura = hashlib.sha256(json.dumps([operacao, argumentos], default=str).encode('utf-8')).hexdigest()
+    anterior = conn.execute(SQL_REQUISICAO_IDEMPOTENTE, (id_usuario, chave)).fetchone()
+    if anterior is not None:
+        if (anterior['operacao'], anterior['assinatura']) != (operacao, assinatura):
+            raise ErroChaveIdempotencia(f"O id de requisição '{chave}' já foi usado com outros dados.")
+        return json.loads(anterior['resposta'])
+    resultado = executar()
+    conn.execute('''
+        INSERT INTO requisicoes_idempotentes (id_usuario, chave, operacao, assinatura, resposta, criada_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (id_usuario, chave, operacao, assinatura, json.dumps(resultado, ensure_ascii=False, default=str), time.time()))
+    return resultado
+
+# --- Eventos ---
+# Registro de mudanças para as atualizações ao vivo (ver eventos.py). Os
+# gatilhos gravam cada retirada, devolução e alteração de equipamento na mesma
+# transação da escrita, venha ela de qualquer processo; os assinantes leem a
+# tabela a partir do último id que já receberam.
+
+SQL_EVENTOS_APOS = '''
+    SELECT id_evento, tipo, dados FROM eventos
+    WHERE id_evento > ?
+    ORDER BY id_evento
+    LIMIT ?
+'''
+
+# Segundos desde 1970 (unixepoch com fração só existe a partir do SQLite 3.42).
+SQL_AGORA_EPOCA = "((julianday('now') - 2440587.5) * 86400.0)"
+
+def _gatilho_evento(nome, momento, tipo, quando, dados):
+    return f'''
+    CREATE TRIGGER IF NOT EXISTS {nome}
+    {momento}{f" WHEN {quando}" if quando else ""}
+    BEGIN
+        INSERT INTO eventos (tipo, dados, criado_em) VALUES ('{tipo}', {dados}, {SQL_AGORA_EPOCA});
+    END
+    '''
+
+# --- Fila de Tarefas ---
+# Trabalho demorado sai da requisição: a view grava a tarefa e responde na hora;
+# processos trabalhadores (ver tarefas.py) reservam a próxima por prioridade. A
+# reserva tem prazo: se o trabalhador morrer, a tarefa volta para a fila quando o
+# prazo vence. Cada falha reagenda a tarefa com espera exponencial até o limite
+# de tentativas. Os horários são segundos desde 1970, como nas sessões.
+
+SQL_PROXIMA_TAREFA = '''
+    SELECT id_tarefa FROM tarefas
+    WHERE estado = 'pendente' AND disponivel_em <= ?
+    ORDER BY prioridade DESC, id_tarefa
+    LIMIT 1
+'''
+
+SQL_RESERVAS_VENCIDAS = '''
+    SELECT id_tarefa FROM tarefas
+    WHERE estado = 'executando' AND reservada_ate < ?
+'''
+
+SQL_TAREFAS_POR_ESTADO = '''
+    SELECT * FROM tarefas
+    WHERE estado = ?
+    ORDER BY id_tarefa DESC
+    LIMIT ?
+'''
+
+SQL_TAREFAS_ANTIGAS = '''
+    SELECT id_tarefa FROM tarefas
+    WHERE estado IN ('concluida', 'falhou') AND atualizada_em < ?
+'''
+
+# --- Migrações ---
+# A versão do esquema fica em PRAGMA user_version. Cada migração roda uma única
+# vez, em ordem, e só é gravada se os planos das consultas listadas não
+# caírem em varredura completa de tabela.
+
+class ErroPlanoConsulta(Exception):
+    pass
+
+MIGRACOES = [
+    {
+        'versao': 1,
+        'descricao': 'Tabelas iniciais',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS usuarios (
+                id_usuario INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_usuario TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                senha TEXT NOT NULL,
+                cargo TEXT,
+                nivel_acesso TEXT NOT NULL CHECK (nivel_acesso IN ('Administrador', 'Técnico'))
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS equipamentos (
+                id_equipamento INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_equipamento TEXT NOT NULL,
+                descricao_equipamento TEXT,
+                quantidade_estoque INTEGER NOT NULL DEFAULT 0,
+                data_cadastro DATETIME NOT NULL,
+                status TEXT NOT NULL DEFAULT 'Ativo'
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS clientes (
+                id_cliente INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_cliente TEXT NOT NULL,
+                contato TEXT
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS movimentacoes (
+                id_movimentacao INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_equipamento INTEGER NOT NULL,
+                id_usuario INTEGER NOT NULL,
+                id_cliente INTEGER NOT NULL,
+                data_retirada DATETIME NOT NULL,
+                quantidade_retirada INTEGER NOT NULL,
+                data_devolucao DATETIME,
+                observacao TEXT,
+                FOREIGN KEY(id_equipamento) REFERENCES equipamentos(id_equipamento),
+                FOREIGN KEY(id_usuario) REFERENCES usuarios(id_usuario),
+                FOREIGN KEY(id_cliente) REFERENCES clientes(id_cliente)
+            )
+            ''',
+        ],
+        'consultas_verificadas': [],
+    },
+    {
+        'versao': 2,
+        'descricao': 'Índices de movimentações',
+        'comandos': [
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_abertas
+            ON movimentacoes (data_retirada) WHERE data_devolucao IS NULL
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_abertas_equipamento
+            ON movimentacoes (id_equipamento, quantidade_retirada) WHERE data_devolucao IS NULL
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_cliente_data
+            ON movimentacoes (id_cliente, data_retirada)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_ordenacao
+            ON movimentacoes (COALESCE(data_devolucao, data_retirada))
+            ''',
+        ],
+        'consultas_verificadas': [
+            consulta_movimentacoes_abertas()[0],
+            consulta_movimentacoes_por_cliente(1)[0],
+            SQL_MOVIMENTACOES_ABERTAS_EQUIPAMENTO,
+            SQL_TOTAL_EM_USO,
+            SQL_ULTIMAS_MOVIMENTACOES,
+        ],
+    },
+    {
+        'versao': 3,
+        'descricao': 'Índices para listagens paginadas',
+        'comandos': [
+            '''
+            CREATE INDEX IF NOT EXISTS idx_equipamentos_status_nome
+            ON equipamentos (status, nome_equipamento COLLATE NOCASE)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_clientes_nome
+            ON clientes (nome_cliente COLLATE NOCASE)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_usuarios_nome
+            ON usuarios (nome_usuario COLLATE NOCASE)
+            ''',
+        ],
+        'consultas_verificadas': [
+            consulta_equipamentos(prefixo='a', apos=['a', 1], limite=TAMANHO_PAGINA_PADRAO)[0],
+            consulta_clientes(prefixo='a', apos=['a', 1], limite=TAMANHO_PAGINA_PADRAO)[0],
+            consulta_usuarios(prefixo='a', apos=['a', 1], limite=TAMANHO_PAGINA_PADRAO)[0],
+            consulta_movimentacoes_abertas('2000-01-01', '2000-01-31', apos=['2000-01-01', 1],
+                                           limite=TAMANHO_PAGINA_PADRAO)[0],
+        ],
+    },
+    {
+        'versao': 4,
+        'descricao': 'Contadores do dashboard mantidos por gatilhos',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS estatisticas (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            f'''
+            INSERT OR REPLACE INTO estatisticas (chave, valor) {SQL_ESTATISTICAS_CALCULADAS}
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_equipamentos_estatisticas_insert
+            AFTER INSERT ON equipamentos WHEN NEW.status = 'Ativo'
+            BEGIN
+                UPDATE estatisticas SET valor = valor + NEW.quantidade_estoque WHERE chave = 'estoque_ativo';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_equipamentos_estatisticas_update
+            AFTER UPDATE OF quantidade_estoque, status ON equipamentos
+            BEGIN
+                UPDATE estatisticas
+                SET valor = valor
+                    - CASE WHEN OLD.status = 'Ativo' THEN OLD.quantidade_estoque ELSE 0 END
+                    + CASE WHEN NEW.status = 'Ativo' THEN NEW.quantidade_estoque ELSE 0 END
+                WHERE chave = 'estoque_ativo';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_equipamentos_estatisticas_delete
+            AFTER DELETE ON equipamentos WHEN OLD.status = 'Ativo'
+            BEGIN
+                UPDATE estatisticas SET valor = valor - OLD.quantidade_estoque WHERE chave = 'estoque_ativo';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_estatisticas_insert
+            AFTER INSERT ON movimentacoes WHEN NEW.data_devolucao IS NULL
+            BEGIN
+                UPDATE estatisticas SET valor = valor + NEW.quantidade_retirada WHERE chave = 'em_uso';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_estatisticas_update
+            AFTER UPDATE OF data_devolucao, quantidade_retirada ON movimentacoes
+            BEGIN
+                UPDATE estatisticas
+                SET valor = valor
+                    - CASE WHEN OLD.data_devolucao IS NULL THEN OLD.quantidade_retirada ELSE 0 END
+                    + CASE WHEN NEW.data_devolucao IS NULL THEN NEW.quantidade_retirada ELSE 0 END
+                WHERE chave = 'em_uso';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_estatisticas_delete
+            AFTER DELETE ON movimentacoes WHEN OLD.data_devolucao IS NULL
+            BEGIN
+                UPDATE estatisticas SET valor = valor - OLD.quantidade_retirada WHERE chave = 'em_uso';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_estatisticas_insert
+            AFTER INSERT ON usuarios
+            BEGIN
+                UPDATE estatisticas SET valor = valor + 1 WHERE chave = 'total_usuarios';
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_estatisticas_delete
+            AFTER DELETE ON usuarios
+            BEGIN
+                UPDATE estatisticas SET valor = valor - 1 WHERE chave = 'total_usuarios';
+            END
+            ''',
+        ],
+        'consultas_verificadas': [],
+    },
+    {
+        'versao': 5,
+        'descricao': 'Versões de tabelas para invalidação do cache',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS versoes_tabelas (
+                tabela TEXT PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT OR IGNORE INTO versoes_tabelas (tabela, versao)
+            VALUES ('equipamentos', 0), ('usuarios', 0), ('clientes', 0), ('movimentacoes', 0)
+            ''',
+        ] + [
+            f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabela}_versao_{operacao.lower()}
+            AFTER {operacao} ON {tabela}
+            BEGIN
+                UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = '{tabela}';
+            END
+            '''
+            for tabela in ('equipamentos', 'usuarios', 'clientes', 'movimentacoes')
+            for operacao in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+        'consultas_verificadas': [],
+    },
+    {
+        'versao': 6,
+        'descricao': 'Índices para exportação do histórico',
+        'comandos': [
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_equipamento_data
+            ON movimentacoes (id_equipamento, data_retirada)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_data
+            ON movimentacoes (data_retirada)
+            ''',
+        ],
+        'consultas_verificadas': [
+            consulta_exportacao_movimentacoes()[0],
+            consulta_exportacao_movimentacoes(id_cliente=1, data_inicio='2000-01-01')[0],
+            consulta_exportacao_movimentacoes(id_equipamento=1, data_fim='2000-01-31')[0],
+            consulta_exportacao_movimentacoes(data_inicio='2000-01-01', data_fim='2000-01-31')[0],
+        ],
+    },
+    {
+        'versao': 7,
+        'descricao': 'Controle de importações em lote',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS importacoes (
+                id_importacao INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                hash_arquivo TEXT NOT NULL,
+                ultima_linha INTEGER NOT NULL DEFAULT 0,
+                linhas_importadas INTEGER NOT NULL DEFAULT 0,
+                concluida INTEGER NOT NULL DEFAULT 0,
+                data_inicio DATETIME NOT NULL,
+                data_fim DATETIME,
+                UNIQUE (tipo, hash_arquivo)
+            )
+            ''',
+        ],
+        'consultas_verificadas': [],
+    },
+    {
+        'versao': 8,
+        'descricao': 'Busca textual (FTS5) de equipamentos e clientes',
+        'comandos': [
+            comando
+            for tabela, chave, colunas in INDICES_BUSCA
+            for comando in _comandos_indice_busca(tabela, chave, colunas)
+        ],
+        'consultas_verificadas': [],
+    },
+    {
+        'versao': 9,
+        'descricao': 'Sessões no servidor com o usuário em cache',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS sessoes (
+                id_sessao TEXT PRIMARY KEY,
+                id_usuario INTEGER,
+                nome_usuario TEXT,
+                nivel_acesso TEXT,
+                dados TEXT NOT NULL DEFAULT '{}',
+                expira_em REAL NOT NULL
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_sessoes_usuario ON sessoes (id_usuario)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_sessoes_expiracao ON sessoes (expira_em)
+            ''',
+            # O usuário em cache na sessão acompanha as alterações do cadastro.
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_sessoes_update
+            AFTER UPDATE OF nome_usuario, nivel_acesso ON usuarios
+            BEGIN
+                UPDATE sessoes SET nome_usuario = NEW.nome_usuario, nivel_acesso = NEW.nivel_acesso
+                WHERE id_usuario = NEW.id_usuario;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_sessoes_delete
+            AFTER DELETE ON usuarios
+            BEGIN
+                DELETE FROM sessoes WHERE id_usuario = OLD.id_usuario;
+            END
+            ''',
+        ],
+        'consultas_verificadas': [
+            'DELETE FROM sessoes WHERE id_usuario = ?',
+            'DELETE FROM sessoes WHERE expira_em < ?',
+        ],
+    },
+    {
+        'versao': 10,
+        'descricao': 'Razão de estoque com snapshots',
+        'comandos': [
+            f'''
+            CREATE TABLE IF NOT EXISTS estoque_lancamentos (
+                id_lancamento INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_equipamento INTEGER NOT NULL,
+                data DATETIME NOT NULL,
+                variacao INTEGER NOT NULL,
+                origem TEXT NOT NULL CHECK (origem IN {ORIGENS_LANCAMENTO}),
+                id_movimentacao INTEGER
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_lancamentos_equipamento_data
+            ON estoque_lancamentos (id_equipamento, data)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_lancamentos_data
+            ON estoque_lancamentos (data)
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS estoque_snapshots (
+                data DATETIME NOT NULL,
+                id_equipamento INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                PRIMARY KEY (data, id_equipamento)
+            ) WITHOUT ROWID
+            ''',
+            # Histórico anterior ao razão: o saldo inicial no cadastro é o estoque atual mais o
+            # que está emprestado, seguido de todas as retiradas e devoluções já registradas.
+            '''
+            INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem)
+            SELECT e.id_equipamento, e.data_cadastro,
+                   e.quantidade_estoque + COALESCE((
+                       SELECT SUM(m.quantidade_retirada) FROM movimentacoes m
+                       WHERE m.id_equipamento = e.id_equipamento AND m.data_devolucao IS NULL
+                   ), 0),
+                   'inicial'
+            FROM equipamentos e
+            ''',
+            '''
+            INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem, id_movimentacao)
+            SELECT id_equipamento, data_retirada, -quantidade_retirada, 'retirada', id_movimentacao
+            FROM movimentacoes
+            ''',
+            '''
+            INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem, id_movimentacao)
+            SELECT id_equipamento, data_devolucao, quantidade_retirada, 'devolucao', id_movimentacao
+            FROM movimentacoes WHERE data_devolucao IS NOT NULL
+            ''',
+            # Retiradas, devoluções e cadastros entram pelos gatilhos; ajustes manuais
+            # são lançados por atualizar_equipamento, que conhece o saldo anterior.
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_equipamentos_lancamento_insert
+            AFTER INSERT ON equipamentos WHEN NEW.quantidade_estoque != 0
+            BEGIN
+                INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem)
+                VALUES (NEW.id_equipamento, NEW.data_cadastro, NEW.quantidade_estoque, 'cadastro');
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_lancamento_insert
+            AFTER INSERT ON movimentacoes
+            BEGIN
+                INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem, id_movimentacao)
+                VALUES (NEW.id_equipamento, NEW.data_retirada, -NEW.quantidade_retirada, 'retirada', NEW.id_movimentacao);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_lancamento_devolucao
+            AFTER UPDATE OF data_devolucao ON movimentacoes
+            WHEN OLD.data_devolucao IS NULL AND NEW.data_devolucao IS NOT NULL
+            BEGIN
+                INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem, id_movimentacao)
+                VALUES (NEW.id_equipamento, NEW.data_devolucao, NEW.quantidade_retirada, 'devolucao', NEW.id_movimentacao);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_estoque_lancamentos_update
+            BEFORE UPDATE ON estoque_lancamentos
+            BEGIN
+                SELECT RAISE(ABORT, 'Lançamentos de estoque não podem ser alterados');
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_estoque_lancamentos_delete
+            BEFORE DELETE ON estoque_lancamentos
+            BEGIN
+                SELECT RAISE(ABORT, 'Lançamentos de estoque não podem ser excluídos');
+            END
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_ULTIMO_SNAPSHOT,
+            SQL_ESTOQUE_EQUIPAMENTO_EM,
+        ],
+    },
+    {
+        'versao': 11,
+        'descricao': 'Relatórios pré-calculados e estoque mínimo',
+        'comandos': [
+            '''
+            ALTER TABLE equipamentos ADD COLUMN estoque_minimo INTEGER NOT NULL DEFAULT 0
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_equipamentos_estoque_baixo
+            ON equipamentos (nome_equipamento COLLATE NOCASE)
+            WHERE status = 'Ativo' AND quantidade_estoque < estoque_minimo
+            ''',
+        ] + [
+            f'''
+            CREATE TABLE IF NOT EXISTS relatorio_diario_{tabela} (
+                dia TEXT NOT NULL,
+                {chave} INTEGER NOT NULL,
+                retiradas INTEGER NOT NULL DEFAULT 0,
+                quantidade_retirada INTEGER NOT NULL DEFAULT 0,
+                devolucoes INTEGER NOT NULL DEFAULT 0,
+                quantidade_devolvida INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dia, {chave})
+            ) WITHOUT ROWID
+            '''
+            for tabela, chave in (('equipamentos', 'id_equipamento'), ('clientes', 'id_cliente'))
+        ] + [
+            '''
+            CREATE TABLE IF NOT EXISTS relatorio_duracoes (
+                id_equipamento INTEGER NOT NULL,
+                faixa INTEGER NOT NULL,
+                devolucoes INTEGER NOT NULL DEFAULT 0,
+                soma_segundos REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (id_equipamento, faixa)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS relatorios_progresso (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT OR IGNORE INTO relatorios_progresso (chave, valor) VALUES ('ultimo_lancamento', 0)
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_RELATORIO_LANCAMENTOS,
+            SQL_RELATORIO_DIARIO,
+            SQL_TOTAL_ATRASADOS,
+            SQL_ESTOQUE_BAIXO,
+        ],
+    },
+    {
+        'versao': 12,
+        'descricao': 'Arquivamento de movimentações devolvidas',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS particoes_movimentacoes (
+                ano INTEGER PRIMARY KEY,
+                tabela TEXT NOT NULL UNIQUE,
+                linhas INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_movimentacoes_devolvidas
+            ON movimentacoes (data_devolucao) WHERE data_devolucao IS NOT NULL
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_MOVIMENTACOES_ARQUIVAVEIS,
+        ],
+    },
+    {
+        'versao': 13,
+        'descricao': 'Requisições idempotentes da API de lotes',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS requisicoes_idempotentes (
+                id_usuario INTEGER NOT NULL,
+                chave TEXT NOT NULL,
+                operacao TEXT NOT NULL,
+                assinatura TEXT NOT NULL,
+                resposta TEXT NOT NULL,
+                criada_em REAL NOT NULL,
+                PRIMARY KEY (id_usuario, chave)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_requisicoes_idempotentes_criacao ON requisicoes_idempotentes (criada_em)
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_REQUISICAO_IDEMPOTENTE,
+        ],
+    },
+    {
+        'versao': 14,
+        'descricao': 'Registro de eventos para atualizações ao vivo',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS eventos (
+                id_evento INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                criado_em REAL NOT NULL
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_eventos_criacao ON eventos (criado_em)
+            ''',
+            _gatilho_evento(
+                'trg_movimentacoes_evento_retirada', 'AFTER INSERT ON movimentacoes', 'retirada', None, '''json_object(
+                    'id_movimentacao', NEW.id_movimentacao, 'id_equipamento', NEW.id_equipamento,
+                    'nome_equipamento', (SELECT nome_equipamento FROM equipamentos WHERE id_equipamento = NEW.id_equipamento),
+                    'id_cliente', NEW.id_cliente,
+                    'nome_cliente', (SELECT nome_cliente FROM clientes WHERE id_cliente = NEW.id_cliente),
+                    'nome_usuario', (SELECT nome_usuario FROM usuarios WHERE id_usuario = NEW.id_usuario),
+                    'quantidade', NEW.quantidade_retirada, 'data', NEW.data_retirada)'''),
+            _gatilho_evento(
+                'trg_movimentacoes_evento_devolucao', 'AFTER UPDATE OF data_devolucao ON movimentacoes', 'devolucao',
+                'OLD.data_devolucao IS NULL AND NEW.data_devolucao IS NOT NULL', '''json_object(
+                    'id_movimentacao', NEW.id_movimentacao, 'id_equipamento', NEW.id_equipamento,
+                    'nome_equipamento', (SELECT nome_equipamento FROM equipamentos WHERE id_equipamento = NEW.id_equipamento),
+                    'id_cliente', NEW.id_cliente,
+                    'nome_cliente', (SELECT nome_cliente FROM clientes WHERE id_cliente = NEW.id_cliente),
+                    'quantidade', NEW.quantidade_retirada, 'data', NEW.data_devolucao)'''),
+            # Edição de cadastro ou estoque (inclusive a baixa e a volta das movimentações).
+            _gatilho_evento(
+                'trg_equipamentos_evento_update',
+                'AFTER UPDATE OF nome_equipamento, quantidade_estoque, estoque_minimo ON equipamentos', 'equipamento',
+                'NEW.status = \'Ativo\' AND (OLD.nome_equipamento IS NOT NEW.nome_equipamento '
+                'OR OLD.quantidade_estoque IS NOT NEW.quantidade_estoque OR OLD.estoque_minimo IS NOT NEW.estoque_minimo)',
+                '''json_object(
+                    'id_equipamento', NEW.id_equipamento, 'nome_equipamento', NEW.nome_equipamento,
+                    'quantidade_estoque', NEW.quantidade_estoque, 'estoque_minimo', NEW.estoque_minimo)'''),
+            _gatilho_evento(
+                'trg_equipamentos_evento_desativacao', 'AFTER UPDATE OF status ON equipamentos', 'desativacao',
+                'OLD.status = \'Ativo\' AND NEW.status != \'Ativo\'',
+                "json_object('id_equipamento', NEW.id_equipamento, 'nome_equipamento', NEW.nome_equipamento)"),
+        ],
+        'consultas_verificadas': [
+            SQL_EVENTOS_APOS,
+        ],
+    },
+    {
+        'versao': 15,
+        'descricao': 'Fila de tarefas em segundo plano',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS tarefas (
+                id_tarefa INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                argumentos TEXT NOT NULL,
+                prioridade INTEGER NOT NULL DEFAULT 0,
+                estado TEXT NOT NULL DEFAULT 'pendente'
+                    CHECK (estado IN ('pendente', 'executando', 'concluida', 'falhou')),
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                maximo_tentativas INTEGER NOT NULL,
+                disponivel_em REAL NOT NULL,
+                reservada_ate REAL,
+                trabalhador TEXT,
+                progresso REAL NOT NULL DEFAULT 0,
+                mensagem TEXT,
+                resultado TEXT,
+                erro TEXT,
+                id_usuario INTEGER,
+                criada_em REAL NOT NULL,
+                atualizada_em REAL NOT NULL
+            )
+            ''',
+            # Índices parciais: a fila só percorre as pendentes, na ordem em que serão reservadas.
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tarefas_fila ON tarefas (prioridade DESC, id_tarefa)
+            WHERE estado = 'pendente'
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tarefas_reservas ON tarefas (reservada_ate)
+            WHERE estado = 'executando'
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tarefas_estado ON tarefas (estado, id_tarefa)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tarefas_encerradas ON tarefas (atualizada_em)
+            WHERE estado IN ('concluida', 'falhou')
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_PROXIMA_TAREFA,
+            SQL_RESERVAS_VENCIDAS,
+            SQL_TAREFAS_POR_ESTADO,
+            SQL_TAREFAS_ANTIGAS,
+        ],
+    },
+    {
+        'versao': 16,
+        'descricao': 'Trilha de auditoria das alterações',
+        'comandos': [
+            '''
+            CREATE TABLE IF NOT EXISTS auditoria (
+                id_auditoria INTEGER PRIMARY KEY AUTOINCREMENT,
+                momento REAL NOT NULL,
+                id_usuario INTEGER,
+                tabela TEXT NOT NULL,
+                id_registro INTEGER,
+                acao TEXT NOT NULL,
+                antes TEXT,
+                depois TEXT
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_auditoria_registro ON auditoria (tabela, id_registro, momento)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_auditoria_usuario ON auditoria (id_usuario, momento)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_auditoria_momento ON auditoria (momento)
+            ''',
+        ],
+        'consultas_verificadas': [
+            SQL_AUDITORIA_REGISTRO,
+            SQL_AUDITORIA_USUARIO,
+            SQL_AUDITORIA_PERIODO,
+        ],
+    },
+    {
+        'versao': 17,
+        'descricao': 'Índice de busca só com equipamentos ativos',
+        'comandos': _comandos_indice_busca_ativos('equipamentos', 'id_equipamento',
+                                                  ('nome_equipamento', 'descricao_equipamento')),
+        'consultas_verificadas': [],
+    },
+]
+
+def verificar_planos(conn, consultas):
+    for consulta in consultas:
+        parametros = (1,) * consulta.count('?')
+        plano = conn.execute(f"EXPLAIN QUERY PLAN {consulta}", parametros).fetchall()
+        for linha in plano:
+            detalhe = linha[3]
+            # "SCAN tabela" sem "USING ..." é varredura completa ("SCAN CONSTANT ROW" é um SELECT sem FROM).
+            if detalhe.startswith('SCAN ') and ' USING ' not in detalhe and detalhe != 'SCAN CONSTANT ROW':
+                raise ErroPlanoConsulta(f"Consulta sem índice ({detalhe}):\n{consulta.strip()}")
+
+def aplicar_migracoes():
+    with transacao_escrita() as conn:
+        versao_atual = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migracao in MIGRACOES:
+            if migracao['versao'] <= versao_atual:
+                continue
+            for comando in migracao['comandos']:
+                conn.execute(comando)
+            verificar_planos(conn, migracao['consultas_verificadas'])
+            conn.execute(f"PRAGMA user_version = {migracao['versao']}")
+            print(f"Migração {migracao['versao']} aplicada: {migracao['descricao']}")
+
+def verificar_todos_os_planos():
+    conn = conectar()
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        data_atual = obter_hora_atual()
-        cursor.execute('''
-           INSERT INTO equipamentos (nome_equipamento, descricao_equipamento, quantidade_estoque, data_cadastro) 
-           VALUES (?, ?, ?, ?)
-        ''', (nome, descricao, quantidade, data_atual))
-        conn.commit()
+        for migracao in MIGRACOES:
+            verificar_planos(conn, migracao['consultas_verificadas'])
+    finally:
+        conn.close()
+
+def criar_tabelas():
+    aplicar_migracoes()
+
+def adicionar_equipamento(nome, descricao, quantidade, estoque_minimo=0):
+    try:
+        with transacao_escrita('equipamentos') as conn:
+            cursor = conn.cursor()
+            data_atual = obter_hora_atual()
+            cursor.execute('''
+               INSERT INTO equipamentos (nome_equipamento, descricao_equipamento, quantidade_estoque, data_cadastro, estoque_minimo) 
+               VALUES (?, ?, ?, ?, ?)
+            ''', (nome, descricao, quantidade, data_atual, estoque_minimo))
         print("SUCESSO: Commit realizado no banco de dados.") 
     except sqlite3.Error as e:
         print(f"ERRO CRÍTICO NO CADASTRO: {e}")
         raise 
-    finally:
-        if conn:
-            conn.close()
 
-def listar_equipamentos():
+@em_cache('equipamentos')
+def listar_equipamentos(prefixo=None, status='Ativo', apos=None, limite=None):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM equipamentos WHERE status = 'Ativo' ORDER BY nome_equipamento")
-        
-        resultados = cursor.fetchall()
-        
-        equipamentos_processados = []
-        for eq in resultados:
-            eq_dict = dict(eq)
-            if isinstance(eq_dict.get('data_cadastro'), str):
-                eq_dict['data_cadastro'] = datetime.fromisoformat(eq_dict['data_cadastro'])
-            equipamentos_processados.append(eq_dict)
-            
-        return equipamentos_processados
+        cursor.execute(*consulta_equipamentos(prefixo, status, apos, limitar_pagina(limite)))
+        return cursor.fetchall()
 
     except sqlite3.Error as e:
         print(f"Erro ao listar equipamentos: {e}")
@@ -110,7 +1976,6 @@ def obter_equipamento_por_id(id_equipamento):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM equipamentos WHERE id_equipamento = ?", (id_equipamento,))
         return cursor.fetchone()
@@ -121,44 +1986,42 @@ def obter_equipamento_por_id(id_equipamento):
         if conn:
             conn.close()
 
-def atualizar_equipamento(id_equipamento, nome, descricao, quantidade):
-    conn = None
+def atualizar_equipamento(id_equipamento, nome, descricao, quantidade, estoque_minimo=None):
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE equipamentos
-            SET nome_equipamento = ?, descricao_equipamento = ?, quantidade_estoque = ?
-            WHERE id_equipamento = ?
-        ''', (nome, descricao, quantidade, id_equipamento))
-        conn.commit()
+        with transacao_escrita('equipamentos') as conn:
+            cursor = conn.cursor()
+            # Lança a diferença antes do UPDATE, enquanto o saldo anterior ainda está na linha.
+            cursor.execute('''
+                INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem)
+                SELECT id_equipamento, ?, CAST(? AS INTEGER) - quantidade_estoque, 'ajuste'
+                FROM equipamentos
+                WHERE id_equipamento = ? AND quantidade_estoque != CAST(? AS INTEGER)
+            ''', (obter_hora_atual(), quantidade, id_equipamento, quantidade))
+            cursor.execute('''
+                UPDATE equipamentos
+                SET nome_equipamento = ?, descricao_equipamento = ?, quantidade_estoque = ?,
+                    estoque_minimo = COALESCE(?, estoque_minimo)
+                WHERE id_equipamento = ?
+            ''', (nome, descricao, quantidade, estoque_minimo, id_equipamento))
     except sqlite3.Error as e:
         print(f"Erro ao atualizar equipamento: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def desativar_equipamento(id_equipamento):
-    conn = None
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE equipamentos SET status = 'Inativo' WHERE id_equipamento = ?", (id_equipamento,))
-        conn.commit()
+        with transacao_escrita('equipamentos') as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE equipamentos SET status = 'Inativo' WHERE id_equipamento = ?", (id_equipamento,))
         return True
     except sqlite3.Error as e:
         print(f"Erro ao desativar equipamento: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def verificar_movimentacoes_abertas_equipamento(id_equipamento):
     conn = None
     try:
         conn = conectar()
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(id_movimentacao) FROM movimentacoes WHERE id_equipamento = ? AND data_devolucao IS NULL", (id_equipamento,))
+        cursor.execute(SQL_MOVIMENTACOES_ABERTAS_EQUIPAMENTO, (id_equipamento,))
         count = cursor.fetchone()[0]
         return count > 0
     except sqlite3.Error as e:
@@ -171,29 +2034,24 @@ def verificar_movimentacoes_abertas_equipamento(id_equipamento):
 # --- Funções de Usuários ---
 
 def adicionar_usuario(nome, email, senha, cargo, nivel_acesso):
-    conn = None
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        senha_hash = generate_password_hash(senha)
-        cursor.execute('''
-            INSERT INTO usuarios (nome_usuario, email, senha, cargo, nivel_acesso)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (nome, email, senha_hash, cargo, nivel_acesso))
-        conn.commit()
+        senha_hash = senhas.gerar_hash(senha)
+        with transacao_escrita('usuarios') as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO usuarios (nome_usuario, email, senha, cargo, nivel_acesso)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (nome, email, senha_hash, cargo, nivel_acesso))
     except sqlite3.Error as e:
         print(f"Erro ao adicionar usuário: {e}")
-    finally:
-        if conn:
-            conn.close()
 
-def listar_usuarios():
+@em_cache('usuarios')
+def listar_usuarios(prefixo=None, nivel_acesso=None, apos=None, limite=None):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT id_usuario, nome_usuario, email, cargo, nivel_acesso FROM usuarios ORDER BY nome_usuario")
+        cursor.execute(*consulta_usuarios(prefixo, nivel_acesso, apos, limitar_pagina(limite)))
         return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Erro ao listar usuários: {e}")
@@ -206,7 +2064,6 @@ def obter_usuario_por_id(id_usuario):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM usuarios WHERE id_usuario = ?", (id_usuario,))
         return cursor.fetchone()
@@ -218,47 +2075,46 @@ def obter_usuario_por_id(id_usuario):
             conn.close()  
 
 def atualizar_usuario(id_usuario, nome, email, senha, cargo, nivel_acesso):
-    conn = None
+    # Senha vazia mantém a atual, sem gerar um hash novo.
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        senha_hash = generate_password_hash(senha)
-        cursor.execute('''
-            UPDATE usuarios
-            SET nome_usuario = ?, email = ?, senha = ?, cargo = ?, nivel_acesso = ?
-            WHERE id_usuario = ?
-        ''', (nome, email, senha_hash, cargo, nivel_acesso, id_usuario))
-        conn.commit()
+        senha_hash = senhas.gerar_hash(senha) if senha else None
+        with transacao_escrita('usuarios') as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE usuarios
+                SET nome_usuario = ?, email = ?, senha = COALESCE(?, senha), cargo = ?, nivel_acesso = ?
+                WHERE id_usuario = ?
+            ''', (nome, email, senha_hash, cargo, nivel_acesso, id_usuario))
     except sqlite3.Error as e:
         print(f"Erro ao atualizar usuário: {e}") 
-    finally:
-        if conn:
-            conn.close()
+
+def atualizar_hash_senha(id_usuario, senha_hash):
+    try:
+        with transacao_escrita('usuarios') as conn:
+            conn.execute("UPDATE usuarios SET senha = ? WHERE id_usuario = ?", (senha_hash, id_usuario))
+    except sqlite3.Error as e:
+        print(f"Erro ao atualizar hash de senha: {e}")
 
 def excluir_usuario(id_usuario):
-    conn = None
     try:
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM usuarios WHERE id_usuario = ?", (id_usuario,))
-        conn.commit()
+        with transacao_escrita('usuarios') as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM usuarios WHERE id_usuario = ?", (id_usuario,))
         return True
     except sqlite3.IntegrityError:
         return False
     except sqlite3.Error as e:
         print(f"Erro ao excluir usuário: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def obter_usuario_por_email(email):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM usuarios WHERE email = ?", (email,))
+        cursor.execute('''
+            SELECT id_usuario, nome_usuario, senha, nivel_acesso FROM usuarios WHERE email = ?
+        ''', (email,))
         return cursor.fetchone()
     except sqlite3.Error as e:
         print(f"Erro ao obter usuário por email: {e}")
@@ -267,30 +2123,76 @@ def obter_usuario_por_email(email):
         if conn:
             conn.close()
 
-# --- Funções de Clientes ---
+# --- Sessões ---
+# Usadas por sessoes.py. id_sessao é o hash do token do cookie; o usuário
+# (id, nome, nível) fica em colunas próprias e é mantido pelos gatilhos da
+# migração 9, então a autenticação não consulta a tabela usuarios.
 
-def adicionar_cliente(nome, contato):
+def obter_sessao(id_sessao):
     conn = None
     try:
         conn = conectar()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO clientes (nome_cliente, contato) VALUES (?, ?)
-        ''', (nome, contato))
-        conn.commit()
+            SELECT id_usuario, nome_usuario, nivel_acesso, dados, expira_em FROM sessoes WHERE id_sessao = ?
+        ''', (id_sessao,))
+        return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"Erro ao adicionar cliente: {e}")
+        print(f"Erro ao obter sessão: {e}")
+        return None
     finally:
         if conn:
             conn.close()
 
-def listar_clientes():
+def salvar_sessao(id_sessao, id_usuario, nome_usuario, nivel_acesso, dados, expira_em, substituir=None):
+    # `substituir` é o id anterior quando a sessão troca de id (ex.: no login).
+    try:
+        with transacao_escrita() as conn:
+            if substituir:
+                conn.execute("DELETE FROM sessoes WHERE id_sessao = ?", (substituir,))
+            conn.execute('''
+                INSERT OR REPLACE INTO sessoes (id_sessao, id_usuario, nome_usuario, nivel_acesso, dados, expira_em)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (id_sessao, id_usuario, nome_usuario, nivel_acesso, dados, expira_em))
+        return True
+    except sqlite3.Error as e:
+        print(f"Erro ao salvar sessão: {e}")
+        return False
+
+def excluir_sessao(id_sessao):
+    try:
+        with transacao_escrita() as conn:
+            conn.execute("DELETE FROM sessoes WHERE id_sessao = ?", (id_sessao,))
+    except sqlite3.Error as e:
+        print(f"Erro ao excluir sessão: {e}")
+
+def limpar_sessoes_expiradas(agora):
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute("DELETE FROM sessoes WHERE expira_em < ?", (agora,)).rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao limpar sessões expiradas: {e}")
+        return 0
+
+# --- Funções de Clientes ---
+
+def adicionar_cliente(nome, contato):
+    try:
+        with transacao_escrita('clientes') as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO clientes (nome_cliente, contato) VALUES (?, ?)
+            ''', (nome, contato))
+    except sqlite3.Error as e:
+        print(f"Erro ao adicionar cliente: {e}")
+
+@em_cache('clientes')
+def listar_clientes(prefixo=None, apos=None, limite=None):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clientes ORDER BY nome_cliente")
+        cursor.execute(*consulta_clientes(prefixo, apos, limitar_pagina(limite)))
         return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Erro ao listar clientes: {e}")
@@ -303,7 +2205,6 @@ def obter_cliente_por_id(id_cliente):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM clientes WHERE id_cliente = ?", (id_cliente,))
         return cursor.fetchone()
@@ -314,91 +2215,419 @@ def obter_cliente_por_id(id_cliente):
         if conn:
             conn.close()
 
-# --- Funções de Movimentações ---
+# --- Busca ---
 
-def registrar_retirada(id_equipamento, id_usuario, id_cliente, quantidade, observacao):
+def buscar(tipo, termo, pagina=1, limite=10):
+    resultado = {'itens': [], 'pagina': pagina, 'tem_mais': False}
+    consulta = montar_consulta_busca(termo)
+    limite = limitar_pagina(limite)
+    if not consulta:
+        return resultado
     conn = None
     try:
         conn = conectar()
         cursor = conn.cursor()
-        data_atual = obter_hora_atual()
-        cursor.execute('''
-            INSERT INTO movimentacoes (id_equipamento, id_usuario, id_cliente, quantidade_retirada, observacao, data_retirada)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (id_equipamento, id_usuario, id_cliente, quantidade, observacao, data_atual))
-        cursor.execute('''
-            UPDATE equipamentos
-            SET quantidade_estoque = quantidade_estoque - ?
-            WHERE id_equipamento = ?
-        ''', (quantidade, id_equipamento))
-        conn.commit()
+        candidatos = obter_configuracao()['busca_max_candidatos']
+        cursor.execute(SQL_BUSCA[tipo], (consulta, candidatos, limite + 1, (pagina - 1) * limite))
+        itens = [dict(linha) for linha in cursor.fetchall()]
+        resultado['tem_mais'] = len(itens) > limite
+        resultado['itens'] = itens[:limite]
+        return resultado
     except sqlite3.Error as e:
-        print(f"Erro ao registrar retirada: {e}")
+        print(f"Erro na busca de {tipo}: {e}")
+        return resultado
+    finally:
         if conn:
-            conn.rollback() 
+            conn.close()
+
+# --- Importação em Lote ---
+
+SQL_IMPORTACAO = {
+    'equipamentos': '''
+        INSERT INTO equipamentos (nome_equipamento, descricao_equipamento, quantidade_estoque, data_cadastro)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'clientes': '''
+        INSERT INTO clientes (nome_cliente, contato) VALUES (?, ?)
+    ''',
+}
+
+def iniciar_importacao(tipo, hash_arquivo):
+    with transacao_escrita() as conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO importacoes (tipo, hash_arquivo, data_inicio) VALUES (?, ?, ?)
+        ''', (tipo, hash_arquivo, obter_hora_atual()))
+        return conn.execute('''
+            SELECT id_importacao, ultima_linha, concluida FROM importacoes
+            WHERE tipo = ? AND hash_arquivo = ?
+        ''', (tipo, hash_arquivo)).fetchone()
+
+def importar_lote(tipo, id_importacao, linhas, ultima_linha):
+    # Linhas e progresso entram na mesma transação: uma nova execução retoma do último lote gravado.
+    with transacao_escrita(tipo) as conn:
+        if tipo == 'equipamentos':
+            data_atual = obter_hora_atual()
+            linhas = [linha + (data_atual,) for linha in linhas]
+        conn.executemany(SQL_IMPORTACAO[tipo], linhas)
+        conn.execute('''
+            UPDATE importacoes
+            SET ultima_linha = ?, linhas_importadas = linhas_importadas + ?
+            WHERE id_importacao = ?
+        ''', (ultima_linha, len(linhas), id_importacao))
+
+def concluir_importacao(id_importacao):
+    with transacao_escrita() as conn:
+        conn.execute('''
+            UPDATE importacoes SET concluida = 1, data_fim = ? WHERE id_importacao = ?
+        ''', (obter_hora_atual(), id_importacao))
+
+# --- Funções de Movimentações ---
+
+def _normalizar_id(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _registrar_retiradas(conn, itens, id_usuario, id_cliente, observacao, quantidade):
+    ids_validos = sorted({id_equipamento for id_equipamento in itens if id_equipamento is not None})
+    resultados = []
+    cursor = conn.cursor()
+    # A leitura acontece dentro do BEGIN IMMEDIATE, então o estoque não muda até o commit.
+    cursor.execute('''
+        SELECT id_equipamento, nome_equipamento, quantidade_estoque
+        FROM equipamentos
+        WHERE status = 'Ativo' AND id_equipamento IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(ids_validos),))
+    estoque = {}
+    nomes = {}
+    for id_equipamento, nome, quantidade_estoque in cursor.fetchall():
+        estoque[id_equipamento] = quantidade_estoque
+        nomes[id_equipamento] = nome
+
+    baixas = {}
+    for id_equipamento in itens:
+        resultado = {
+            'id_equipamento': id_equipamento,
+            'nome_equipamento': nomes.get(id_equipamento),
+            'registrado': False,
+            'motivo': None,
+        }
+        if id_equipamento not in estoque:
+            resultado['motivo'] = 'nao_encontrado'
+        elif estoque[id_equipamento] < quantidade:
+            resultado['motivo'] = 'sem_estoque'
+        else:
+            estoque[id_equipamento] -= quantidade
+            baixas[id_equipamento] = baixas.get(id_equipamento, 0) + quantidade
+            resultado['registrado'] = True
+        resultados.append(resultado)
+
+    data_atual = obter_hora_atual()
+    cursor.executemany('''
+        INSERT INTO movimentacoes (id_equipamento, id_usuario, id_cliente, quantidade_retirada, observacao, data_retirada)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(r['id_equipamento'], id_usuario, id_cliente, quantidade, observacao, data_atual)
+          for r in resultados if r['registrado']])
+    cursor.executemany('''
+        UPDATE equipamentos
+        SET quantidade_estoque = quantidade_estoque - ?
+        WHERE id_equipamento = ? AND quantidade_estoque >= ?
+    ''', [(total, id_equipamento, total) for id_equipamento, total in baixas.items()])
+    if cursor.rowcount != len(baixas):
+        raise sqlite3.IntegrityError("Estoque alterado durante a retirada em lote.")
+    return resultados
+
+def registrar_retiradas_em_lote(ids_equipamentos, id_usuario, id_cliente, observacao, quantidade=1, chave=None):
+    # Com `chave` (id de requisição do cliente), um reenvio devolve o resultado da primeira vez.
+    if not isinstance(quantidade, int) or quantidade < 1:
+        # Zero gravaria uma retirada vazia; um valor negativo passaria pela checagem e aumentaria o estoque.
+        raise ValueError(f"Quantidade de retirada inválida: {quantidade!r}.")
+    itens = [_normalizar_id(id_equipamento) for id_equipamento in ids_equipamentos]
+    try:
+        with transacao_escrita('movimentacoes', 'equipamentos') as conn:
+            return _executar_idempotente(
+                conn, id_usuario, chave, 'retiradas', [itens, id_cliente, observacao, quantidade],
+                lambda: _registrar_retiradas(conn, itens, id_usuario, id_cliente, observacao, quantidade))
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar retiradas em lote: {e}")
+        return [{'id_equipamento': id_equipamento, 'nome_equipamento': None, 'registrado': False, 'motivo': 'erro'}
+                for id_equipamento in itens]
+
+def _registrar_devolucoes(conn, itens):
+    ids_validos = sorted({id_movimentacao for id_movimentacao in itens if id_movimentacao is not None})
+    # Um único UPDATE marca todas as abertas do lote; o RETURNING diz quais eram e quanto voltou.
+    devolvidas = {linha[0]: linha[1:] for linha in conn.execute('''
+        UPDATE movimentacoes
+        SET data_devolucao = ?
+        WHERE id_movimentacao IN (SELECT value FROM json_each(?)) AND data_devolucao IS NULL
+        RETURNING id_movimentacao, id_equipamento, quantidade_retirada
+    ''', (obter_hora_atual(), json.dumps(ids_validos))).fetchall()}
+    entradas = {}
+    for id_equipamento, quantidade in devolvidas.values():
+        entradas[id_equipamento] = entradas.get(id_equipamento, 0) + quantidade
+    conn.executemany('''
+        UPDATE equipamentos
+        SET quantidade_estoque = quantidade_estoque + ?
+        WHERE id_equipamento = ?
+    ''', [(total, id_equipamento) for id_equipamento, total in entradas.items()])
+
+    # As que ficaram de fora já estavam devolvidas (talvez arquivadas) ou não existem.
+    restantes = [id_movimentacao for id_movimentacao in ids_validos if id_movimentacao not in devolvidas]
+    ja_devolvidas = set()
+    if restantes:
+        for tabela in ['movimentacoes'] + _particoes(conn):
+            ja_devolvidas.update(linha[0] for linha in conn.execute(
+                f"SELECT id_movimentacao FROM {tabela} WHERE id_movimentacao IN (SELECT value FROM json_each(?))",
+                (json.dumps(restantes),)))
+
+    resultados = []
+    vistas = set()
+    for id_movimentacao in itens:
+        resultado = {'id_movimentacao': id_movimentacao, 'id_equipamento': None, 'devolvida': False, 'motivo': None}
+        if id_movimentacao in devolvidas and id_movimentacao not in vistas:
+            resultado['id_equipamento'] = devolvidas[id_movimentacao][0]
+            resultado['devolvida'] = True
+        elif id_movimentacao in devolvidas or id_movimentacao in ja_devolvidas:
+            # Repetida no próprio lote conta como já devolvida: o estoque só voltou uma vez.
+            resultado['motivo'] = 'ja_devolvida'
+        else:
+            resultado['motivo'] = 'nao_encontrada'
+        vistas.add(id_movimentacao)
+        resultados.append(resultado)
+    return resultados
+
+def registrar_devolucoes_em_lote(ids_movimentacoes, id_usuario=None, chave=None):
+    # Devolve o lote inteiro numa transação. `chave` exige `id_usuario`: a chave vale por usuário.
+    itens = [_normalizar_id(id_movimentacao) for id_movimentacao in ids_movimentacoes]
+    try:
+        with transacao_escrita('movimentacoes', 'equipamentos') as conn:
+            return _executar_idempotente(conn, id_usuario, chave, 'devolucoes', [itens],
+                                         lambda: _registrar_devolucoes(conn, itens))
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar devoluções em lote: {e}")
+        return [{'id_movimentacao': id_movimentacao, 'id_equipamento': None, 'devolvida': False, 'motivo': 'erro'}
+                for id_movimentacao in itens]
+
+def listar_eventos(apos, limite=500):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_EVENTOS_APOS, (apos, limite)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar eventos: {e}")
+        return []
     finally:
         if conn:
             conn.close()
 
-def registrar_devolucao(id_movimentacao):
+def ultimo_evento():
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id_equipamento, quantidade_retirada FROM movimentacoes WHERE id_movimentacao = ?", (id_movimentacao,))
-        movimentacao = cursor.fetchone()
-        
-        if movimentacao:
-            id_equipamento = movimentacao['id_equipamento']
-            quantidade_devolvida = movimentacao['quantidade_retirada']
-            data_atual = obter_hora_atual()
-            cursor.execute('''
-                UPDATE movimentacoes
-                SET data_devolucao = ?
-                WHERE id_movimentacao = ?
-            ''', (data_atual, id_movimentacao))
-            cursor.execute('''
-                UPDATE equipamentos
-                SET quantidade_estoque = quantidade_estoque + ?
-                WHERE id_equipamento = ?
-            ''', (quantidade_devolvida, id_equipamento))
-            conn.commit()
-        else:
-            print(f"Movimentação com ID {id_movimentacao} não encontrada.")
+        return conn.execute("SELECT COALESCE(MAX(id_evento), 0) FROM eventos").fetchone()[0]
     except sqlite3.Error as e:
-        print(f"Erro ao registrar devolução: {e}")
+        print(f"Erro ao obter o último evento: {e}")
+        return 0
+    finally:
         if conn:
-            conn.rollback()
+            conn.close()
+
+def limpar_eventos(antes_de):
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute("DELETE FROM eventos WHERE criado_em < ?", (antes_de,)).rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao limpar eventos: {e}")
+        return 0
+
+def enfileirar_tarefa(tipo, argumentos, prioridade=0, id_usuario=None, maximo_tentativas=None, atraso=0):
+    agora = time.time()
+    maximo_tentativas = maximo_tentativas or obter_configuracao()['tarefas_tentativas']
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute('''
+                INSERT INTO tarefas (tipo, argumentos, prioridade, maximo_tentativas, disponivel_em, id_usuario,
+                                     criada_em, atualizada_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id_tarefa
+            ''', (tipo, json.dumps(argumentos, ensure_ascii=False, default=str), prioridade, maximo_tentativas,
+                  agora + atraso, id_usuario, agora, agora)).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao enfileirar tarefa: {e}")
+        return None
+
+def reservar_tarefa(trabalhador, duracao_reserva):
+    # Devolve as reservas vencidas à fila e reserva a próxima tarefa, numa transação só:
+    # dois trabalhadores nunca pegam a mesma.
+    agora = time.time()
+    try:
+        with transacao_escrita() as conn:
+            vencidas = [linha[0] for linha in conn.execute(SQL_RESERVAS_VENCIDAS, (agora,))]
+            conn.executemany('''
+                UPDATE tarefas
+                SET estado = CASE WHEN tentativas < maximo_tentativas THEN 'pendente' ELSE 'falhou' END,
+                    erro = 'Reserva vencida (trabalhador ' || COALESCE(trabalhador, '?') || ' parou de responder).',
+                    disponivel_em = ?, reservada_ate = NULL, trabalhador = NULL, atualizada_em = ?
+                WHERE id_tarefa = ?
+            ''', [(agora, agora, id_tarefa) for id_tarefa in vencidas])
+            linha = conn.execute(SQL_PROXIMA_TAREFA, (agora,)).fetchone()
+            if linha is None:
+                return None
+            return conn.execute('''
+                UPDATE tarefas
+                SET estado = 'executando', tentativas = tentativas + 1, reservada_ate = ?, trabalhador = ?,
+                    erro = NULL, atualizada_em = ?
+                WHERE id_tarefa = ?
+                RETURNING *
+            ''', (agora + duracao_reserva, trabalhador, agora, linha[0])).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao reservar tarefa: {e}")
+        return None
+
+def atualizar_progresso_tarefa(id_tarefa, trabalhador, progresso, mensagem, duracao_reserva):
+    # Também renova a reserva. Falso se a tarefa já não é deste trabalhador (a reserva venceu).
+    agora = time.time()
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute('''
+                UPDATE tarefas SET progresso = ?, mensagem = COALESCE(?, mensagem), reservada_ate = ?, atualizada_em = ?
+                WHERE id_tarefa = ? AND trabalhador = ? AND estado = 'executando'
+            ''', (progresso, mensagem, agora + duracao_reserva, agora, id_tarefa, trabalhador)).rowcount == 1
+    except sqlite3.Error as e:
+        print(f"Erro ao atualizar progresso da tarefa: {e}")
+        return True
+
+def concluir_tarefa(id_tarefa, trabalhador, resultado):
+    agora = time.time()
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute('''
+                UPDATE tarefas
+                SET estado = 'concluida', progresso = 1, resultado = ?, reservada_ate = NULL, atualizada_em = ?
+                WHERE id_tarefa = ? AND trabalhador = ? AND estado = 'executando'
+            ''', (json.dumps(resultado, ensure_ascii=False, default=str), agora, id_tarefa, trabalhador)).rowcount == 1
+    except sqlite3.Error as e:
+        print(f"Erro ao concluir tarefa: {e}")
+        return False
+
+def falhar_tarefa(id_tarefa, trabalhador, erro, espera):
+    # Com tentativas sobrando, volta para a fila depois de `espera` segundos; senão (ou com `espera`
+    # None, erro que não se resolve tentando de novo) fica como falha.
+    agora = time.time()
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute('''
+                UPDATE tarefas
+                SET estado = CASE WHEN ?1 IS NOT NULL AND tentativas < maximo_tentativas THEN 'pendente' ELSE 'falhou' END,
+                    erro = ?2, disponivel_em = ?3 + COALESCE(?1, 0), reservada_ate = NULL, atualizada_em = ?3
+                WHERE id_tarefa = ?4 AND trabalhador = ?5 AND estado = 'executando'
+                RETURNING estado
+            ''', (espera, erro, agora, id_tarefa, trabalhador)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar falha da tarefa: {e}")
+        return None
+
+def obter_tarefa(id_tarefa):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute("SELECT * FROM tarefas WHERE id_tarefa = ?", (id_tarefa,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao obter tarefa: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def listar_tarefas(estado, limite=None):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_TAREFAS_POR_ESTADO, (estado, limitar_pagina(limite))).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar tarefas: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def contar_tarefas():
+    # Total por estado e há quanto tempo a tarefa pronta mais antiga espera um trabalhador.
+    conn = None
+    try:
+        conn = conectar()
+        totais = {estado: 0 for estado in ('pendente', 'executando', 'concluida', 'falhou')}
+        totais.update(conn.execute("SELECT estado, COUNT(*) FROM tarefas GROUP BY estado").fetchall())
+        agora = time.time()
+        mais_antiga = conn.execute(
+            "SELECT MIN(disponivel_em) FROM tarefas WHERE estado = 'pendente' AND disponivel_em <= ?", (agora,)
+        ).fetchone()[0]
+        return {'estados': totais, 'espera_segundos': agora - mais_antiga if mais_antiga is not None else 0.0}
+    except sqlite3.Error as e:
+        print(f"Erro ao contar tarefas: {e}")
+        return {'estados': {}, 'espera_segundos': 0.0}
     finally:
         if conn:
             conn.close()
 
-def listar_movimentacoes_abertas():
+def gravar_auditoria(entradas):
+    try:
+        with transacao_escrita() as conn:
+            conn.executemany('''
+                INSERT INTO auditoria (momento, id_usuario, tabela, id_registro, acao, antes, depois)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', entradas)
+        return True
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar auditoria: {e}")
+        return False
+
+def listar_auditoria(tabela=None, id_registro=None, id_usuario=None, inicio=None, fim=None, apos=None, limite=None):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(*consulta_auditoria(tabela, id_registro, id_usuario, inicio, fim, apos,
+                                                limitar_pagina(limite))).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar auditoria: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def limpar_tarefas_encerradas(antes_de):
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute(f"DELETE FROM tarefas WHERE id_tarefa IN ({SQL_TAREFAS_ANTIGAS})", (antes_de,)).rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao limpar tarefas: {e}")
+        return 0
+
+def limpar_requisicoes_expiradas(antes_de):
+    try:
+        with transacao_escrita() as conn:
+            return conn.execute("DELETE FROM requisicoes_idempotentes WHERE criada_em < ?", (antes_de,)).rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao limpar requisições expiradas: {e}")
+        return 0
+
+def registrar_devolucao(id_movimentacao):
+    resultado = registrar_devolucoes_em_lote([id_movimentacao])[0]
+    if resultado['motivo'] == 'ja_devolvida':
+        # Devolver de novo somaria o estoque duas vezes.
+        print(f"Movimentação com ID {id_movimentacao} já foi devolvida.")
+    elif resultado['motivo'] == 'nao_encontrada':
+        print(f"Movimentação com ID {id_movimentacao} não encontrada.")
+    return resultado['devolvida']
+
+def listar_movimentacoes_abertas(data_inicio=None, data_fim=None, apos=None, limite=None):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                m.id_movimentacao, m.data_retirada, m.quantidade_retirada,
-                e.nome_equipamento, u.nome_usuario, c.nome_cliente
-            FROM movimentacoes m
-            JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
-            JOIN usuarios u ON m.id_usuario = u.id_usuario
-            JOIN clientes c ON m.id_cliente = c.id_cliente
-            WHERE m.data_devolucao IS NULL
-            ORDER BY m.data_retirada DESC
-        ''')
-        resultados = cursor.fetchall()
-        movimentacoes_processadas = []
-        for mov in resultados:
-            mov_dict = dict(mov)
-            if isinstance(mov_dict.get('data_retirada'), str):
-                mov_dict['data_retirada'] = datetime.fromisoformat(mov_dict['data_retirada'])
-            movimentacoes_processadas.append(mov_dict)
-        return movimentacoes_processadas
+        cursor.execute(*consulta_movimentacoes_abertas(data_inicio, data_fim, apos, limitar_pagina(limite)))
+        return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Erro ao listar movimentações abertas: {e}")
         return []
@@ -406,29 +2635,13 @@ def listar_movimentacoes_abertas():
         if conn:
             conn.close()
 
-def listar_movimentacoes_por_cliente(id_cliente):
+def listar_movimentacoes_por_cliente(id_cliente, limite=None):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT m.data_retirada, m.data_devolucao, m.quantidade_retirada, m.observacao, e.nome_equipamento
-            FROM movimentacoes m
-            JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
-            WHERE m.id_cliente = ?
-            ORDER BY m.data_retirada DESC
-        ''', (id_cliente,))
-        resultados = cursor.fetchall()
-        movimentacoes_processadas = []
-        for mov in resultados:
-            mov_dict = dict(mov) 
-            if isinstance(mov_dict.get('data_retirada'), str):
-                mov_dict['data_retirada'] = datetime.fromisoformat(mov_dict['data_retirada'])
-            if isinstance(mov_dict.get('data_devolucao'), str):
-                mov_dict['data_devolucao'] = datetime.fromisoformat(mov_dict['data_devolucao'])
-            movimentacoes_processadas.append(mov_dict)
-        return movimentacoes_processadas
+        cursor.execute(*consulta_movimentacoes_por_cliente(id_cliente, limite, _particoes(conn)))
+        return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Erro ao listar movimentações por cliente: {e}")
         return []
@@ -436,6 +2649,273 @@ def listar_movimentacoes_por_cliente(id_cliente):
         if conn:
             conn.close()
 
+def iterar_movimentacoes(id_cliente=None, id_equipamento=None, data_inicio=None, data_fim=None, tamanho_lote=1000):
+    # Gera lotes de tuplas (na ordem de COLUNAS_EXPORTACAO) sem carregar o resultado inteiro.
+    conn = None
+    try:
+        conn = conectar()
+        cursor = conn.cursor()
+        particoes = _particoes(conn, data_inicio, data_fim)
+        cursor.execute(*consulta_exportacao_movimentacoes(id_cliente, id_equipamento, data_inicio, data_fim, particoes))
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield lote
+    except sqlite3.Error as e:
+        print(f"Erro ao exportar movimentações: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def arquivar_lote_movimentacoes(devolvidas_antes_de, tamanho_lote):
+    # Move até `tamanho_lote` movimentações devolvidas antes do limite para as partições do ano da
+    # retirada e devolve quantas foram movidas. Lotes pequenos mantêm a trava de escrita curta.
+    with transacao_escrita('movimentacoes') as conn:
+        linhas = conn.execute(SQL_MOVIMENTACOES_ARQUIVAVEIS, (devolvidas_antes_de, tamanho_lote)).fetchall()
+        por_ano = {}
+        for id_movimentacao, ano in linhas:
+            por_ano.setdefault(ano, []).append(id_movimentacao)
+        nova_particao = False
+        for ano, ids in sorted(por_ano.items()):
+            tabela = f"movimentacoes_arquivo_{int(ano)}"
+            if conn.execute("SELECT 1 FROM particoes_movimentacoes WHERE ano = ?", (ano,)).fetchone() is None:
+                for comando in _comandos_particao(tabela):
+                    conn.execute(comando)
+                conn.execute("INSERT INTO particoes_movimentacoes (ano, tabela) VALUES (?, ?)", (ano, tabela))
+                nova_particao = True
+            lista = json.dumps(ids)
+            conn.execute(f'''
+                INSERT INTO {tabela} ({COLUNAS_MOVIMENTACOES})
+                SELECT {COLUNAS_MOVIMENTACOES} FROM movimentacoes
+                WHERE id_movimentacao IN (SELECT value FROM json_each(?))
+            ''', (lista,))
+            conn.execute("DELETE FROM movimentacoes WHERE id_movimentacao IN (SELECT value FROM json_each(?))",
+                         (lista,))
+            conn.execute("UPDATE particoes_movimentacoes SET linhas = linhas + ? WHERE ano = ?", (len(ids), ano))
+        if nova_particao:
+            verificar_planos(conn, _consultas_historico(_particoes(conn)))
+        return len(linhas)
+
+def listar_particoes_arquivo():
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute("SELECT ano, tabela, linhas FROM particoes_movimentacoes ORDER BY ano").fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar partições de arquivo: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+# --- Funções de Estoque ---
+
+def obter_estoque_em(momento=None):
+    # Saldo de todos os equipamentos ao fim de `momento` (data, datetime ou texto ISO).
+    conn = None
+    try:
+        conn = conectar()
+        limite = _limite_momento(momento)
+        snapshot = _snapshot_anterior(conn, limite)
+        return conn.execute(SQL_ESTOQUE_EM, (snapshot, snapshot, limite)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao calcular estoque: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def obter_estoque_equipamento_em(id_equipamento, momento=None):
+    conn = None
+    try:
+        conn = conectar()
+        limite = _limite_momento(momento)
+        snapshot = _snapshot_anterior(conn, limite)
+        return conn.execute(SQL_ESTOQUE_EQUIPAMENTO_EM,
+                            (snapshot, id_equipamento, id_equipamento, snapshot, limite)).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao calcular estoque do equipamento: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def serie_estoque(id_equipamento, inicio, fim=None):
+    # Saldo inicial em `inicio` e um ponto (data, origem, variacao, id_movimentacao, quantidade)
+    # por lançamento até o fim de `fim`.
+    conn = None
+    try:
+        conn = conectar()
+        limite_inicio = _limite_momento(inicio, fim_do_dia=False)
+        snapshot = _snapshot_anterior(conn, limite_inicio)
+        saldo_inicial = conn.execute(SQL_ESTOQUE_EQUIPAMENTO_EM,
+                                     (snapshot, id_equipamento, id_equipamento, snapshot, limite_inicio)).fetchone()[0]
+        pontos = conn.execute(SQL_SERIE_ESTOQUE,
+                              (saldo_inicial, id_equipamento, limite_inicio, _limite_momento(fim))).fetchall()
+        return saldo_inicial, pontos
+    except sqlite3.Error as e:
+        print(f"Erro ao montar série de estoque: {e}")
+        return 0, []
+    finally:
+        if conn:
+            conn.close()
+
+def criar_snapshot_estoque(corrigir=True):
+    # Compacta o razão até agora em um snapshot (saldos zerados não são gravados) e compara
+    # com quantidade_estoque; divergências viram lançamentos de ajuste quando `corrigir`.
+    with transacao_escrita() as conn:
+        agora = obter_hora_atual()
+        limite = _limite_momento(agora)
+        snapshot = _snapshot_anterior(conn, limite)
+        saldos = dict(conn.execute(SQL_SALDOS_ESTOQUE, (snapshot, snapshot, limite)).fetchall())
+        divergencias = {
+            id_equipamento: {'razao': saldos.get(id_equipamento, 0), 'estoque': quantidade}
+            for id_equipamento, quantidade in conn.execute("SELECT id_equipamento, quantidade_estoque FROM equipamentos")
+            if saldos.get(id_equipamento, 0) != quantidade
+        }
+        if corrigir and divergencias:
+            conn.executemany('''
+                INSERT INTO estoque_lancamentos (id_equipamento, data, variacao, origem)
+                VALUES (?, ?, ?, 'ajuste')
+            ''', [(id_equipamento, agora, valores['estoque'] - valores['razao'])
+                  for id_equipamento, valores in divergencias.items()])
+            for id_equipamento, valores in divergencias.items():
+                saldos[id_equipamento] = valores['estoque']
+        conn.executemany("INSERT INTO estoque_snapshots (data, id_equipamento, quantidade) VALUES (?, ?, ?)",
+                         [(limite, id_equipamento, quantidade)
+                          for id_equipamento, quantidade in saldos.items() if quantidade != 0])
+    return {'data': limite, 'equipamentos': sum(1 for quantidade in saldos.values() if quantidade != 0),
+            'divergencias': divergencias}
+
+def podar_snapshots_estoque(manter):
+    # Mantém os `manter` snapshots mais recentes; consultas anteriores a eles refazem mais lançamentos.
+    with transacao_escrita() as conn:
+        cursor = conn.execute('''
+            DELETE FROM estoque_snapshots
+            WHERE data < COALESCE((
+                SELECT data FROM (SELECT DISTINCT data FROM estoque_snapshots ORDER BY data DESC LIMIT 1 OFFSET ?)
+            ), '')
+        ''', (max(manter, 1) - 1,))
+        return cursor.rowcount
+
+# --- Funções de Relatórios ---
+
+def atualizar_relatorios(faixas_duracao, tamanho_lote=None):
+    # Acumula até `tamanho_lote` lançamentos novos numa transação e devolve quanto o progresso
+    # avançou (0 quando não há nada pendente). `faixas_duracao` converte uma lista de durações
+    # em segundos nas faixas do histograma (ver relatorios.faixas_duracao).
+    tamanho_lote = tamanho_lote or obter_configuracao()['tamanho_lote_relatorios']
+    with transacao_escrita() as conn:
+        inicio = conn.execute("SELECT valor FROM relatorios_progresso WHERE chave = 'ultimo_lancamento'").fetchone()[0]
+        fim = conn.execute(SQL_RELATORIO_LANCAMENTOS, (inicio, tamanho_lote)).fetchone()[0]
+        if fim is None:
+            return 0
+        conn.execute(SQL_ACUMULAR_DIARIO_EQUIPAMENTOS, (inicio, fim))
+        conn.execute(SQL_ACUMULAR_DIARIO_CLIENTES, (inicio, fim))
+        duracoes = conn.execute(SQL_DURACOES_DEVOLVIDAS, (inicio, fim)).fetchall()
+        histograma = {}
+        faixas = faixas_duracao([segundos for _, segundos in duracoes]) if duracoes else []
+        for (id_equipamento, segundos), faixa in zip(duracoes, faixas):
+            devolucoes, soma = histograma.get((id_equipamento, faixa), (0, 0.0))
+            histograma[(id_equipamento, faixa)] = (devolucoes + 1, soma + segundos)
+        conn.executemany('''
+            INSERT INTO relatorio_duracoes (id_equipamento, faixa, devolucoes, soma_segundos)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (id_equipamento, faixa) DO UPDATE SET
+                devolucoes = devolucoes + excluded.devolucoes,
+                soma_segundos = soma_segundos + excluded.soma_segundos
+        ''', [chave + valores for chave, valores in histograma.items()])
+        conn.execute("UPDATE relatorios_progresso SET valor = ? WHERE chave = 'ultimo_lancamento'", (fim,))
+        return fim - inicio
+
+def obter_progresso_relatorios():
+    conn = None
+    try:
+        conn = conectar()
+        ultimo = conn.execute("SELECT valor FROM relatorios_progresso WHERE chave = 'ultimo_lancamento'").fetchone()[0]
+        pendentes = conn.execute("SELECT COUNT(*) FROM estoque_lancamentos WHERE id_lancamento > ?", (ultimo,)).fetchone()[0]
+        return {'ultimo_lancamento': ultimo, 'pendentes': pendentes}
+    except sqlite3.Error as e:
+        print(f"Erro ao obter progresso dos relatórios: {e}")
+        return {'ultimo_lancamento': None, 'pendentes': None}
+    finally:
+        if conn:
+            conn.close()
+
+def relatorio_diario(data_inicio, data_fim):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_RELATORIO_DIARIO, (data_inicio, data_fim)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao obter relatório diário: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def ranking_equipamentos(data_inicio, data_fim, limite=10):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_RANKING_EQUIPAMENTOS, (data_inicio, data_fim, limite)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao obter ranking de equipamentos: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def ranking_clientes(data_inicio, data_fim, limite=10):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_RANKING_CLIENTES, (data_inicio, data_fim, limite)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao obter ranking de clientes: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def listar_duracoes():
+    # Histograma inteiro (equipamentos x faixas); os percentis são calculados em relatorios.py.
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_DURACOES).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar durações: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def total_atrasados(retirada_antes_de):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_TOTAL_ATRASADOS, (retirada_antes_de,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao contar movimentações atrasadas: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def listar_estoque_baixo(limite=None):
+    conn = None
+    try:
+        conn = conectar()
+        return conn.execute(SQL_ESTOQUE_BAIXO, (limite or -1,)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar estoque baixo: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
 # --- Funções de Dashboard ---
 
 def obter_estatisticas():
@@ -448,14 +2928,13 @@ def obter_estatisticas():
     try:
         conn = conectar()
         cursor = conn.cursor()
-        cursor.execute("SELECT SUM(quantidade_estoque) FROM equipamentos WHERE status = 'Ativo'")
-        total_estoque = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(quantidade_retirada) FROM movimentacoes WHERE data_devolucao IS NULL")
-        total_em_uso = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT chave, valor FROM estatisticas")
+        contadores = dict(cursor.fetchall())
+        total_estoque = contadores.get('estoque_ativo', 0)
+        total_em_uso = contadores.get('em_uso', 0)
         stats['total_equipamentos'] = total_estoque + total_em_uso
         stats['em_uso'] = total_em_uso
-        cursor.execute("SELECT COUNT(id_usuario) FROM usuarios")
-        stats['total_usuarios'] = cursor.fetchone()[0] or 0
+        stats['total_usuarios'] = contadores.get('total_usuarios', 0)
         return stats
     except sqlite3.Error as e:
         print(f"Erro ao obter estatísticas: {e}")
@@ -464,36 +2943,33 @@ def obter_estatisticas():
         if conn:
             conn.close()
 
+def reconciliar_estatisticas(corrigir=True):
+    # Os contadores mudam junto com as tabelas de origem (e as versões delas); uma correção feita
+    # aqui não muda nenhuma, então ganha a sua própria versão, 'estatisticas', para o dashboard.
+    with transacao_escrita('estatisticas') as conn:
+        armazenados = dict(conn.execute("SELECT chave, valor FROM estatisticas").fetchall())
+        calculados = dict(conn.execute(SQL_ESTATISTICAS_CALCULADAS).fetchall())
+        divergencias = {
+            chave: {'armazenado': armazenados.get(chave), 'calculado': valor}
+            for chave, valor in calculados.items()
+            if armazenados.get(chave) != valor
+        }
+        if corrigir and divergencias:
+            conn.executemany("INSERT OR REPLACE INTO estatisticas (chave, valor) VALUES (?, ?)",
+                             [(chave, calculados[chave]) for chave in divergencias])
+            conn.execute('''
+                INSERT INTO versoes_tabelas (tabela, versao) VALUES ('estatisticas', 1)
+                ON CONFLICT (tabela) DO UPDATE SET versao = versao + 1
+            ''')
+    return divergencias
+
 def listar_ultimas_movimentacoes(limite=5):
     conn = None
     try:
         conn = conectar()
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT
-                m.data_retirada, m.data_devolucao, e.nome_equipamento,
-                u.nome_usuario, c.id_cliente, c.nome_cliente,
-                CASE
-                    WHEN m.data_devolucao IS NOT NULL THEN 'Devolução'
-                    ELSE 'Retirada'
-                END as tipo_movimentacao,
-                COALESCE(m.data_devolucao, m.data_retirada) as data_ordenacao
-            FROM movimentacoes m
-            JOIN equipamentos e ON m.id_equipamento = e.id_equipamento
-            JOIN usuarios u ON m.id_usuario = u.id_usuario
-            JOIN clientes c ON m.id_cliente = c.id_cliente
-            ORDER BY data_ordenacao DESC
-            LIMIT ?
-        ''', (limite,))
-        resultados = cursor.fetchall()
-        movimentacoes_processadas = []
-        for mov in resultados:
-            mov_dict = dict(mov)
-            if isinstance(mov_dict.get('data_ordenacao'), str):
-                mov_dict['data_ordenacao'] = datetime.fromisoformat(mov_dict['data_ordenacao'].split('.')[0])
-            movimentacoes_processadas.append(mov_dict)
-        return movimentacoes_processadas
+        cursor.execute(SQL_ULTIMAS_MOVIMENTACOES, (limite,))
+        return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Erro ao listar últimas movimentações: {e}")
         return []
@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import db as database
+
+# API assíncrona sobre o db.py: cada chamada roda num pool de threads próprio,
+# então o event loop nunca bloqueia em disco. O db.py continua síncrono e é o
+# que scripts e a aplicação Flask usam diretamente.
+#
+#     import db_async
+#     movimentacoes = await db_async.listar_movimentacoes_abertas(limite=50)
+#     async for lote in db_async.iterar_movimentacoes(id_cliente=3):
+#         ...
+
+_executor = None
+_executor_trava = threading.Lock()
+
+def obter_executor():
+    global _executor
+    if _executor is None:
+        with _executor_trava:
+            if _executor is None:
+                # Mais threads do que conexões no pool só criariam espera no pool.
+                tamanho = int(os.getenv("DB_ASYNC_THREADS", str(database.obter_configuracao()['tamanho_pool'])))
+                _executor = ThreadPoolExecutor(max_workers=tamanho, thread_name_prefix='db-async')
+    return _executor
+
+def encerrar_executor():
+    global _executor
+    with _executor_trava:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+async def executar(funcao, *args, **kwargs):
+    # O contexto vai junto para a thread: o usuário atual da auditoria vale também lá.
+    loop = asyncio.get_running_loop()
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(obter_executor(), partial(contexto.run, funcao, *args, **kwargs))
+
+def _assincrona(nome):
+    funcao = getattr(database, nome)
+
+    @wraps(funcao)
+    async def envolvida(*args, **kwargs):
+        # Busca a função de novo a cada chamada para respeitar quem a substitui
+        # depois (ex.: a instrumentação de metricas.py).
+        return await executar(getattr(database, nome), *args, **kwargs)
+    return envolvida
+
+def _iteradora(nome):
+    funcao = getattr(database, nome)
+
+    @wraps(funcao)
+    async def envolvida(*args, **kwargs):
+        gerador = getattr(database, nome)(*args, **kwargs)
+        fim = object()
+        try:
+            while True:
+                item = await executar(next, gerador, fim)
+                if item is fim:
+                    break
+                yield item
+        finally:
+            await executar(gerador.close)
+    return envolvida
+
+def __getattr__(nome):
+    funcao = getattr(database, nome, None)
+    if nome.startswith('_') or not inspect.isfunction(funcao):
+        raise AttributeError(f"módulo 'db_async' não tem o atributo '{nome}'")
+    envolvida = _iteradora(nome) if inspect.isgeneratorfunction(funcao) else _assincrona(nome)
+    globals()[nome] = envolvida
+    return envolvida
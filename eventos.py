@@ -0,0 +1,195 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import db as database
+import db_async
+
+# Atualizações ao vivo por Server-Sent Events. Os gatilhos gravam as mudanças na
+# tabela eventos; uma única thread por processo acompanha a tabela e repassa cada
+# lote novo a todas as conexões abertas. Como a tabela é compartilhada, uma
+# escrita feita por qualquer worker (ou pela CLI, ou pelo asgi.py) chega a todos.
+#
+# Ao reconectar, o navegador manda o Last-Event-ID e recebe o que perdeu direto
+# da tabela, antes de voltar ao fluxo ao vivo.
+
+RECONEXAO_MS = 3000
+TAMANHO_LOTE = 500
+
+class Difusor:
+
+    def __init__(self, intervalo=0.5, tamanho_fila=100):
+        self.intervalo = intervalo
+        self.tamanho_fila = tamanho_fila
+        self._assinantes = set()
+        self._trava = threading.Lock()
+        self._thread = None
+        self._ultimo = None
+        self._contadores = {'lotes': 0, 'eventos': 0, 'descartados': 0}
+
+    def assinar(self, entregar):
+        # `entregar(mensagens)` roda na thread do difusor e não pode bloquear; se levantar
+        # queue.Full, o assinante ficou para trás e é desligado (ele reconecta e recupera).
+        with self._trava:
+            self._assinantes.add(entregar)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._acompanhar, name='eventos', daemon=True)
+                self._thread.start()
+        return entregar
+
+    def cancelar(self, entregar):
+        with self._trava:
+            self._assinantes.discard(entregar)
+
+    def _acompanhar(self):
+        while True:
+            with self._trava:
+                if not self._assinantes:
+                    # Sem ninguém ouvindo a thread para; a próxima assinatura começa do fim da tabela.
+                    self._thread = None
+                    self._ultimo = None
+                    return
+                assinantes = list(self._assinantes)
+            if self._ultimo is None:
+                self._ultimo = database.ultimo_evento()
+            lote = database.listar_eventos(self._ultimo, TAMANHO_LOTE)
+            if not lote:
+                time.sleep(self.intervalo)
+                continue
+            self._ultimo = lote[-1]['id_evento']
+            mensagens = [(evento['id_evento'], evento['tipo'], evento['dados']) for evento in lote]
+            # Os contadores do dashboard vão junto, lidos uma vez para todos os assinantes.
+            mensagens.append((None, 'estatisticas', json.dumps(dict(database.obter_estatisticas()))))
+            self._contadores['lotes'] += 1
+            self._contadores['eventos'] += len(lote)
+            for entregar in assinantes:
+                try:
+                    entregar(mensagens)
+                except queue.Full:
+                    self.cancelar(entregar)
+                    self._contadores['descartados'] += 1
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self._contadores)
+            dados['assinantes'] = len(self._assinantes)
+        return dados
+
+_difusor = None
+_difusor_trava = threading.Lock()
+
+def obter_difusor():
+    global _difusor
+    if _difusor is None:
+        with _difusor_trava:
+            if _difusor is None:
+                config = database.obter_configuracao()
+                _difusor = Difusor(config['eventos_intervalo'], config['eventos_fila'])
+    return _difusor
+
+def formatar(id_evento, tipo, dados):
+    linhas = [f"id: {id_evento}"] if id_evento is not None else []
+    linhas += [f"event: {tipo}", f"data: {dados}"]
+    return '\n'.join(linhas) + '\n\n'
+
+def _recuperar(ultimo_id):
+    # Eventos gravados depois de `ultimo_id`, já formatados, e o novo último id.
+    pedacos = []
+    while True:
+        lote = database.listar_eventos(ultimo_id, TAMANHO_LOTE)
+        pedacos.extend(formatar(*evento) for evento in lote)
+        if len(lote) < TAMANHO_LOTE:
+            break
+        ultimo_id = lote[-1]['id_evento']
+    if lote:
+        ultimo_id = lote[-1]['id_evento']
+    if pedacos:
+        pedacos.append(formatar(None, 'estatisticas', json.dumps(dict(database.obter_estatisticas()))))
+    return pedacos, ultimo_id
+
+def _novos(mensagens, ultimo_id):
+    # A assinatura começa antes da recuperação, então um lote ao vivo pode repetir eventos já enviados.
+    pedacos = []
+    for id_evento, tipo, dados in mensagens:
+        if id_evento is not None:
+            if id_evento <= ultimo_id:
+                continue
+            ultimo_id = id_evento
+        pedacos.append(formatar(id_evento, tipo, dados))
+    return pedacos, ultimo_id
+
+def fluxo(ultimo_id=None):
+    # Gerador de texto SSE para o Flask (uma thread por conexão aberta).
+    difusor = obter_difusor()
+    heartbeat = database.obter_configuracao()['eventos_heartbeat']
+    fila = queue.Queue(maxsize=difusor.tamanho_fila)
+    descartado = threading.Event()
+
+    def entregar(mensagens):
+        try:
+            fila.put_nowait(mensagens)
+        except queue.Full:
+            descartado.set()
+            raise
+
+    if ultimo_id is None:
+        ultimo_id = database.ultimo_evento()
+    difusor.assinar(entregar)
+    try:
+        yield f"retry: {RECONEXAO_MS}\n\n"
+        # O que entrou enquanto o navegador estava desconectado, ou entre a leitura do último id e a
+        # assinatura; daqui em diante o difusor entrega o resto.
+        pedacos, ultimo_id = _recuperar(ultimo_id)
+        yield from pedacos
+        while not descartado.is_set():
+            try:
+                mensagens = fila.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            pedacos, ultimo_id = _novos(mensagens, ultimo_id)
+            yield from pedacos
+    finally:
+        difusor.cancelar(entregar)
+
+async def fluxo_assincrono(ultimo_id=None):
+    # O mesmo fluxo para o asgi.py: a conexão espera no event loop, sem ocupar uma thread.
+    difusor = obter_difusor()
+    heartbeat = database.obter_configuracao()['eventos_heartbeat']
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+    descartado = asyncio.Event()
+
+    def entregar(mensagens):
+        if fila.qsize() >= difusor.tamanho_fila:
+            loop.call_soon_threadsafe(descartado.set)
+            raise queue.Full
+        loop.call_soon_threadsafe(fila.put_nowait, mensagens)
+
+    if ultimo_id is None:
+        ultimo_id = await db_async.ultimo_evento()
+    difusor.assinar(entregar)
+    try:
+        yield f"retry: {RECONEXAO_MS}\n\n"
+        pedacos, ultimo_id = await db_async.executar(_recuperar, ultimo_id)
+        for pedaco in pedacos:
+            yield pedaco
+        while not descartado.is_set():
+            try:
+                mensagens = await asyncio.wait_for(fila.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            pedacos, ultimo_id = _novos(mensagens, ultimo_id)
+            for pedaco in pedacos:
+                yield pedaco
+    finally:
+        difusor.cancelar(entregar)
+
+def ultimo_id_da_requisicao(valor):
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        return None
@@ -0,0 +1,31 @@
+import csv
+import io
+import json
+
+import db as database
+
+def gerar_csv(lotes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(database.COLUNAS_EXPORTACAO)
+    for lote in lotes:
+        escritor.writerows(lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gerar_ndjson(lotes):
+    colunas = database.COLUNAS_EXPORTACAO
+    for lote in lotes:
+        yield ''.join(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False, default=str) + '\n' for linha in lote)
+
+FORMATOS = {
+    'csv': (gerar_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (gerar_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
+
+def exportar_movimentacoes(formato, **filtros):
+    gerador, _ = FORMATOS[formato]
+    return gerador(database.iterar_movimentacoes(**filtros))
@@ -0,0 +1,110 @@
+import csv
+import hashlib
+import io
+import sqlite3
+import time
+
+import db as database
+
+MAX_ERROS_RELATADOS = 1000
+
+def _texto(linha, coluna):
+    return (linha.get(coluna) or '').strip()
+
+def validar_equipamento(linha):
+    nome = _texto(linha, 'nome_equipamento')
+    if not nome:
+        raise ValueError("nome_equipamento é obrigatório")
+    quantidade = _texto(linha, 'quantidade_estoque') or '0'
+    try:
+        quantidade = int(quantidade)
+    except ValueError:
+        raise ValueError(f"quantidade_estoque inválida: {quantidade!r}")
+    if quantidade < 0:
+        raise ValueError("quantidade_estoque não pode ser negativa")
+    return (nome, _texto(linha, 'descricao_equipamento'), quantidade)
+
+def validar_cliente(linha):
+    nome = _texto(linha, 'nome_cliente')
+    if not nome:
+        raise ValueError("nome_cliente é obrigatório")
+    return (nome, _texto(linha, 'contato'))
+
+TIPOS = {
+    'equipamentos': {
+        'colunas': ['nome_equipamento', 'descricao_equipamento', 'quantidade_estoque'],
+        'validar': validar_equipamento,
+    },
+    'clientes': {
+        'colunas': ['nome_cliente', 'contato'],
+        'validar': validar_cliente,
+    },
+}
+
+def calcular_hash(arquivo):
+    sha = hashlib.sha256()
+    for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+        sha.update(bloco)
+    arquivo.seek(0)
+    return sha.hexdigest()
+
+def importar_csv(arquivo, tipo, tamanho_lote=None):
+    # `arquivo` é um fluxo binário que permite seek (arquivo aberto em 'rb' ou upload do Flask).
+    definicao = TIPOS[tipo]
+    tamanho_lote = tamanho_lote or database.obter_configuracao()['tamanho_lote_importacao']
+    relatorio = {
+        'tipo': tipo,
+        'importadas': 0,
+        'ignoradas': 0,
+        'com_erro': 0,
+        'erros': [],
+        'segundos': 0.0,
+        'linhas_por_segundo': 0.0,
+        'ja_concluida': False,
+    }
+    inicio = time.perf_counter()
+
+    id_importacao, ultima_linha, concluida = database.iniciar_importacao(tipo, calcular_hash(arquivo))
+    if concluida:
+        relatorio['ja_concluida'] = True
+        return relatorio
+
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    try:
+        leitor = csv.DictReader(texto)
+        obrigatoria = definicao['colunas'][0]
+        if obrigatoria not in (leitor.fieldnames or []):
+            relatorio['erros'].append({'linha': 1, 'erro': f"Cabeçalho sem a coluna {obrigatoria}"})
+            relatorio['com_erro'] = 1
+            return relatorio
+
+        lote = []
+        numero_linha = 1
+        for numero_linha, linha in enumerate(leitor, start=2):
+            if numero_linha <= ultima_linha:
+                relatorio['ignoradas'] += 1
+                continue
+            try:
+                lote.append(definicao['validar'](linha))
+            except ValueError as e:
+                relatorio['com_erro'] += 1
+                if len(relatorio['erros']) < MAX_ERROS_RELATADOS:
+                    relatorio['erros'].append({'linha': numero_linha, 'erro': str(e)})
+            if len(lote) >= tamanho_lote:
+                database.importar_lote(tipo, id_importacao, lote, numero_linha)
+                relatorio['importadas'] += len(lote)
+                lote = []
+        if lote or numero_linha > ultima_linha:
+            database.importar_lote(tipo, id_importacao, lote, numero_linha)
+            relatorio['importadas'] += len(lote)
+        database.concluir_importacao(id_importacao)
+    except sqlite3.Error as e:
+        print(f"Erro na importação de {tipo}: {e}")
+        relatorio['erros'].append({'linha': None, 'erro': f"Erro no banco de dados: {e}. Execute novamente para retomar."})
+    finally:
+        texto.detach()
+
+    relatorio['segundos'] = time.perf_counter() - inicio
+    if relatorio['segundos'] > 0:
+        relatorio['linhas_por_segundo'] = relatorio['importadas'] / relatorio['segundos']
+    return relatorio
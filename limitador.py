@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+class LimitadorTentativas:
+    # Janela deslizante em memória, por chave (IP, conta...). Vale por processo;
+    # com vários workers, cada um aplica o próprio limite.
+
+    def __init__(self, maximo, janela, max_chaves=10000):
+        self.maximo = maximo
+        self.janela = janela
+        self.max_chaves = max_chaves
+        self._tentativas = OrderedDict()
+        self._trava = threading.Lock()
+
+    def _recentes(self, chave, agora):
+        tentativas = self._tentativas.get(chave)
+        if tentativas is None:
+            return None
+        while tentativas and tentativas[0] <= agora - self.janela:
+            tentativas.popleft()
+        if not tentativas:
+            del self._tentativas[chave]
+            return None
+        return tentativas
+
+    def espera(self, chave):
+        # Segundos até a próxima tentativa ser aceita (0 = liberado).
+        if self.maximo <= 0:
+            return 0
+        agora = time.monotonic()
+        with self._trava:
+            tentativas = self._recentes(chave, agora)
+            if tentativas is None or len(tentativas) < self.maximo:
+                return 0
+            return max(1, int(tentativas[0] + self.janela - agora + 0.999))
+
+    def registrar(self, chave):
+        agora = time.monotonic()
+        with self._trava:
+            tentativas = self._recentes(chave, agora)
+            if tentativas is None:
+                tentativas = self._tentativas[chave] = deque()
+            tentativas.append(agora)
+            self._tentativas.move_to_end(chave)
+            while len(self._tentativas) > self.max_chaves:
+                self._tentativas.popitem(last=False)
+
+    def limpar(self, chave):
+        with self._trava:
+            self._tentativas.pop(chave, None)
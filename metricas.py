@@ -0,0 +1,213 @@
+import inspect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import g, request
+
+log = logging.getLogger(__name__)
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_QUANTIDADE = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BUCKETS_LINHAS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Funções de infraestrutura do db.py que não fazem sentido cronometrar.
+FUNCOES_IGNORADAS = {
+    'transacao_escrita', 'em_cache', 'definir_observador', 'obter_pool', 'obter_configuracao',
+    'carregar_configuracao', 'obter_cache', 'obter_hora_atual',
+}
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.soma += valor
+        self.total += 1
+        for indice, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[indice] += 1
+                break
+
+class Registro:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._histogramas = {}
+        self._contadores = {}
+        self._descricoes = {}
+
+    def histograma(self, nome, descricao, buckets, valor, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._trava:
+            self._descricoes[nome] = ('histogram', descricao)
+            if chave not in self._histogramas:
+                self._histogramas[chave] = Histograma(buckets)
+            self._histogramas[chave].observar(valor)
+
+    def contador(self, nome, descricao, incremento=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._trava:
+            self._descricoes[nome] = ('counter', descricao)
+            self._contadores[chave] = self._contadores.get(chave, 0) + incremento
+
+    def exportar(self, medidores=None):
+        linhas = []
+        with self._trava:
+            por_nome = {}
+            for (nome, rotulos), histograma in self._histogramas.items():
+                por_nome.setdefault(nome, []).append((rotulos, histograma))
+            for (nome, rotulos), valor in self._contadores.items():
+                por_nome.setdefault(nome, []).append((rotulos, valor))
+            descricoes = dict(self._descricoes)
+            for nome in sorted(por_nome):
+                tipo, descricao = descricoes[nome]
+                linhas.append(f"# HELP {nome} {descricao}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for rotulos, valor in sorted(por_nome[nome], key=lambda item: item[0]):
+                    if tipo == 'counter':
+                        linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+                        continue
+                    acumulado = 0
+                    for limite, contagem in zip(valor.buckets, valor.contagens):
+                        acumulado += contagem
+                        linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', limite),))} {acumulado}")
+                    linhas.append(f"{nome}_bucket{_rotulos(rotulos + (('le', '+Inf'),))} {valor.total}")
+                    linhas.append(f"{nome}_sum{_rotulos(rotulos)} {valor.soma}")
+                    linhas.append(f"{nome}_count{_rotulos(rotulos)} {valor.total}")
+        for nome, descricao, valores in medidores or []:
+            linhas.append(f"# HELP {nome} {descricao}")
+            linhas.append(f"# TYPE {nome} gauge")
+            for rotulos, valor in valores:
+                linhas.append(f"{nome}{_rotulos(tuple(sorted(rotulos.items())))} {valor}")
+        return '\n'.join(linhas) + '\n'
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ''
+    partes = []
+    for chave, valor in rotulos:
+        texto = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        partes.append(f'{chave}="{texto}"')
+    return '{' + ','.join(partes) + '}'
+
+def _normalizar_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+registro = Registro()
+
+class ObservadorConsultas:
+    # Recebe as notificações dos cursores do db.py (ver db.definir_observador).
+
+    def __init__(self, limiar_lenta=None, limiar_n_mais_um=10):
+        self.limiar_lenta = limiar_lenta
+        self.limiar_n_mais_um = limiar_n_mais_um
+        self._local = threading.local()
+
+    def iniciar_requisicao(self):
+        self._local.consultas = 0
+        self._local.linhas = 0
+        self._local.repeticoes = {}
+        self._local.ativa = True
+
+    def encerrar_requisicao(self):
+        self._local.ativa = False
+        return getattr(self._local, 'consultas', 0), getattr(self._local, 'linhas', 0)
+
+    def consulta(self, conn, sql, parametros, duracao):
+        operacao = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        registro.histograma('controle_db_consulta_segundos', 'Duração de cada comando SQL.',
+                            BUCKETS_SEGUNDOS, duracao, operacao=operacao)
+        if getattr(self._local, 'ativa', False):
+            self._local.consultas += 1
+            texto = _normalizar_sql(sql)
+            vezes = self._local.repeticoes.get(texto, 0) + 1
+            self._local.repeticoes[texto] = vezes
+            if vezes == self.limiar_n_mais_um:
+                rota = request.endpoint or 'desconhecida'
+                registro.contador('controle_db_n_mais_um_total',
+                                  'Requisições em que o mesmo SQL se repetiu além do limiar (possível N+1).',
+                                  rota=rota)
+                log.warning("Possível N+1 em %s: consulta repetida %dx: %s", rota, vezes, texto[:200])
+        if self.limiar_lenta is not None and duracao >= self.limiar_lenta:
+            self._registrar_lenta(conn, sql, parametros, duracao)
+
+    def linhas(self, quantidade):
+        if getattr(self._local, 'ativa', False):
+            self._local.linhas += quantidade
+
+    def _registrar_lenta(self, conn, sql, parametros, duracao):
+        plano = ''
+        if parametros is not None and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            try:
+                linhas = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", parametros).fetchall()
+                plano = '\n'.join(f"    {linha[3]}" for linha in linhas)
+            except sqlite3.Error as e:
+                plano = f"    (plano indisponível: {e})"
+        log.warning("Consulta lenta (%.1f ms): %s%s", duracao * 1000, _normalizar_sql(sql), f"\n{plano}" if plano else "")
+
+def instrumentar_funcoes(modulo):
+    for nome, funcao in list(vars(modulo).items()):
+        if (nome.startswith('_') or nome in FUNCOES_IGNORADAS or not inspect.isfunction(funcao)
+                or funcao.__module__ != modulo.__name__ or inspect.isgeneratorfunction(funcao)):
+            continue
+        setattr(modulo, nome, _cronometrar(nome, funcao))
+
+def _cronometrar(nome, funcao):
+    @wraps(funcao)
+    def envolvida(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            registro.histograma('controle_db_funcao_segundos',
+                                'Duração das funções do db.py (conectar = tempo para obter conexão).',
+                                BUCKETS_SEGUNDOS, time.perf_counter() - inicio, funcao=nome)
+    return envolvida
+
+def instrumentar(app, database):
+    limiar_lenta = os.getenv("SLOW_QUERY_MS")
+    observador = ObservadorConsultas(
+        limiar_lenta=float(limiar_lenta) / 1000 if limiar_lenta else None,
+        limiar_n_mais_um=int(os.getenv("N_PLUS_ONE_THRESHOLD", "10")),
+    )
+    database.definir_observador(observador)
+    instrumentar_funcoes(database)
+
+    @app.before_request
+    def iniciar_metricas_requisicao():
+        g.inicio_requisicao = time.perf_counter()
+        observador.iniciar_requisicao()
+
+    @app.teardown_request
+    def encerrar_metricas_requisicao(exc):
+        inicio = g.pop('inicio_requisicao', None)
+        if inicio is None:
+            return
+        rota = request.endpoint or 'desconhecida'
+        consultas, linhas = observador.encerrar_requisicao()
+        registro.histograma('controle_http_requisicao_segundos', 'Duração das requisições por rota.',
+                            BUCKETS_SEGUNDOS, time.perf_counter() - inicio, rota=rota)
+        registro.histograma('controle_db_consultas_por_requisicao', 'Comandos SQL executados por requisição.',
+                            BUCKETS_QUANTIDADE, consultas, rota=rota)
+        registro.histograma('controle_db_linhas_por_requisicao', 'Linhas lidas do banco por requisição.',
+                            BUCKETS_LINHAS, linhas, rota=rota)
+
+    return observador
+
+def exportar_prometheus(database, medidores_extras=()):
+    pool = database.estatisticas_pool()
+    cache = database.estatisticas_cache()
+    medidores = [
+        ('controle_pool_conexoes', 'Contadores do pool de conexões SQLite.',
+         [({'tipo': chave}, valor) for chave, valor in sorted(pool.items())]),
+        ('controle_cache_leitura', 'Contadores do cache de leitura.',
+         [({'tipo': chave}, valor) for chave, valor in sorted(cache.items())]),
+    ]
+    return registro.exportar(medidores + list(medidores_extras))
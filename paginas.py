@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import json
+import os
+from functools import wraps
+
+from flask import current_app, g, make_response, render_template, request, session
+from markupsafe import Markup
+
+import db as database
+from cache import CacheLeitura
+
+try:
+    import brotli
+except ImportError:
+    # brotli é opcional: sem ele as respostas saem só em gzip.
+    brotli = None
+
+# Páginas de listagem servidas a partir das versões de versoes_tabelas (incrementadas
+# por gatilhos a cada escrita): o ETag muda só quando alguma tabela da página muda,
+# os pedaços renderizados ficam guardados por versão e o corpo comprimido é gerado
+# uma única vez para todas as requisições seguintes.
+
+TAMANHO_MINIMO_COMPRESSAO = 1024
+SUFIXOS_CODIFICACAO = {'br': '-br', 'gzip': '-gz'}
+
+_fragmentos = None
+_respostas = None
+_versao_templates = None
+_contadores = {'nao_modificadas': 0}
+
+def _caches():
+    global _fragmentos, _respostas
+    if _respostas is None:
+        config = database.obter_configuracao()
+        _fragmentos = CacheLeitura(config['cache_paginas_ttl'], config['cache_paginas_max_entradas'])
+        _respostas = CacheLeitura(config['cache_paginas_ttl'], config['cache_paginas_max_entradas'])
+    return _fragmentos, _respostas
+
+def _versao_dos_templates():
+    # Um deploy que muda os templates muda todos os ETags, mesmo sem escrita no banco. O hash é do
+    # conteúdo (não da data dos arquivos) para ser igual em todos os processos e servidores.
+    global _versao_templates
+    if _versao_templates is None:
+        pasta = os.path.join(current_app.root_path, current_app.template_folder)
+        resumo = hashlib.sha1()
+        for nome in sorted(os.listdir(pasta)):
+            with open(os.path.join(pasta, nome), 'rb') as arquivo:
+                resumo.update(nome.encode('utf-8'))
+                resumo.update(arquivo.read())
+        _versao_templates = resumo.hexdigest()[:12]
+    return _versao_templates
+
+def _versoes(tabelas):
+    # Lidas uma vez por requisição: o ETag e os pedaços da página usam as mesmas versões.
+    conhecidas = g.get('versoes_tabelas', {})
+    faltando = [tabela for tabela in tabelas if tabela not in conhecidas]
+    if faltando:
+        versoes = database.obter_versoes(faltando)
+        if versoes is None:
+            return None
+        conhecidas = dict(conhecidas, **dict(zip(faltando, versoes)))
+        g.versoes_tabelas = conhecidas
+    return tuple(conhecidas[tabela] for tabela in tabelas)
+
+def fragmento(template, tabelas, carregar):
+    # Pedaço de página que depende só das `tabelas` e dos parâmetros da URL. `carregar` faz as
+    # consultas e devolve o contexto do template; só roda quando o HTML guardado está velho.
+    versoes = _versoes(tabelas)
+    if versoes is None:
+        return Markup(render_template(template, **carregar()))
+    fragmentos, _ = _caches()
+    chave = json.dumps([template, sorted(request.args.items(multi=True))])
+    encontrado, html = fragmentos.obter(chave, versoes)
+    if not encontrado:
+        html = Markup(render_template(template, **carregar()))
+        fragmentos.guardar(chave, tabelas, versoes, html)
+    return html
+
+def _etag(versoes):
+    # O usuário entra no ETag porque o menu mostra o nome e os links do nível de acesso.
+    partes = [_versao_dos_templates(), request.full_path, versoes,
+              session.get('user_id'), session.get('user_name'), session.get('nivel_acesso')]
+    return hashlib.sha1(json.dumps(partes, default=str).encode('utf-8')).hexdigest()
+
+def _comprimir(corpo):
+    corpos = {'identity': corpo}
+    if len(corpo) >= TAMANHO_MINIMO_COMPRESSAO:
+        corpos['gzip'] = gzip.compress(corpo, 6)
+        if brotli is not None:
+            corpos['br'] = brotli.compress(corpo, quality=5)
+    return corpos
+
+def _codificacao(disponiveis):
+    return next((codificacao for codificacao in ('br', 'gzip')
+                 if codificacao in disponiveis and request.accept_encodings[codificacao]), None)
+
+def _cabecalhos(resposta, etag):
+    # Cada codificação tem seu próprio ETag forte; no-cache faz o navegador revalidar sempre.
+    resposta.set_etag(etag)
+    resposta.vary.update(('Cookie', 'Accept-Encoding'))
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
+
+def _servir(corpos, etag):
+    codificacao = _codificacao(corpos)
+    resposta = make_response(corpos[codificacao or 'identity'])
+    resposta.mimetype = 'text/html'
+    if codificacao:
+        resposta.content_encoding = codificacao
+        etag += SUFIXOS_CODIFICACAO[codificacao]
+    return _cabecalhos(resposta, etag)
+
+def condicional(*tabelas):
+    # Para páginas GET que só mudam quando as `tabelas` mudam. Com mensagens flash pendentes a
+    # página sai sempre nova (e não é guardada), porque elas aparecem uma única vez.
+    def decorador(view):
+        @wraps(view)
+        def envolvida(*args, **kwargs):
+            versoes = _versoes(tabelas)
+            if versoes is None or session.get('_flashes'):
+                return view(*args, **kwargs)
+            etag = _etag(versoes)
+            for sufixo in ('', *SUFIXOS_CODIFICACAO.values()):
+                if request.if_none_match.contains(etag + sufixo):
+                    _contadores['nao_modificadas'] += 1
+                    return _cabecalhos(make_response('', 304), etag + sufixo)
+
+            _, respostas = _caches()
+            encontrado, corpos = respostas.obter(etag, versoes)
+            if not encontrado:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200 or session.get('_flashes'):
+                    return resposta
+                corpos = _comprimir(resposta.get_data())
+                respostas.guardar(etag, tabelas, versoes, corpos)
+            return _servir(corpos, etag)
+        return envolvida
+    return decorador
+
+def estatisticas():
+    fragmentos, respostas = _caches()
+    return {
+        'fragmentos': fragmentos.estatisticas(),
+        'respostas': respostas.estatisticas(),
+        'nao_modificadas': _contadores['nao_modificadas'],
+        'brotli': brotli is not None,
+    }
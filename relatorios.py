@@ -0,0 +1,159 @@
+import math
+from datetime import date, timedelta
+
+import db as database
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy é opcional: sem ele as mesmas contas rodam em Python puro.
+    np = None
+
+# Faixas logarítmicas de duração: 4 por oitava (~19% de largura cada), a partir de 1 segundo.
+FAIXAS_POR_OITAVA = 4
+PERCENTIS = (50, 90, 99)
+DIAS_PADRAO = 30
+LIMITE_PADRAO = 10
+
+def faixas_duracao(segundos):
+    if np is not None:
+        valores = np.maximum(np.asarray(segundos, dtype=float), 1.0)
+        return np.floor(np.log2(valores) * FAIXAS_POR_OITAVA).astype(int).tolist()
+    return [math.floor(math.log2(max(valor, 1.0)) * FAIXAS_POR_OITAVA) for valor in segundos]
+
+def _centro_faixa(faixa):
+    # Centro geométrico da faixa: é o valor reportado para um percentil que cai nela.
+    return 2 ** ((faixa + 0.5) / FAIXAS_POR_OITAVA)
+
+def _estatisticas_numpy(grupos, faixas, devolucoes, somas):
+    # Linhas ordenadas por grupo e faixa. Os percentis de todos os grupos saem de uma única
+    # soma acumulada: o alvo de cada grupo é deslocado pelo total dos grupos anteriores.
+    grupos = np.asarray(grupos)
+    faixas = np.asarray(faixas)
+    devolucoes = np.asarray(devolucoes, dtype=np.int64)
+    somas = np.asarray(somas, dtype=float)
+    inicios = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+    totais = np.add.reduceat(devolucoes, inicios)
+    acumulado = np.cumsum(devolucoes)
+    anteriores = acumulado[inicios] - devolucoes[inicios]
+    resultado = {
+        'devolucoes': totais.tolist(),
+        'media_segundos': (np.add.reduceat(somas, inicios) / totais).tolist(),
+    }
+    for percentil in PERCENTIS:
+        alvos = anteriores + np.ceil(totais * percentil / 100)
+        indices = np.searchsorted(acumulado, alvos, side='left')
+        resultado[f'p{percentil}_segundos'] = (2 ** ((faixas[indices] + 0.5) / FAIXAS_POR_OITAVA)).tolist()
+    return grupos[inicios].tolist(), [dict(zip(resultado, valores)) for valores in zip(*resultado.values())]
+
+def _estatisticas_python(grupos, faixas, devolucoes, somas):
+    chaves, estatisticas = [], []
+    inicio = 0
+    while inicio < len(grupos):
+        fim = inicio
+        while fim < len(grupos) and grupos[fim] == grupos[inicio]:
+            fim += 1
+        total = sum(devolucoes[inicio:fim])
+        item = {'devolucoes': total, 'media_segundos': sum(somas[inicio:fim]) / total}
+        for percentil in PERCENTIS:
+            alvo = math.ceil(total * percentil / 100)
+            acumulado = 0
+            for indice in range(inicio, fim):
+                acumulado += devolucoes[indice]
+                if acumulado >= alvo:
+                    item[f'p{percentil}_segundos'] = _centro_faixa(faixas[indice])
+                    break
+        chaves.append(grupos[inicio])
+        estatisticas.append(item)
+        inicio = fim
+    return chaves, estatisticas
+
+def estatisticas_duracoes(linhas):
+    # `linhas` vem de database.listar_duracoes(); devolve o resumo geral e um por equipamento.
+    if not linhas:
+        return None, []
+    calcular = _estatisticas_numpy if np is not None else _estatisticas_python
+    ids, nomes, faixas, devolucoes, somas = zip(*linhas)
+    nomes = dict(zip(ids, nomes))
+    ids, por_equipamento = calcular(ids, faixas, devolucoes, somas)
+
+    geral = {}
+    for faixa, quantidade, soma in zip(faixas, devolucoes, somas):
+        anterior = geral.get(faixa, (0, 0.0))
+        geral[faixa] = (anterior[0] + quantidade, anterior[1] + soma)
+    faixas_gerais = sorted(geral)
+    _, (resumo,) = calcular([0] * len(faixas_gerais), faixas_gerais, [geral[faixa][0] for faixa in faixas_gerais],
+                            [geral[faixa][1] for faixa in faixas_gerais])
+
+    equipamentos = [dict(item, id_equipamento=id_equipamento, nome_equipamento=nomes[id_equipamento])
+                    for id_equipamento, item in zip(ids, por_equipamento)]
+    equipamentos.sort(key=lambda item: item['p90_segundos'], reverse=True)
+    return resumo, equipamentos
+
+_duracoes = (None, (None, []))
+
+def duracoes(ultimo_lancamento):
+    # O histograma só muda quando atualizar_relatorios avança, então o cálculo fica guardado
+    # até o próximo lançamento processado.
+    global _duracoes
+    versao, resultado = _duracoes
+    if versao is None or versao != ultimo_lancamento:
+        resultado = estatisticas_duracoes(database.listar_duracoes())
+        _duracoes = (ultimo_lancamento, resultado)
+    return resultado
+
+def atualizar(maximo_lotes=None):
+    # Processa os lançamentos pendentes em lotes (uma transação por lote).
+    total = 0
+    lotes = 0
+    while maximo_lotes is None or lotes < maximo_lotes:
+        avanco = database.atualizar_relatorios(faixas_duracao)
+        if not avanco:
+            break
+        total += avanco
+        lotes += 1
+    return total
+
+def periodo(data_inicio=None, data_fim=None):
+    data_fim = data_fim or database.obter_hora_atual().date().isoformat()
+    data_inicio = data_inicio or (date.fromisoformat(data_fim) - timedelta(days=DIAS_PADRAO - 1)).isoformat()
+    return data_inicio, data_fim
+
+def atrasados(limite=LIMITE_PADRAO):
+    # Em atraso: retirada antes do início do dia que fica `prazo` dias atrás e ainda não devolvida.
+    prazo = database.obter_configuracao()['prazo_devolucao_dias']
+    corte = database.obter_hora_atual().date() - timedelta(days=prazo)
+    total = database.total_atrasados(corte.isoformat())
+    return {
+        'prazo_dias': prazo,
+        'movimentacoes': total['movimentacoes'] if total else 0,
+        'quantidade': total['quantidade'] if total else 0,
+        'itens': database.listar_movimentacoes_abertas(data_fim=(corte - timedelta(days=1)).isoformat(),
+                                                       limite=limite),
+    }
+
+def montar_painel(data_inicio=None, data_fim=None, limite=LIMITE_PADRAO):
+    data_inicio, data_fim = periodo(data_inicio, data_fim)
+    progresso = database.obter_progresso_relatorios()
+    resumo_duracoes, por_equipamento = duracoes(progresso['ultimo_lancamento'])
+    return {
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
+        'diario': database.relatorio_diario(data_inicio, data_fim),
+        'equipamentos': database.ranking_equipamentos(data_inicio, data_fim, limite),
+        'clientes': database.ranking_clientes(data_inicio, data_fim, limite),
+        'duracoes': {'geral': resumo_duracoes, 'equipamentos': por_equipamento[:limite]},
+        'atrasados': atrasados(limite),
+        'estoque_baixo': database.listar_estoque_baixo(limite),
+        'progresso': progresso,
+    }
+
+def serializavel(valor):
+    # Registros viram dicts para o jsonify (uma tupla sairia como lista, sem os nomes das colunas).
+    if isinstance(valor, database.Registro):
+        return dict(valor)
+    if isinstance(valor, dict):
+        return {chave: serializavel(item) for chave, item in valor.items()}
+    if isinstance(valor, list):
+        return [serializavel(item) for item in valor]
+    return valor
@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as TempoEsgotado
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Hash e verificação de senhas rodam num pool de processos limitado: um pico de
+# logins ocupa no máximo PASSWORD_HASH_WORKERS núcleos e uma fila de tamanho
+# fixo, em vez de prender todas as threads que atendem as outras rotas.
+
+class FilaSenhasCheia(Exception):
+    pass
+
+_executor = None
+_vagas = None
+_trava = threading.Lock()
+_metodo_normalizado = None
+_configuracao = None
+
+def obter_configuracao():
+    global _configuracao
+    if _configuracao is None:
+        _configuracao = carregar_configuracao()
+    return _configuracao
+
+def carregar_configuracao():
+    return {
+        'metodo': os.getenv("PASSWORD_HASH_METHOD", "scrypt"),
+        'processos': int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+        'fila': int(os.getenv("PASSWORD_HASH_QUEUE", "16")),
+        'timeout': float(os.getenv("PASSWORD_HASH_TIMEOUT", "5")),
+    }
+
+def _gerar(senha, metodo):
+    return generate_password_hash(senha, method=metodo)
+
+def _verificar(senha_hash, senha):
+    return check_password_hash(senha_hash, senha)
+
+def _aquecer():
+    return os.getpid()
+
+def iniciar():
+    # Cria os processos já no início: com "fork", é melhor que isso aconteça
+    # antes de o servidor abrir suas threads.
+    global _executor, _vagas
+    config = obter_configuracao()
+    with _trava:
+        if _executor is not None or config['processos'] <= 0:
+            return
+        metodos = multiprocessing.get_all_start_methods()
+        # "spawn"/"forkserver" reimportariam o app.py em cada processo.
+        contexto = multiprocessing.get_context('fork' if 'fork' in metodos else None)
+        _executor = ProcessPoolExecutor(max_workers=config['processos'], mp_context=contexto)
+        _vagas = threading.BoundedSemaphore(config['processos'] + config['fila'])
+        aquecimento = [_executor.submit(_aquecer) for _ in range(config['processos'])]
+    for futuro in aquecimento:
+        futuro.result()
+
+def encerrar():
+    global _executor
+    with _trava:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+def _executar(funcao, *args):
+    global _executor
+    config = obter_configuracao()
+    if config['processos'] <= 0:
+        return funcao(*args)
+    if _executor is None:
+        iniciar()
+    executor = _executor
+    if not _vagas.acquire(timeout=config['timeout']):
+        raise FilaSenhasCheia("Fila de verificação de senhas cheia.")
+    try:
+        futuro = executor.submit(funcao, *args)
+    except BaseException:
+        _vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: _vagas.release())
+    try:
+        return futuro.result(timeout=config['timeout'])
+    except TempoEsgotado:
+        raise FilaSenhasCheia("Tempo esgotado aguardando a verificação de senha.")
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: OOM); o próximo pedido cria um pool novo.
+        with _trava:
+            if _executor is executor:
+                _executor = None
+        raise
+
+def gerar_hash(senha, metodo=None):
+    return _executar(_gerar, senha, metodo or obter_configuracao()['metodo'])
+
+def verificar_senha(senha_hash, senha):
+    return _executar(_verificar, senha_hash, senha)
+
+def precisa_atualizar(senha_hash):
+    # Verdadeiro quando o hash foi gerado com outro método ou custo (ex.: após
+    # mudar PASSWORD_HASH_METHOD); o login aproveita para refazê-lo.
+    global _metodo_normalizado
+    if _metodo_normalizado is None:
+        _metodo_normalizado = generate_password_hash('', method=obter_configuracao()['metodo']).split('$', 1)[0]
+    return senha_hash.split('$', 1)[0] != _metodo_normalizado
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import db as database
+
+# Sessões guardadas no banco (tabela sessoes). O cookie leva só um token
+# aleatório; o usuário autenticado (id, nome, nível de acesso) vem junto com a
+# sessão, então login_required e as checagens de nível não fazem consulta extra.
+
+CHAVES_USUARIO = ('user_id', 'user_name', 'nivel_acesso')
+
+def _hash_token(token):
+    # O banco guarda o hash: quem lê a tabela não consegue usar as sessões.
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class SessaoServidor(CallbackDict, SessionMixin):
+    def __init__(self, dados=None, token=None, expira_em=None):
+        def ao_modificar(sessao):
+            sessao.modified = True
+        CallbackDict.__init__(self, dados, ao_modificar)
+        self.token = token
+        self.expira_em = expira_em
+        self.usuario_original = (dados or {}).get('user_id')
+        self.new = token is None
+        self.modified = False
+
+class InterfaceSessaoServidor(SessionInterface):
+    def __init__(self, duracao=None, intervalo_limpeza=None):
+        # Expiração por inatividade: cada uso dentro da segunda metade do prazo renova a sessão.
+        self.duracao = duracao or float(os.getenv("SESSION_IDLE_TIMEOUT", str(8 * 3600)))
+        self.intervalo_limpeza = intervalo_limpeza or float(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+        self._ultima_limpeza = time.monotonic()
+        self._trava = threading.Lock()
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if not token:
+            return SessaoServidor()
+        linha = database.obter_sessao(_hash_token(token))
+        if linha is None or linha['expira_em'] < time.time():
+            return SessaoServidor()
+        dados = json.loads(linha['dados'])
+        if linha['id_usuario'] is not None:
+            dados.update(user_id=linha['id_usuario'], user_name=linha['nome_usuario'],
+                         nivel_acesso=linha['nivel_acesso'])
+        return SessaoServidor(dados, token, linha['expira_em'])
+
+    def save_session(self, app, session, response):
+        self._limpar_expiradas()
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        caminho = self.get_cookie_path(app)
+        if not session:
+            if session.token is not None:
+                database.excluir_sessao(_hash_token(session.token))
+                response.delete_cookie(nome, domain=dominio, path=caminho)
+            return
+        agora = time.time()
+        # Troca o token quando o usuário da sessão muda (login), contra fixação de sessão.
+        trocar = session.token is None or session.get('user_id') != session.usuario_original
+        if not trocar and not session.modified and session.expira_em - agora > self.duracao / 2:
+            return
+        token = secrets.token_urlsafe(32) if trocar else session.token
+        dados = {chave: valor for chave, valor in session.items() if chave not in CHAVES_USUARIO}
+        salva = database.salvar_sessao(
+            _hash_token(token), session.get('user_id'), session.get('user_name'), session.get('nivel_acesso'),
+            json.dumps(dados, default=str), agora + self.duracao,
+            substituir=_hash_token(session.token) if trocar and session.token else None,
+        )
+        if not salva:
+            return
+        response.vary.add('Cookie')
+        if trocar or session.permanent:
+            response.set_cookie(
+                nome, token,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=dominio,
+                path=caminho,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _limpar_expiradas(self):
+        agora = time.monotonic()
+        with self._trava:
+            if agora - self._ultima_limpeza < self.intervalo_limpeza:
+                return
+            self._ultima_limpeza = agora
+        database.limpar_sessoes_expiradas(time.time())
+
+def usuario_da_sessao(token):
+    # Para quem não passa pelo Flask (ex.: asgi.py): devolve o id do usuário ou None.
+    if not token:
+        return None
+    linha = database.obter_sessao(_hash_token(token))
+    if linha is None or linha['expira_em'] < time.time():
+        return None
+    return linha['id_usuario']
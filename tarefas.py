@@ -0,0 +1,214 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+import arquivamento
+import auditoria
+import backup
+import db as database
+import relatorios
+
+# Trabalhadores da fila de tarefas (a fila em si fica na tabela tarefas, ver db.py).
+# Cada trabalhador é um processo que reserva uma tarefa por vez; vários deles, em
+# uma ou mais máquinas com o mesmo banco, dividem a fila. Enquanto a tarefa roda,
+# uma thread renova a reserva, então só um trabalhador morto a devolve à fila.
+
+log = logging.getLogger(__name__)
+
+class ErroTarefa(Exception):
+    # Falha que não se resolve tentando de novo (argumentos inválidos, tipo desconhecido).
+    pass
+
+class ReservaPerdida(Exception):
+    pass
+
+def _retiradas(id_tarefa, argumentos, progresso):
+    # O id da tarefa serve de id de requisição: se o trabalhador cair depois do commit,
+    # a nova tentativa devolve o resultado gravado em vez de retirar tudo de novo.
+    resultados = database.registrar_retiradas_em_lote(
+        argumentos['ids_equipamentos'], argumentos['id_usuario'], argumentos['id_cliente'],
+        argumentos.get('observacao'), chave=f"tarefa-{id_tarefa}")
+    if any(resultado['motivo'] == 'erro' for resultado in resultados):
+        # Nada foi gravado (o lote é uma transação); vale tentar de novo.
+        raise RuntimeError("Erro no banco ao registrar as retiradas.")
+    return resultados
+
+def _atualizar_relatorios(id_tarefa, argumentos, progresso):
+    feitos = 0
+    while True:
+        avanco = relatorios.atualizar(maximo_lotes=1)
+        if not avanco:
+            return {'processados': feitos}
+        feitos += avanco
+        pendentes = database.obter_progresso_relatorios()['pendentes'] or 0
+        progresso(feitos / (feitos + pendentes), f"{feitos} lançamento(s) processado(s)")
+
+def _arquivar_movimentacoes(id_tarefa, argumentos, progresso):
+    relatorio = arquivamento.arquivar(argumentos.get('horizonte_dias'), argumentos.get('tamanho_lote'))
+    relatorio['particoes'] = [dict(particao) for particao in relatorio['particoes']]
+    return relatorio
+
+def _backup(id_tarefa, argumentos, progresso):
+    manifesto = backup.criar_snapshot()
+    manifesto.pop('blocos')
+    return manifesto
+
+TIPOS = {
+    'retiradas': _retiradas,
+    'atualizar_relatorios': _atualizar_relatorios,
+    'arquivar_movimentacoes': _arquivar_movimentacoes,
+    'backup': _backup,
+}
+
+# Prioridades usadas pelas views: o que alguém espera na tela passa na frente da manutenção.
+PRIORIDADE_INTERATIVA = 10
+PRIORIDADE_MANUTENCAO = 0
+
+def enfileirar(tipo, argumentos, prioridade=PRIORIDADE_MANUTENCAO, id_usuario=None, maximo_tentativas=None):
+    if tipo not in TIPOS:
+        raise ErroTarefa(f"Tipo de tarefa desconhecido: {tipo}")
+    return database.enfileirar_tarefa(tipo, argumentos, prioridade, id_usuario, maximo_tentativas)
+
+def espera_apos_falha(tentativas):
+    # Exponencial com variação aleatória, para que falhas em massa não voltem todas juntas.
+    config = database.obter_configuracao()
+    espera = min(config['tarefas_espera_base'] * 2 ** (tentativas - 1), config['tarefas_espera_maxima'])
+    return espera * random.uniform(0.5, 1.0)
+
+def serializavel(tarefa):
+    dados = dict(zip(tarefa.keys(), tarefa))
+    for campo in ('argumentos', 'resultado'):
+        if dados[campo] is not None:
+            dados[campo] = json.loads(dados[campo])
+    return dados
+
+class _Execucao:
+    # Progresso e renovação da reserva de uma tarefa em andamento.
+
+    def __init__(self, tarefa, trabalhador, duracao_reserva):
+        self.id_tarefa = tarefa['id_tarefa']
+        self.trabalhador = trabalhador
+        self.duracao_reserva = duracao_reserva
+        self.progresso = 0.0
+        self.mensagem = None
+        self.perdida = False
+        self._gravado_em = 0.0
+        self._fim = threading.Event()
+        self._thread = threading.Thread(target=self._renovar, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fim.set()
+        self._thread.join()
+
+    def _gravar(self):
+        self._gravado_em = time.monotonic()
+        if not database.atualizar_progresso_tarefa(self.id_tarefa, self.trabalhador, self.progresso, self.mensagem,
+                                                   self.duracao_reserva):
+            self.perdida = True
+
+    def _renovar(self):
+        while not self._fim.wait(self.duracao_reserva / 3):
+            self._gravar()
+
+    def __call__(self, progresso, mensagem=None):
+        # Chamada pela tarefa; grava no máximo duas vezes por segundo.
+        if self.perdida:
+            raise ReservaPerdida(f"A reserva da tarefa {self.id_tarefa} venceu.")
+        self.progresso, self.mensagem = min(max(progresso, 0.0), 1.0), mensagem
+        if time.monotonic() - self._gravado_em >= 0.5:
+            self._gravar()
+
+def executar_proxima(trabalhador):
+    # Reserva e executa uma tarefa. Falso quando a fila está vazia.
+    config = database.obter_configuracao()
+    tarefa = database.reservar_tarefa(trabalhador, config['tarefas_reserva'])
+    if tarefa is None:
+        return False
+    id_tarefa, tipo = tarefa['id_tarefa'], tarefa['tipo']
+    # As alterações feitas pela tarefa ficam na auditoria em nome de quem a enfileirou.
+    database.definir_usuario_atual(tarefa['id_usuario'])
+    try:
+        with _Execucao(tarefa, trabalhador, config['tarefas_reserva']) as execucao:
+            funcao = TIPOS.get(tipo)
+            if funcao is None:
+                raise ErroTarefa(f"Tipo de tarefa desconhecido: {tipo}")
+            resultado = funcao(id_tarefa, json.loads(tarefa['argumentos']), execucao)
+    except ReservaPerdida as e:
+        # Outro trabalhador já assumiu a tarefa; nada a gravar.
+        log.warning("Tarefa %s (%s): %s", id_tarefa, tipo, e)
+    except (ErroTarefa, database.ErroChaveIdempotencia, KeyError, TypeError, ValueError) as e:
+        log.error("Tarefa %s (%s) falhou sem nova tentativa: %r", id_tarefa, tipo, e, exc_info=True)
+        database.falhar_tarefa(id_tarefa, trabalhador, repr(e), None)
+    except Exception as e:
+        log.warning("Tarefa %s (%s) falhou na tentativa %s: %r", id_tarefa, tipo, tarefa['tentativas'], e,
+                    exc_info=True)
+        database.falhar_tarefa(id_tarefa, trabalhador, repr(e), espera_apos_falha(tarefa['tentativas']))
+    else:
+        database.concluir_tarefa(id_tarefa, trabalhador, resultado)
+    finally:
+        database.definir_usuario_atual(None)
+    return True
+
+def trabalhar(parar=None, maximo_tarefas=None):
+    # Laço de um trabalhador: executa tarefas enquanto houver e espera `tarefas_intervalo` com a
+    # fila vazia. `parar` interrompe entre uma tarefa e outra, nunca no meio de uma.
+    parar = parar or threading.Event()
+    trabalhador = f"{socket.gethostname()}:{os.getpid()}"
+    intervalo = database.obter_configuracao()['tarefas_intervalo']
+    executadas = 0
+    while not parar.is_set() and (maximo_tarefas is None or executadas < maximo_tarefas):
+        if executar_proxima(trabalhador):
+            executadas += 1
+        else:
+            parar.wait(intervalo)
+    return executadas
+
+def _processo_trabalhador():
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+    try:
+        trabalhar(parar)
+    finally:
+        auditoria.encerrar()
+
+def iniciar_trabalhadores(quantidade=None):
+    # Um processo por trabalhador (as tarefas usam CPU e o GIL), independente dos workers web.
+    # SIGTERM/SIGINT terminam a tarefa em andamento e encerram.
+    quantidade = quantidade or database.obter_configuracao()['tarefas_trabalhadores']
+    if quantidade == 1:
+        return _processo_trabalhador()
+    metodos = multiprocessing.get_all_start_methods()
+    contexto = multiprocessing.get_context('fork' if 'fork' in metodos else None)
+    processos = [contexto.Process(target=_processo_trabalhador, name=f"trabalhador-{numero}")
+                 for numero in range(quantidade)]
+    for processo in processos:
+        processo.start()
+
+    def repassar(sinal, quadro):
+        for processo in processos:
+            if processo.is_alive():
+                os.kill(processo.pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, repassar)
+    signal.signal(signal.SIGINT, repassar)
+    for processo in processos:
+        processo.join()
+
+def metricas():
+    contagem = database.contar_tarefas()
+    return [
+        ('controle_tarefas', 'Tarefas na fila por estado.',
+         [({'estado': estado}, total) for estado, total in sorted(contagem['estados'].items())]),
+        ('controle_tarefas_espera_segundos', 'Há quanto tempo a tarefa pronta mais antiga espera um trabalhador.',
+         [({}, contagem['espera_segundos'])]),
+    ]
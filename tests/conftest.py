@@ -0,0 +1,105 @@
+import itertools
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# Os testes usam uma cópia do controle.db de exemplo (esquema original, sem
+# migrações); o app a migra ao ser importado. A configuração do db.py é lida
+# uma vez, então as variáveis precisam estar definidas antes do import.
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BANCO_EXEMPLO = os.path.join(RAIZ, 'controle.db')
+
+_pasta = tempfile.mkdtemp(prefix='controle-testes-')
+shutil.copy(BANCO_EXEMPLO, os.path.join(_pasta, 'controle.db'))
+os.environ['DB_PATH'] = os.path.join(_pasta, 'controle.db')
+os.environ['BACKUP_DIR'] = os.path.join(_pasta, 'backups')
+os.environ['SECRET_KEY'] = 'testes'
+os.environ['AUDIT_FLUSH_INTERVAL'] = '0.1'
+os.environ['LOGIN_MAX_ATTEMPTS_IP'] = '100000'
+sys.path.insert(0, RAIZ)
+
+import db as database  # noqa: E402
+from app import app as aplicacao  # noqa: E402
+
+_numeros = itertools.count(1)
+
+def _unico(prefixo):
+    return f"{prefixo} {os.getpid()}-{next(_numeros)}"
+
+@pytest.fixture(scope='session')
+def app():
+    aplicacao.config['TESTING'] = True
+    return aplicacao
+
+@pytest.fixture
+def banco():
+    # Conexão direta, fora do pool e da trava de escrita: para preparar ou estragar dados.
+    conn = sqlite3.connect(database.obter_configuracao()['caminho'], isolation_level=None)
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def novo_equipamento():
+    def criar(quantidade=10, nome=None):
+        nome = nome or _unico('Equipamento')
+        database.adicionar_equipamento(nome, 'Criado pelos testes', quantidade)
+        conn = database.conectar()
+        try:
+            return conn.execute("SELECT id_equipamento FROM equipamentos WHERE nome_equipamento = ?",
+                                (nome,)).fetchone()[0]
+        finally:
+            conn.close()
+    return criar
+
+@pytest.fixture
+def novo_cliente():
+    def criar():
+        nome = _unico('Cliente')
+        database.adicionar_cliente(nome, 'contato@teste')
+        conn = database.conectar()
+        try:
+            return conn.execute("SELECT id_cliente FROM clientes WHERE nome_cliente = ?", (nome,)).fetchone()[0]
+        finally:
+            conn.close()
+    return criar
+
+@pytest.fixture
+def novo_usuario():
+    def criar(nivel_acesso='Administrador', senha='senha-teste'):
+        email = f"{_unico('usuario').replace(' ', '-')}@teste"
+        database.adicionar_usuario('Usuário de Teste', email, senha, 'Testes', nivel_acesso)
+        return database.obter_usuario_por_email(email)['id_usuario'], email, senha
+    return criar
+
+@pytest.fixture
+def entrar(app):
+    # Devolve um test client com a sessão do usuário já aberta.
+    def abrir(email, senha):
+        cliente = app.test_client()
+        resposta = cliente.post('/login', data={'email': email, 'senha': senha})
+        assert resposta.status_code == 302
+        return cliente
+    return abrir
+
+@pytest.fixture
+def cliente_admin(novo_usuario, entrar):
+    _, email, senha = novo_usuario()
+    return entrar(email, senha)
+
+@pytest.fixture
+def banco_novo(tmp_path, monkeypatch):
+    # Aponta o db.py para outra cópia do banco de exemplo, ainda sem migrações, com pool e
+    # cache próprios; o banco compartilhado volta ao fim do teste.
+    caminho = str(tmp_path / 'controle.db')
+    shutil.copy(BANCO_EXEMPLO, caminho)
+    monkeypatch.setattr(database, '_configuracao', dict(database.obter_configuracao(), caminho=caminho))
+    monkeypatch.setattr(database, '_pool', None)
+    monkeypatch.setattr(database, '_cache', None)
+    yield caminho
+    if database._pool is not None:
+        database._pool.fechar_todas()
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import arquivamento
+import db as database
+
+@pytest.fixture
+def banco_arquivo(banco_novo):
+    # O arquivamento varre a tabela inteira; num banco só do teste, os números são exatos.
+    database.criar_tabelas()
+    conn = sqlite3.connect(banco_novo, isolation_level=None)
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def movimentacao(banco_arquivo, novo_equipamento, novo_usuario, novo_cliente):
+    # Retirada e devolução de verdade, com as datas da movimentação levadas para o passado.
+    id_usuario = novo_usuario()[0]
+
+    def criar(retirada='2021-03-01 09:00:00-03:00', devolucao='2021-03-02 17:00:00-03:00', quantidade=2):
+        id_equipamento, id_cliente = novo_equipamento(5), novo_cliente()
+        database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, 'arquivo', quantidade)
+        id_movimentacao = banco_arquivo.execute("SELECT MAX(id_movimentacao) FROM movimentacoes").fetchone()[0]
+        if devolucao:
+            database.registrar_devolucoes_em_lote([id_movimentacao], id_usuario)
+        banco_arquivo.execute("UPDATE movimentacoes SET data_retirada = ?, data_devolucao = ? WHERE id_movimentacao = ?",
+                              (retirada, devolucao, id_movimentacao))
+        return id_movimentacao, id_equipamento, id_cliente
+    return criar
+
+def _linha(conn, tabela, id_movimentacao):
+    return conn.execute(f"SELECT {database.COLUNAS_MOVIMENTACOES} FROM {tabela} WHERE id_movimentacao = ?",
+                        (id_movimentacao,)).fetchone()
+
+def test_ida_e_volta_do_arquivo(banco_arquivo, movimentacao):
+    id_movimentacao, _, id_cliente = movimentacao()
+    original = _linha(banco_arquivo, 'movimentacoes', id_movimentacao)
+    relatorio = arquivamento.arquivar(horizonte_dias=30, tamanho_lote=2, pausa=0)
+    assert relatorio['arquivadas'] >= 1
+    assert relatorio['lotes'] == -(-relatorio['arquivadas'] // 2)
+    assert _linha(banco_arquivo, 'movimentacoes', id_movimentacao) is None
+    assert _linha(banco_arquivo, 'movimentacoes_arquivo_2021', id_movimentacao) == original
+    particoes = {particao['ano']: particao['linhas'] for particao in relatorio['particoes']}
+    assert particoes[2021] == banco_arquivo.execute("SELECT COUNT(*) FROM movimentacoes_arquivo_2021").fetchone()[0]
+    # O histórico do cliente e a exportação continuam enxergando a movimentação arquivada.
+    historico, = database.listar_movimentacoes_por_cliente(id_cliente)
+    assert (historico['quantidade_retirada'], historico['observacao']) == (2, 'arquivo')
+    assert str(historico['data_retirada']).startswith('2021-03-01')
+    exportadas = [linha for lote in database.iterar_movimentacoes(id_cliente=id_cliente) for linha in lote]
+    assert [linha[0] for linha in exportadas] == [id_movimentacao]
+    assert [linha[0] for lote in database.iterar_movimentacoes(id_cliente=id_cliente, data_inicio='2022-01-01')
+            for linha in lote] == []
+
+def test_devolver_movimentacao_arquivada(banco_arquivo, movimentacao):
+    id_movimentacao, id_equipamento, _ = movimentacao()
+    arquivamento.arquivar(horizonte_dias=30, pausa=0)
+    resultado, = database.registrar_devolucoes_em_lote([id_movimentacao])
+    assert (resultado['devolvida'], resultado['motivo']) == (False, 'ja_devolvida')
+    assert database.registrar_devolucao(id_movimentacao) is False
+    assert database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque'] == 5
+
+def test_so_arquiva_as_devolvidas_antes_do_horizonte(banco_arquivo, movimentacao):
+    aberta, _, _ = movimentacao(devolucao=None)
+    recente, _, _ = movimentacao(retirada='2021-03-01 09:00:00-03:00',
+                                 devolucao=str(database.obter_hora_atual()))
+    arquivamento.arquivar(horizonte_dias=30, pausa=0)
+    for id_movimentacao in (aberta, recente):
+        assert _linha(banco_arquivo, 'movimentacoes', id_movimentacao) is not None
+
+def test_relatorios_consolidam_antes_de_arquivar(banco_arquivo, movimentacao):
+    # Os lançamentos são de hoje; a consolidação precisa achar o cliente em movimentacoes.
+    _, _, id_cliente = movimentacao(quantidade=3)
+    arquivamento.arquivar(horizonte_dias=30, pausa=0)
+    assert database.obter_progresso_relatorios()['pendentes'] == 0
+    hoje = database.obter_hora_atual().date().isoformat()
+    cliente, = [linha for linha in database.ranking_clientes(hoje, hoje, 200) if linha['id_cliente'] == id_cliente]
+    assert (cliente['retiradas'], cliente['quantidade_retirada'], cliente['devolucoes']) == (1, 3, 1)
+
+def test_comando_de_arquivamento(app, banco_arquivo, movimentacao):
+    movimentacao()
+    resultado = app.test_cli_runner().invoke(args=['arquivar-movimentacoes', '--dias', '30', '--lote', '10'])
+    assert resultado.exit_code == 0
+    assert 'movimentacoes_arquivo_2021' in resultado.output
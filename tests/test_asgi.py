@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+import db as database
+
+pytest.importorskip('asgiref')
+import asgi  # noqa: E402
+import db_async  # noqa: E402
+
+def _chamar(caminho, corpo=b'', metodo='POST', cabecalhos=()):
+    enviados = []
+    mensagens = [{'type': 'http.request', 'body': corpo, 'more_body': False}]
+
+    async def receive():
+        if mensagens:
+            return mensagens.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(mensagem):
+        enviados.append(mensagem)
+    escopo = {'type': 'http', 'method': metodo, 'path': caminho, 'raw_path': caminho.encode(),
+              'query_string': b'', 'root_path': '', 'scheme': 'http', 'http_version': '1.1',
+              'server': ('testserver', 80), 'client': ('127.0.0.1', 40000), 'headers': list(cabecalhos)}
+    asyncio.run(asgi.aplicacao(escopo, receive, send))
+    inicio = enviados[0]
+    corpo = b''.join(mensagem.get('body', b'') for mensagem in enviados[1:])
+    return inicio['status'], dict(inicio['headers']), corpo
+
+@pytest.fixture
+def sessao(app, novo_usuario, entrar):
+    _, email, senha = novo_usuario()
+    token = entrar(email, senha).get_cookie(app.config['SESSION_COOKIE_NAME']).value
+    return (b'cookie', f"{app.config['SESSION_COOKIE_NAME']}={token}".encode())
+
+def _json(sessao, caminho, corpo):
+    status, _, resposta = _chamar(caminho, corpo if isinstance(corpo, bytes) else json.dumps(corpo).encode(),
+                                  cabecalhos=[sessao, (b'content-type', b'application/json; charset=utf-8')])
+    return status, json.loads(resposta)
+
+def test_sem_sessao_e_401():
+    status, _, corpo = _chamar('/api/retiradas', b'{}', cabecalhos=[(b'content-type', b'application/json')])
+    assert status == 401
+    assert 'login' in json.loads(corpo)['erro']
+
+def test_eventos_sem_sessao_e_401():
+    assert _chamar('/eventos', metodo='GET')[0] == 401
+
+def test_metodo_errado_e_405(sessao):
+    assert _chamar('/api/retiradas', metodo='GET', cabecalhos=[sessao])[0] == 405
+
+def test_formulario_e_recusado_com_415(sessao):
+    for tipo in (b'application/x-www-form-urlencoded', b'text/plain', b'multipart/form-data; boundary=x'):
+        assert _chamar('/api/retiradas', b'{}', cabecalhos=[sessao, (b'content-type', tipo)])[0] == 415
+
+@pytest.mark.parametrize('corpo, trecho', [
+    (b'{"id_equipamentos": [1', 'JSON inválido'),
+    (b'[1, 2]', 'objeto JSON'),
+    (b' ' * (asgi.TAMANHO_MAXIMO_CORPO + 1), 'muito grande'),
+    ({'id_equipamentos': [1], 'id_cliente': 1, 'quantidade': 0}, 'quantidade'),
+    ({'id_equipamentos': [1], 'id_cliente': 1, 'id_requisicao': 'x' * 201}, 'id_requisicao'),
+    ({'id_equipamentos': 1, 'id_cliente': 1}, 'id_equipamentos'),
+])
+def test_pedido_invalido_e_400(sessao, corpo, trecho):
+    status, resposta = _json(sessao, '/api/retiradas', corpo)
+    assert status == 400
+    assert trecho in resposta['erro']
+
+def test_retirada_de_varias_unidades_pela_api(sessao, novo_equipamento, novo_cliente):
+    id_equipamento = novo_equipamento(3)
+    status, resposta = _json(sessao, '/api/retiradas', {'id_equipamentos': [id_equipamento], 'id_cliente': novo_cliente(),
+                                                        'quantidade': 2})
+    assert (status, resposta['registrados']) == (200, 1)
+    assert database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque'] == 1
+
+def test_demais_rotas_vao_para_o_flask():
+    status, cabecalhos, corpo = _chamar('/login', metodo='GET')
+    assert status == 200
+    assert cabecalhos[b'content-type'].startswith(b'text/html')
+    assert 'senha' in corpo.decode('utf-8')
+
+def test_ciclo_de_vida_abre_e_fecha_o_executor():
+    mensagens = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    enviados = []
+
+    async def receive():
+        return mensagens.pop(0)
+
+    async def send(mensagem):
+        enviados.append(mensagem['type'])
+    asyncio.run(asgi.aplicacao({'type': 'lifespan'}, receive, send))
+    assert enviados == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert db_async._executor is None
+
+# --- db_async ---
+
+def test_db_async_devolve_o_mesmo_que_o_db(novo_equipamento):
+    id_equipamento = novo_equipamento(nome='Assíncrono')
+    assert asyncio.run(db_async.obter_equipamento_por_id(id_equipamento)) == \
+        database.obter_equipamento_por_id(id_equipamento)
+
+def test_db_async_itera_em_lotes(novo_equipamento, novo_usuario, novo_cliente):
+    id_cliente = novo_cliente()
+    database.registrar_retiradas_em_lote([novo_equipamento() for _ in range(3)], novo_usuario()[0], id_cliente, None)
+
+    async def coletar():
+        return [len(lote) async for lote in db_async.iterar_movimentacoes(id_cliente=id_cliente, tamanho_lote=2)]
+    assert asyncio.run(coletar()) == [2, 1]
+
+def test_db_async_leva_o_usuario_atual_para_a_thread():
+    async def usuario():
+        database.definir_usuario_atual(1234)
+        return await db_async.executar(database._usuario_atual.get)
+    assert asyncio.run(usuario()) == 1234
+    assert database._usuario_atual.get() is None
+
+def test_db_async_so_expoe_funcoes_publicas():
+    for nome in ('_registrar_retiradas', 'TAMANHO_PAGINA_MAXIMO', 'inexistente'):
+        with pytest.raises(AttributeError):
+            getattr(db_async, nome)
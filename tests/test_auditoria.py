@@ -0,0 +1,61 @@
+import json
+
+import auditoria
+import db as database
+
+def _registros(tabela, id_registro):
+    auditoria.obter_auditor().descarregar()
+    return [auditoria.serializavel(linha) for linha in database.listar_auditoria(tabela, id_registro)]
+
+def test_alteracoes_ficam_registradas_com_o_usuario(novo_equipamento, novo_usuario):
+    id_usuario = novo_usuario()[0]
+    database.definir_usuario_atual(id_usuario)
+    try:
+        id_equipamento = novo_equipamento(3)
+        database.atualizar_equipamento(id_equipamento, 'Renomeado', 'desc', 5, 2)
+    finally:
+        database.definir_usuario_atual(None)
+    alteracao, criacao = _registros('equipamentos', id_equipamento)
+    assert (criacao['acao'], criacao['antes'], criacao['depois']['quantidade_estoque']) == ('criacao', None, 3)
+    assert alteracao['acao'] == 'alteracao'
+    assert (alteracao['antes']['quantidade_estoque'], alteracao['depois']['quantidade_estoque']) == (3, 5)
+    assert alteracao['depois']['nome_equipamento'] == 'Renomeado'
+    assert {criacao['id_usuario'], alteracao['id_usuario']} == {id_usuario}
+
+def test_senha_nao_vai_para_a_auditoria(novo_usuario):
+    id_usuario = novo_usuario()[0]
+    criacao, = _registros('usuarios', id_usuario)
+    assert 'senha' not in criacao['depois']
+
+def test_transacao_desfeita_nao_gera_registro(novo_usuario):
+    id_usuario, email, _ = novo_usuario()
+    _, outro_email, _ = novo_usuario()
+    database.atualizar_usuario(id_usuario, 'Outro nome', outro_email, '', 'Testes', 'Administrador')
+    assert [registro['acao'] for registro in _registros('usuarios', id_usuario)] == ['criacao']
+
+def test_gatilhos_seguem_o_esquema_depois_das_migracoes(banco_novo, capsys):
+    # Uma conexão que já escreveu no esquema antigo passa pelas migrações e continua no pool;
+    # os gatilhos dela têm que enxergar as colunas novas.
+    auditoria.obter_auditor().descarregar()
+    with database.transacao_escrita():
+        pass
+    database.criar_tabelas()
+    capsys.readouterr()
+    id_equipamento = database.listar_equipamentos()[0]['id_equipamento']
+    equipamento = database.obter_equipamento_por_id(id_equipamento)
+    database.atualizar_equipamento(id_equipamento, equipamento['nome_equipamento'],
+                                   equipamento['descricao_equipamento'], equipamento['quantidade_estoque'], 7)
+    registro = _registros('equipamentos', id_equipamento)[0]
+    assert (registro['antes']['estoque_minimo'], registro['depois']['estoque_minimo']) == (0, 7)
+    assert 'Erro ao gravar auditoria' not in capsys.readouterr().out
+
+def test_buffer_nao_passa_do_limite(monkeypatch):
+    monkeypatch.setattr(database, 'gravar_auditoria', lambda entradas: False)
+    auditor = auditoria.Auditor(tamanho_lote=100, intervalo=60, maximo_pendentes=5)
+    for numero in range(8):
+        auditor.registrar([(numero, None, 'equipamentos', numero, 'criacao', None, json.dumps({}))])
+    estatisticas = auditor.estatisticas()
+    assert estatisticas['pendentes'] == 5
+    assert estatisticas['descartadas'] == 3
+    # As mais antigas é que se perdem.
+    assert [entrada[0] for entrada in auditor._pendentes] == [3, 4, 5, 6, 7]
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import backup
+import db as database
+
+def _equipamentos(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return {linha[0] for linha in conn.execute("SELECT nome_equipamento FROM equipamentos")}
+    finally:
+        conn.close()
+
+def test_snapshot_verifica_e_restaura_em_outro_arquivo(tmp_path, novo_equipamento):
+    novo_equipamento(nome='Equipamento do snapshot')
+    manifesto = backup.criar_snapshot(str(tmp_path))
+    assert backup.verificar(manifesto['nome'], completo=True, pasta=str(tmp_path))['sha256'] == manifesto['sha256']
+    destino = str(tmp_path / 'restaurado.db')
+    backup.restaurar(manifesto['nome'], destino=destino, pasta=str(tmp_path))
+    assert 'Equipamento do snapshot' in _equipamentos(destino)
+
+def test_bloco_corrompido_e_detectado(tmp_path):
+    manifesto = backup.criar_snapshot(str(tmp_path))
+    resumo = manifesto['blocos'][0]
+    with open(os.path.join(tmp_path, 'blocos', resumo[:2], resumo), 'r+b') as arquivo:
+        arquivo.write(b'\0' * 16)
+    with pytest.raises(backup.ErroBackup, match='corrompido'):
+        backup.verificar(pasta=str(tmp_path))
+
+def test_retencao_apaga_so_blocos_sem_uso(tmp_path, novo_equipamento):
+    primeiro = backup.criar_snapshot(str(tmp_path))
+    novo_equipamento()
+    ultimo = backup.criar_snapshot(str(tmp_path))
+    assert backup.aplicar_retencao(1, str(tmp_path)) == 1
+    assert [manifesto['nome'] for manifesto in backup.listar_snapshots(str(tmp_path))] == [ultimo['nome']]
+    restantes = {nome for _, _, nomes in os.walk(tmp_path / 'blocos') for nome in nomes}
+    assert restantes == set(ultimo['blocos'])
+    assert set(primeiro['blocos']) - restantes == set(primeiro['blocos']) - set(ultimo['blocos'])
+    backup.verificar(completo=True, pasta=str(tmp_path))
+
+def test_retencao_espera_o_snapshot_em_andamento(tmp_path):
+    backup.criar_snapshot(str(tmp_path))
+    _, snapshots = backup._pastas(str(tmp_path))
+    terminou = threading.Event()
+    thread = threading.Thread(target=lambda: (backup.aplicar_retencao(1, str(tmp_path)), terminou.set()))
+    with backup._travar(snapshots, exclusiva=True):
+        thread.start()
+        assert not terminou.wait(0.2)
+    assert terminou.wait(5)
+    thread.join()
+
+def test_restaurar_no_banco_em_uso(tmp_path, novo_equipamento):
+    manifesto = backup.criar_snapshot(str(tmp_path))
+    id_equipamento = novo_equipamento(nome='Cadastrado depois do snapshot')
+    versao = database.obter_versoes(('equipamentos',))[0]
+    backup.restaurar(manifesto['nome'], pasta=str(tmp_path))
+    assert database.obter_equipamento_por_id(id_equipamento) is None
+    assert 'Cadastrado depois do snapshot' not in [linha['nome_equipamento']
+                                                   for linha in database.listar_equipamentos(limite=200)]
+    # As versões só sobem, então nenhum cache guardado antes da restauração continua valendo.
+    assert database.obter_versoes(('equipamentos',))[0] > versao
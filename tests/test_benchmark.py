@@ -0,0 +1,57 @@
+import sqlite3
+from collections import Counter
+
+import pytest
+
+import db as database
+from benchmark import gerador, resultados
+
+ESCALA = {'movimentacoes': 500, 'equipamentos': 30, 'clientes': 20, 'usuarios': 3}
+
+@pytest.fixture
+def gerar(tmp_path, monkeypatch):
+    monkeypatch.setitem(gerador.ESCALAS, 'teste', ESCALA)
+
+    def gerar(nome, semente=gerador.SEMENTE_PADRAO):
+        caminho = str(tmp_path / nome)
+        gerador.gerar(caminho, 'teste', semente)
+        return sqlite3.connect(caminho)
+    return gerar
+
+def _conteudo(conn):
+    return [conn.execute(f"SELECT * FROM {tabela} ORDER BY 1").fetchall()
+            for tabela in ('usuarios', 'equipamentos', 'clientes', 'movimentacoes')]
+
+def test_gera_os_volumes_no_esquema_atual(gerar):
+    conn = gerar('a.db')
+    for tabela, total in ESCALA.items():
+        assert conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0] == total
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == database.MIGRACOES[-1]['versao']
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+def test_mesma_semente_gera_o_mesmo_banco(gerar):
+    assert _conteudo(gerar('a.db')) == _conteudo(gerar('b.db'))
+    assert _conteudo(gerar('c.db', semente=7)) != _conteudo(gerar('d.db'))
+
+def test_movimentacoes_concentradas_em_poucos_clientes(gerar):
+    conn = gerar('a.db')
+    por_cliente = Counter(id_cliente for id_cliente, in conn.execute("SELECT id_cliente FROM movimentacoes"))
+    # Com Zipf, o cliente mais ativo tem bem mais que a média (500 / 20 = 25).
+    assert por_cliente.most_common(1)[0][1] > 3 * ESCALA['movimentacoes'] / ESCALA['clientes']
+
+def test_comparacao_acusa_so_regressoes_acima_da_tolerancia():
+    baseline = {'micro': {'a': {'mediana_ms': 10.0}, 'b': {'mediana_ms': 10.0}, 'c': {'mediana_ms': 0}}}
+    atual = {'micro': {'a': {'mediana_ms': 11.0}, 'b': {'mediana_ms': 13.0}, 'c': {'mediana_ms': 5.0},
+                       'novo': {'mediana_ms': 1.0}}}
+    comparacoes = {c['caso']: c for c in resultados.comparar(atual, baseline, tolerancia=0.2)}
+    assert set(comparacoes) == {'a', 'b'}
+    assert not comparacoes['a']['regressao']
+    assert comparacoes['b']['regressao']
+    assert comparacoes['b']['variacao'] == pytest.approx(0.3)
+
+def test_resultado_salvo_e_carregado(tmp_path):
+    resultado = {'metadados': resultados.metadados(escala='teste'), 'micro': {'a': {'mediana_ms': 1.5}}}
+    caminho = str(tmp_path / 'resultados' / 'ultimo.json')
+    resultados.salvar(resultado, caminho)
+    assert resultados.carregar(caminho) == resultado
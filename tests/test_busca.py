@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+
+import db as database
+
+@pytest.fixture
+def palavra():
+    # Uma palavra que só existe neste teste.
+    return f"zq{uuid.uuid4().hex[:10]}"
+
+def _ids(tipo, termo, **argumentos):
+    chave = 'id_equipamento' if tipo == 'equipamentos' else 'id_cliente'
+    return [item[chave] for item in database.buscar(tipo, termo, **argumentos)['itens']]
+
+def _indice_integro(banco):
+    for tabela in ('equipamentos_fts', 'clientes_fts'):
+        banco.execute(f"INSERT INTO {tabela}({tabela}) VALUES ('integrity-check')")
+
+def test_edicao_atualiza_o_indice(novo_equipamento, palavra, banco):
+    id_equipamento = novo_equipamento(4, nome=f'Furadeira {palavra}')
+    assert _ids('equipamentos', palavra) == [id_equipamento]
+    database.atualizar_equipamento(id_equipamento, 'Parafusadeira', f'antes {palavra}', 4)
+    assert _ids('equipamentos', 'Furadeira ' + palavra) == []
+    assert _ids('equipamentos', f'parafusa {palavra}') == [id_equipamento]
+    _indice_integro(banco)
+
+def test_mudanca_de_estoque_nao_mexe_no_indice(novo_equipamento, novo_usuario, novo_cliente, palavra, banco):
+    id_equipamento = novo_equipamento(4, nome=f'Serra {palavra}')
+    database.registrar_retiradas_em_lote([id_equipamento], novo_usuario()[0], novo_cliente(), None)
+    resultado, = database.buscar('equipamentos', palavra)['itens']
+    assert resultado['quantidade_estoque'] == 3
+    _indice_integro(banco)
+
+def test_equipamento_desativado_sai_da_busca(novo_equipamento, palavra, banco):
+    id_equipamento = novo_equipamento(nome=f'Lixadeira {palavra}')
+    database.desativar_equipamento(id_equipamento)
+    assert _ids('equipamentos', palavra) == []
+    _indice_integro(banco)
+
+def test_nome_pesa_mais_que_descricao(palavra):
+    database.adicionar_equipamento(f'Modelo genérico {palavra[2:]}', f'compatível com {palavra}', 1)
+    database.adicionar_equipamento(f'{palavra} original', 'sem menção', 1)
+    nomes = [item['nome_equipamento'] for item in database.buscar('equipamentos', palavra)['itens']]
+    assert nomes == [f'{palavra} original', f'Modelo genérico {palavra[2:]}']
+
+def test_paginas_da_busca(palavra):
+    for numero in range(5):
+        database.adicionar_cliente(f'Cliente {palavra} {numero}', 'contato')
+    primeira = database.buscar('clientes', palavra, pagina=1, limite=3)
+    segunda = database.buscar('clientes', palavra, pagina=2, limite=3)
+    assert (len(primeira['itens']), primeira['tem_mais']) == (3, True)
+    assert (len(segunda['itens']), segunda['tem_mais']) == (2, False)
+    assert not {item['id_cliente'] for item in primeira['itens']} & {item['id_cliente'] for item in segunda['itens']}
+
+@pytest.mark.parametrize('termo', ['"', 'NEAR(a b)', 'a AND', '*', 'col:valor', ''])
+def test_sintaxe_fts_no_termo_nao_quebra_a_busca(termo, capsys):
+    assert isinstance(database.buscar('equipamentos', termo)['itens'], list)
+    assert 'Erro na busca' not in capsys.readouterr().out
+
+def test_api_de_busca(cliente_admin, palavra, app):
+    database.adicionar_cliente(f'Oficina {palavra}', f'{palavra}@contato')
+    resposta = cliente_admin.get(f'/api/busca?tipo=clientes&q={palavra[:-2]}')
+    assert [item['nome_cliente'] for item in resposta.get_json()['clientes']['itens']] == [f'Oficina {palavra}']
+    assert cliente_admin.get('/api/busca?tipo=usuarios&q=a').status_code == 404
+    assert app.test_client().get(f'/api/busca?q={palavra}').status_code == 302
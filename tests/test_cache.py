@@ -0,0 +1,57 @@
+import time
+
+import db as database
+from cache import CacheLeitura
+
+def test_entrada_vale_enquanto_as_versoes_nao_mudam():
+    cache = CacheLeitura(ttl=60)
+    cache.guardar('chave', ('equipamentos',), (1,), [1, 2])
+    assert cache.obter('chave', (1,)) == (True, [1, 2])
+    assert cache.obter('chave', (2,)) == (False, None)
+    assert cache.obter('chave', (1,)) == (False, None)
+    assert cache.estatisticas()['invalidadas'] == 1
+
+def test_entrada_expira_pelo_ttl():
+    cache = CacheLeitura(ttl=0.01)
+    cache.guardar('chave', ('equipamentos',), (1,), [1])
+    time.sleep(0.02)
+    assert cache.obter('chave', (1,)) == (False, None)
+    assert cache.estatisticas()['expiradas'] == 1
+
+def test_despeja_a_menos_usada():
+    cache = CacheLeitura(max_entradas=2)
+    cache.guardar('a', (), (), [1])
+    cache.guardar('b', (), (), [2])
+    cache.obter('a', ())
+    cache.guardar('c', (), (), [3])
+    assert cache.obter('b', ())[0] is False
+    assert cache.obter('a', ())[0] and cache.obter('c', ())[0]
+
+def test_invalidar_por_tabela():
+    cache = CacheLeitura()
+    cache.guardar('equipamentos', ('equipamentos',), (1,), [1])
+    cache.guardar('clientes', ('clientes',), (1,), [1])
+    cache.invalidar('equipamentos')
+    assert cache.obter('equipamentos', (1,))[0] is False
+    assert cache.obter('clientes', (1,))[0] is True
+
+def test_listas_vazias_ou_grandes_nao_sao_guardadas():
+    cache = CacheLeitura(max_itens=3)
+    cache.guardar('vazia', (), (), [])
+    cache.guardar('grande', (), (), [1, 2, 3, 4])
+    assert cache.estatisticas()['entradas'] == 0
+
+def test_listagem_repetida_vem_do_cache(novo_cliente):
+    novo_cliente()
+    database.listar_clientes(prefixo='Cliente')
+    antes = database.estatisticas_cache()['hits']
+    database.listar_clientes(prefixo='Cliente')
+    assert database.estatisticas_cache()['hits'] == antes + 1
+
+def test_escrita_de_outro_processo_invalida_o_cache(novo_equipamento, banco):
+    # Os gatilhos incrementam versoes_tabelas em qualquer conexão, até fora do pool.
+    id_equipamento = novo_equipamento(3)
+    nome = database.obter_equipamento_por_id(id_equipamento)['nome_equipamento']
+    assert [linha['quantidade_estoque'] for linha in database.listar_equipamentos(prefixo=nome)] == [3]
+    banco.execute("UPDATE equipamentos SET quantidade_estoque = 8 WHERE id_equipamento = ?", (id_equipamento,))
+    assert [linha['quantidade_estoque'] for linha in database.listar_equipamentos(prefixo=nome)] == [8]
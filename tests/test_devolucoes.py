@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+
+import db as database
+
+@pytest.fixture
+def retirada(novo_equipamento, novo_usuario, novo_cliente):
+    # Cria um equipamento com estoque e devolve os ids de `quantidade` retiradas abertas dele.
+    id_usuario, id_cliente = novo_usuario()[0], novo_cliente()
+
+    def criar(quantidade=1):
+        id_equipamento = novo_equipamento(quantidade)
+        database.registrar_retiradas_em_lote([id_equipamento] * quantidade, id_usuario, id_cliente, None)
+        conn = database.conectar()
+        try:
+            ids = [linha[0] for linha in conn.execute(
+                "SELECT id_movimentacao FROM movimentacoes WHERE id_equipamento = ? ORDER BY id_movimentacao",
+                (id_equipamento,))]
+        finally:
+            conn.close()
+        return id_equipamento, ids
+    return criar
+
+def _estoque(id_equipamento):
+    return database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque']
+
+def test_lote_devolve_e_marca_repetidas(retirada):
+    id_equipamento, ids = retirada(2)
+    resultados = database.registrar_devolucoes_em_lote(ids + [ids[0], 99999999, 'x'])
+    assert [resultado['devolvida'] for resultado in resultados] == [True, True, False, False, False]
+    assert [resultado['motivo'] for resultado in resultados[2:]] == ['ja_devolvida', 'nao_encontrada',
+                                                                     'nao_encontrada']
+    assert _estoque(id_equipamento) == 2
+
+def test_devolver_de_novo_nao_soma_estoque(retirada):
+    id_equipamento, ids = retirada(1)
+    assert database.registrar_devolucao(ids[0]) is True
+    assert database.registrar_devolucao(ids[0]) is False
+    resultado = database.registrar_devolucoes_em_lote(ids)[0]
+    assert resultado['motivo'] == 'ja_devolvida'
+    assert _estoque(id_equipamento) == 1
+
+def test_chave_repetida_nao_devolve_duas_vezes(retirada, novo_usuario):
+    id_equipamento, ids = retirada(2)
+    id_usuario = novo_usuario()[0]
+    primeira = database.registrar_devolucoes_em_lote(ids[:1], id_usuario, chave='d-1')
+    assert database.registrar_devolucoes_em_lote(ids[:1], id_usuario, chave='d-1') == primeira
+    with pytest.raises(database.ErroChaveIdempotencia):
+        database.registrar_devolucoes_em_lote(ids[1:], id_usuario, chave='d-1')
+    # A chave vale por usuário: outro usuário pode usar a mesma.
+    outro = novo_usuario()[0]
+    assert database.registrar_devolucoes_em_lote(ids[1:], outro, chave='d-1')[0]['devolvida']
+    assert _estoque(id_equipamento) == 2
+
+def test_rota_do_formulario(cliente_admin, retirada):
+    _, ids = retirada(1)
+    texto = cliente_admin.post(f'/movimentacoes/devolver/{ids[0]}', follow_redirects=True).get_data(as_text=True)
+    assert 'Devolução registrada com sucesso!' in texto
+    texto = cliente_admin.post(f'/movimentacoes/devolver/{ids[0]}', follow_redirects=True).get_data(as_text=True)
+    assert 'já devolvida' in texto
+
+# --- API de lotes (asgi.py) ---
+
+@pytest.fixture
+def chamar_api(app, novo_usuario, entrar):
+    # O modo ASGI é opcional (requer asgiref).
+    pytest.importorskip('asgiref')
+    import asgi
+    _, email, senha = novo_usuario()
+    token = entrar(email, senha).get_cookie(app.config['SESSION_COOKIE_NAME']).value
+
+    def chamar(caminho, corpo, tipo=b'application/json', cabecalhos=()):
+        enviados = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': json.dumps(corpo).encode(), 'more_body': False}
+
+        async def send(mensagem):
+            enviados.append(mensagem)
+        escopo = {'type': 'http', 'method': 'POST', 'path': caminho, 'headers': [
+            (b'content-type', tipo),
+            (b'cookie', f"{app.config['SESSION_COOKIE_NAME']}={token}".encode()),
+            *cabecalhos,
+        ]}
+        asyncio.run(asgi.aplicacao(escopo, receive, send))
+        return enviados[0]['status'], json.loads(enviados[1]['body'])
+    return chamar
+
+def test_api_devolucoes_em_lote(chamar_api, retirada):
+    id_equipamento, ids = retirada(3)
+    status, resposta = chamar_api('/api/devolucoes', {'id_movimentacoes': ids + [ids[0]], 'id_requisicao': 'a-1'})
+    assert (status, resposta['devolvidas']) == (200, 3)
+    assert resposta['resultados'][-1]['motivo'] == 'ja_devolvida'
+    assert chamar_api('/api/devolucoes', {'id_movimentacoes': ids + [ids[0]], 'id_requisicao': 'a-1'}) \
+        == (status, resposta)
+    status, _ = chamar_api('/api/devolucoes', {'id_movimentacoes': ids[:1]}, cabecalhos=[(b'idempotency-key', b'a-1')])
+    assert status == 409
+    assert _estoque(id_equipamento) == 3
+
+def test_api_devolucao_individual(chamar_api, retirada):
+    _, ids = retirada(1)
+    assert chamar_api(f'/api/devolucoes/{ids[0]}', {})[0] == 200
+    assert chamar_api(f'/api/devolucoes/{ids[0]}', {})[0] == 409
+    assert chamar_api('/api/devolucoes/99999999', {})[0] == 404
+
+def test_api_retiradas(chamar_api, novo_equipamento, novo_cliente):
+    id_equipamento = novo_equipamento(1)
+    status, resposta = chamar_api('/api/retiradas', {'id_equipamentos': [id_equipamento, id_equipamento],
+                                                     'id_cliente': novo_cliente()})
+    assert (status, resposta['registrados']) == (200, 1)
+    assert resposta['resultados'][1]['motivo'] == 'sem_estoque'
+    assert _estoque(id_equipamento) == 0
+
+def test_api_valida_o_pedido(chamar_api):
+    assert chamar_api('/api/devolucoes', {'id_movimentacoes': []})[0] == 400
+    assert chamar_api('/api/devolucoes', {'id_movimentacoes': [1] * 1001})[0] == 400
+    assert chamar_api('/api/devolucoes', {'id_movimentacoes': [1]}, tipo=b'text/plain')[0] == 415
+    assert chamar_api('/api/retiradas', {'id_equipamentos': [1]})[0] == 400
@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db as database
+
+@pytest.fixture
+def banco_sem_espera(banco_novo, monkeypatch):
+    # Sem busy_timeout, quem espera pela trava do SQLite são só as novas tentativas do transacao_escrita.
+    config = database.obter_configuracao()
+    monkeypatch.setattr(database, '_configuracao', dict(
+        config, tentativas_escrita=4, espera_escrita=0.05, pragmas=dict(config['pragmas'], busy_timeout=0)))
+    database.criar_tabelas()
+    return banco_novo
+
+def _trava_externa(caminho):
+    # Outro processo (aqui, outra conexão fora do pool) segurando a escrita.
+    conn = sqlite3.connect(caminho, isolation_level=None, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+def test_conexoes_saem_com_os_pragmas_configurados():
+    conn = database.conectar()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_leitura_nao_bloqueia_nem_e_bloqueada_pela_escrita(banco, novo_equipamento):
+    id_equipamento = novo_equipamento(3)
+    banco.execute("BEGIN")
+    assert banco.execute("SELECT quantidade_estoque FROM equipamentos WHERE id_equipamento = ?",
+                         (id_equipamento,)).fetchone()[0] == 3
+    # Com WAL, o commit não espera o leitor terminar, e o leitor segue com a sua foto do banco.
+    with database.transacao_escrita('equipamentos') as conn:
+        conn.execute("UPDATE equipamentos SET quantidade_estoque = 9 WHERE id_equipamento = ?", (id_equipamento,))
+    assert banco.execute("SELECT quantidade_estoque FROM equipamentos WHERE id_equipamento = ?",
+                         (id_equipamento,)).fetchone()[0] == 3
+    banco.execute("COMMIT")
+    assert database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque'] == 9
+
+def test_escrita_tenta_de_novo_enquanto_o_banco_esta_ocupado(banco_sem_espera):
+    externa = _trava_externa(banco_sem_espera)
+    threading.Timer(0.1, externa.rollback).start()
+    with database.transacao_escrita() as conn:
+        conn.execute("UPDATE equipamentos SET estoque_minimo = 1")
+    externa.close()
+
+def test_escrita_desiste_depois_das_tentativas(banco_sem_espera):
+    externa = _trava_externa(banco_sem_espera)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            with database.transacao_escrita():
+                pass
+    finally:
+        externa.close()
+    # A conexão volta ao pool sem transação pendurada.
+    with database.transacao_escrita() as conn:
+        conn.execute("UPDATE equipamentos SET estoque_minimo = 1")
+
+def test_escritas_concorrentes_sao_serializadas(novo_equipamento, capsys):
+    id_equipamento = novo_equipamento(0)
+    erros = []
+
+    def incrementar():
+        try:
+            for _ in range(20):
+                with database.transacao_escrita('equipamentos') as conn:
+                    atual = conn.execute("SELECT quantidade_estoque FROM equipamentos WHERE id_equipamento = ?",
+                                         (id_equipamento,)).fetchone()[0]
+                    conn.execute("UPDATE equipamentos SET quantidade_estoque = ? WHERE id_equipamento = ?",
+                                 (atual + 1, id_equipamento))
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=incrementar) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert erros == []
+    # Leitura e escrita separadas dentro da transação: sem a serialização, incrementos se perderiam.
+    assert database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque'] == 120
+    assert 'locked' not in capsys.readouterr().out
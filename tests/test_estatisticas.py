@@ -0,0 +1,43 @@
+import re
+
+import db as database
+
+def _no_painel(cliente, chave):
+    texto = cliente.get('/').get_data(as_text=True)
+    return int(re.search(rf'data-estatistica="{chave}">(\d+)<', texto).group(1))
+
+def test_contadores_acompanham_as_escritas(novo_equipamento, novo_usuario, novo_cliente):
+    id_cliente = novo_cliente()
+    antes = database.obter_estatisticas()
+    id_usuario = novo_usuario()[0]
+    id_equipamento = novo_equipamento(4)
+    database.registrar_retiradas_em_lote([id_equipamento] * 3, id_usuario, id_cliente, None)
+    depois = database.obter_estatisticas()
+    assert depois['total_equipamentos'] == antes['total_equipamentos'] + 4
+    assert depois['em_uso'] == antes['em_uso'] + 3
+    assert depois['total_usuarios'] == antes['total_usuarios'] + 1
+    assert database.reconciliar_estatisticas(corrigir=False) == {}
+
+def test_reconciliar_corrige_contador_divergente(banco):
+    banco.execute("UPDATE estatisticas SET valor = valor + 7 WHERE chave = 'total_usuarios'")
+    divergencias = database.reconciliar_estatisticas(corrigir=False)
+    assert list(divergencias) == ['total_usuarios']
+    assert divergencias['total_usuarios']['armazenado'] == divergencias['total_usuarios']['calculado'] + 7
+    assert database.reconciliar_estatisticas() == divergencias
+    assert database.reconciliar_estatisticas() == {}
+
+def test_correcao_invalida_o_painel(cliente_admin, banco, novo_equipamento):
+    correto = banco.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]
+    banco.execute("UPDATE estatisticas SET valor = valor + 50 WHERE chave = 'total_usuarios'")
+    # Uma escrita qualquer faz o painel ser montado de novo, agora com o contador errado.
+    novo_equipamento()
+    cliente_admin.get('/')
+    assert _no_painel(cliente_admin, 'total_usuarios') == correto + 50
+    etag = cliente_admin.get('/').headers['ETag']
+    assert cliente_admin.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+    database.reconciliar_estatisticas()
+    resposta = cliente_admin.get('/', headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    assert _no_painel(cliente_admin, 'total_usuarios') == correto
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+import db as database
+import eventos
+
+@pytest.fixture
+def difusor(monkeypatch):
+    # Difusor próprio do teste, com espera e heartbeat curtos.
+    monkeypatch.setattr(database, '_configuracao', dict(database.obter_configuracao(), eventos_heartbeat=0.2))
+    difusor = eventos.Difusor(intervalo=0.02, tamanho_fila=100)
+    monkeypatch.setattr(eventos, '_difusor', difusor)
+    return difusor
+
+def _aguardar(condicao, limite=5):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "tempo esgotado"
+        time.sleep(0.01)
+
+def _eventos_apos(ultimo_id):
+    return [(evento['tipo'], json.loads(evento['dados'])) for evento in database.listar_eventos(ultimo_id)]
+
+def _tipo(pedaco):
+    return next(linha for linha in pedaco.split('\n') if linha.startswith('event: ')).removeprefix('event: ')
+
+def _ate_o_ping(fluxo):
+    # Pedaços do fluxo até o próximo heartbeat (exclusive).
+    pedacos = []
+    for pedaco in fluxo:
+        if pedaco == ": ping\n\n":
+            return pedacos
+        pedacos.append(pedaco)
+
+def test_formatar():
+    assert eventos.formatar(3, 'retirada', '{"a":1}') == 'id: 3\nevent: retirada\ndata: {"a":1}\n\n'
+    assert eventos.formatar(None, 'estatisticas', '{}') == 'event: estatisticas\ndata: {}\n\n'
+
+@pytest.mark.parametrize('valor, esperado', [('12', 12), ('x', None), ('', None), (None, None)])
+def test_ultimo_id_da_requisicao(valor, esperado):
+    assert eventos.ultimo_id_da_requisicao(valor) == esperado
+
+def test_gatilhos_gravam_as_mudancas(novo_equipamento, novo_usuario, novo_cliente):
+    id_equipamento = novo_equipamento(3, nome='Equipamento com eventos')
+    inicio = database.ultimo_evento()
+    database.registrar_retiradas_em_lote([id_equipamento], novo_usuario()[0], novo_cliente(), None, 2)
+    gravados = dict(_eventos_apos(inicio))
+    assert set(gravados) == {'retirada', 'equipamento'}
+    retirada = gravados['retirada']
+    assert (retirada['id_equipamento'], retirada['quantidade']) == (id_equipamento, 2)
+    assert retirada['nome_equipamento'] == 'Equipamento com eventos'
+    assert gravados['equipamento']['quantidade_estoque'] == 1
+
+    meio = database.ultimo_evento()
+    database.registrar_devolucoes_em_lote([retirada['id_movimentacao']])
+    database.desativar_equipamento(id_equipamento)
+    tipos = [tipo for tipo, _ in _eventos_apos(meio)]
+    assert sorted(tipos[:2]) == ['devolucao', 'equipamento']
+    assert tipos[2:] == ['desativacao']
+    # Equipamento inativo não gera mais eventos de edição.
+    fim = database.ultimo_evento()
+    database.atualizar_equipamento(id_equipamento, 'Inativo editado', '', 9)
+    assert database.ultimo_evento() == fim
+
+def test_transacao_desfeita_nao_gera_evento(novo_equipamento):
+    id_equipamento = novo_equipamento()
+    inicio = database.ultimo_evento()
+    with pytest.raises(RuntimeError):
+        with database.transacao_escrita('equipamentos') as conn:
+            conn.execute("UPDATE equipamentos SET quantidade_estoque = 99 WHERE id_equipamento = ?", (id_equipamento,))
+            raise RuntimeError("desfaz")
+    assert database.ultimo_evento() == inicio
+
+def test_reconexao_recebe_o_que_perdeu(difusor, novo_equipamento):
+    ultimo_id = database.ultimo_evento()
+    database.atualizar_equipamento(novo_equipamento(), 'Perdido na desconexão', '', 4)
+    fluxo = eventos.fluxo(ultimo_id)
+    try:
+        assert next(fluxo) == f"retry: {eventos.RECONEXAO_MS}\n\n"
+        equipamento, estatisticas = _ate_o_ping(fluxo)
+        assert int(equipamento.split('\n')[0].removeprefix('id: ')) > ultimo_id
+        assert (_tipo(equipamento), _tipo(estatisticas)) == ('equipamento', 'estatisticas')
+        assert 'Perdido na desconexão' in equipamento
+        assert json.loads(estatisticas.split('data: ')[1])['total_equipamentos'] >= 1
+    finally:
+        fluxo.close()
+    assert difusor.estatisticas()['assinantes'] == 0
+
+def test_fluxo_ao_vivo_entrega_cada_evento_uma_vez(difusor, novo_equipamento):
+    id_equipamento = novo_equipamento()
+    fluxo = eventos.fluxo()
+    try:
+        next(fluxo)
+        _aguardar(lambda: difusor._ultimo is not None)
+        # A escrita acontece com o fluxo já parado na fila, esperando o difusor.
+        threading.Timer(0.05, database.atualizar_equipamento, (id_equipamento, 'Ao vivo', '', 7)).start()
+        pedacos = _ate_o_ping(fluxo)
+        assert [_tipo(pedaco) for pedaco in pedacos] == ['equipamento', 'estatisticas']
+        assert '"quantidade_estoque":7' in pedacos[0]
+        assert _ate_o_ping(fluxo) == []
+        assert difusor.estatisticas()['eventos'] >= 1
+    finally:
+        fluxo.close()
+
+def test_novos_ignora_eventos_ja_enviados():
+    mensagens = [(5, 'retirada', '{}'), (6, 'devolucao', '{}'), (None, 'estatisticas', '{}')]
+    pedacos, ultimo_id = eventos._novos(mensagens, 5)
+    assert ultimo_id == 6
+    assert [pedaco.split('\n')[0] for pedaco in pedacos] == ['id: 6', 'event: estatisticas']
+
+def test_assinante_lento_e_desligado(difusor, novo_equipamento):
+    def lento(mensagens):
+        raise queue.Full
+    id_equipamento = novo_equipamento()
+    difusor.assinar(lento)
+    _aguardar(lambda: difusor._ultimo is not None)
+    database.atualizar_equipamento(id_equipamento, 'Para o assinante lento', '', 3)
+    _aguardar(lambda: difusor.estatisticas()['descartados'])
+    assert difusor.estatisticas()['descartados'] == 1
+    assert difusor.estatisticas()['assinantes'] == 0
+
+def test_rota_exige_login_e_transmite(app, cliente_admin, difusor, novo_equipamento):
+    assert app.test_client().get('/eventos').status_code == 302
+    ultimo_id = database.ultimo_evento()
+    database.atualizar_equipamento(novo_equipamento(), 'Pela rota', '', 1)
+    resposta = cliente_admin.get('/eventos', headers={'Last-Event-ID': str(ultimo_id)}, buffered=False)
+    try:
+        assert resposta.mimetype == 'text/event-stream'
+        assert resposta.headers['Cache-Control'] == 'no-cache'
+        texto = ''
+        for pedaco in resposta.response:
+            texto += pedaco.decode('utf-8')
+            if 'Pela rota' in texto:
+                break
+        assert texto.startswith(f"retry: {eventos.RECONEXAO_MS}\n\n")
+    finally:
+        resposta.close()
+
+def test_fluxo_assincrono(difusor, novo_equipamento):
+    ultimo_id = database.ultimo_evento()
+    database.atualizar_equipamento(novo_equipamento(), 'Pelo event loop', '', 2)
+
+    async def ler():
+        fluxo = eventos.fluxo_assincrono(ultimo_id)
+        try:
+            return [await fluxo.__anext__() for _ in range(4)]
+        finally:
+            await fluxo.aclose()
+    retry, equipamento, estatisticas, ping = asyncio.run(ler())
+    assert retry.startswith('retry: ')
+    assert 'Pelo event loop' in equipamento
+    assert 'event: estatisticas' in estatisticas
+    assert ping == ": ping\n\n"
+    assert difusor.estatisticas()['assinantes'] == 0
+
+def test_limpar_eventos(banco, novo_equipamento):
+    database.atualizar_equipamento(novo_equipamento(), 'Evento antigo', '', 5)
+    antigo = database.ultimo_evento()
+    banco.execute("UPDATE eventos SET criado_em = 0 WHERE id_evento = ?", (antigo,))
+    assert database.limpar_eventos(1) >= 1
+    assert all(evento['id_evento'] != antigo for evento in database.listar_eventos(antigo - 1))
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+
+import db as database
+import exportacao
+
+def _retiradas(novo_equipamento, novo_usuario, novo_cliente, quantidade=3):
+    id_cliente = novo_cliente()
+    ids_equipamentos = [novo_equipamento() for _ in range(quantidade)]
+    database.registrar_retiradas_em_lote(ids_equipamentos, novo_usuario()[0], id_cliente, 'exportação')
+    return id_cliente, ids_equipamentos
+
+def test_csv_do_cliente_e_transmitido(cliente_admin, novo_equipamento, novo_usuario, novo_cliente):
+    id_cliente, ids_equipamentos = _retiradas(novo_equipamento, novo_usuario, novo_cliente)
+    resposta = cliente_admin.get(f'/exportar/movimentacoes.csv?id_cliente={id_cliente}')
+    assert resposta.status_code == 200
+    assert resposta.is_streamed
+    assert resposta.headers['Content-Disposition'] == 'attachment; filename=movimentacoes.csv'
+    cabecalho, *linhas = csv.reader(io.StringIO(resposta.get_data(as_text=True)))
+    assert cabecalho == database.COLUNAS_EXPORTACAO
+    linhas = [dict(zip(cabecalho, linha)) for linha in linhas]
+    assert sorted(int(linha['id_equipamento']) for linha in linhas) == sorted(ids_equipamentos)
+    assert {(linha['id_cliente'], linha['observacao'], linha['data_devolucao']) for linha in linhas} == {
+        (str(id_cliente), 'exportação', '')}
+
+def test_ndjson_filtrado_por_equipamento(cliente_admin, novo_equipamento, novo_usuario, novo_cliente):
+    _, ids_equipamentos = _retiradas(novo_equipamento, novo_usuario, novo_cliente)
+    resposta = cliente_admin.get(f'/exportar/movimentacoes.ndjson?id_equipamento={ids_equipamentos[1]}')
+    linha, = [json.loads(texto) for texto in resposta.get_data(as_text=True).splitlines()]
+    assert list(linha) == database.COLUNAS_EXPORTACAO
+    assert (linha['id_equipamento'], linha['quantidade_retirada']) == (ids_equipamentos[1], 1)
+
+def test_exportacao_le_em_lotes(novo_equipamento, novo_usuario, novo_cliente):
+    id_cliente, _ = _retiradas(novo_equipamento, novo_usuario, novo_cliente, quantidade=5)
+    lotes = list(database.iterar_movimentacoes(id_cliente=id_cliente, tamanho_lote=2))
+    assert [len(lote) for lote in lotes] == [2, 2, 1]
+    # Cada lote vira um trecho da resposta, não um único texto no fim.
+    assert len(list(exportacao.gerar_csv(lotes))) == 3
+
+def test_formato_desconhecido_e_login(app, cliente_admin):
+    assert cliente_admin.get('/exportar/movimentacoes.xml').status_code == 404
+    assert app.test_client().get('/exportar/movimentacoes.csv').status_code == 302
+
+def test_comando_de_exportacao(app, novo_equipamento, novo_usuario, novo_cliente):
+    id_cliente, ids_equipamentos = _retiradas(novo_equipamento, novo_usuario, novo_cliente)
+    resultado = app.test_cli_runner().invoke(args=['exportar-movimentacoes', '--formato', 'ndjson',
+                                                   '--cliente', str(id_cliente)])
+    assert resultado.exit_code == 0
+    linhas = [json.loads(texto) for texto in resultado.output.splitlines()]
+    assert sorted(linha['id_equipamento'] for linha in linhas) == sorted(ids_equipamentos)
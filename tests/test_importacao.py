@@ -0,0 +1,69 @@
+import io
+import sqlite3
+import uuid
+
+import pytest
+
+import db as database
+import importacao
+
+def _csv(cabecalho, linhas):
+    return io.BytesIO(('\n'.join([cabecalho] + linhas) + '\n').encode('utf-8'))
+
+def _equipamentos(prefixo):
+    return sorted((linha['nome_equipamento'], linha['quantidade_estoque'])
+                  for linha in database.listar_equipamentos(prefixo=prefixo, limite=database.TAMANHO_PAGINA_MAXIMO))
+
+@pytest.fixture
+def prefixo():
+    # O arquivo é reconhecido pelo hash; um prefixo novo por teste torna cada CSV único.
+    return f"Importado {uuid.uuid4().hex[:8]}"
+
+def test_importa_e_relata_as_linhas_com_erro(prefixo):
+    arquivo = _csv('nome_equipamento,descricao_equipamento,quantidade_estoque',
+                   [f'{prefixo} 1,a,3', ',sem nome,1', f'{prefixo} 2,b,x', f'{prefixo} 3,c,'])
+    relatorio = importacao.importar_csv(arquivo, 'equipamentos', tamanho_lote=2)
+    assert (relatorio['importadas'], relatorio['com_erro'], relatorio['ignoradas']) == (2, 2, 0)
+    assert [erro['linha'] for erro in relatorio['erros']] == [3, 4]
+    assert relatorio['linhas_por_segundo'] > 0
+    assert _equipamentos(prefixo) == [(f'{prefixo} 1', 3), (f'{prefixo} 3', 0)]
+
+def test_mesmo_arquivo_nao_e_importado_duas_vezes(prefixo):
+    conteudo = _csv('nome_cliente,contato', [f'{prefixo} A,a@x', f'{prefixo} B,b@x']).getvalue()
+    assert importacao.importar_csv(io.BytesIO(conteudo), 'clientes')['importadas'] == 2
+    relatorio = importacao.importar_csv(io.BytesIO(conteudo), 'clientes')
+    assert relatorio['ja_concluida'] and relatorio['importadas'] == 0
+    assert len(database.listar_clientes(prefixo=prefixo)) == 2
+
+def test_importacao_interrompida_e_retomada(prefixo, monkeypatch):
+    conteudo = _csv('nome_equipamento,descricao_equipamento,quantidade_estoque',
+                    [f'{prefixo} {numero},d,{numero}' for numero in range(1, 8)]).getvalue()
+    importar_lote = database.importar_lote
+    chamadas = []
+
+    def falhar_no_segundo_lote(*args):
+        chamadas.append(args)
+        if len(chamadas) == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+        return importar_lote(*args)
+    monkeypatch.setattr(database, 'importar_lote', falhar_no_segundo_lote)
+    relatorio = importacao.importar_csv(io.BytesIO(conteudo), 'equipamentos', tamanho_lote=3)
+    assert relatorio['importadas'] == 3
+    assert 'Execute novamente' in relatorio['erros'][0]['erro']
+    monkeypatch.setattr(database, 'importar_lote', importar_lote)
+
+    relatorio = importacao.importar_csv(io.BytesIO(conteudo), 'equipamentos', tamanho_lote=3)
+    assert (relatorio['ignoradas'], relatorio['importadas'], relatorio['ja_concluida']) == (3, 4, False)
+    assert _equipamentos(prefixo) == sorted((f'{prefixo} {numero}', numero) for numero in range(1, 8))
+    assert importacao.importar_csv(io.BytesIO(conteudo), 'equipamentos')['ja_concluida']
+
+def test_cabecalho_sem_a_coluna_obrigatoria(prefixo):
+    relatorio = importacao.importar_csv(_csv('nome,contato', [f'{prefixo},x']), 'clientes')
+    assert relatorio['erros'] == [{'linha': 1, 'erro': 'Cabeçalho sem a coluna nome_cliente'}]
+
+def test_upload_pela_rota(cliente_admin, prefixo):
+    resposta = cliente_admin.post('/importar', data={
+        'tipo': 'clientes', 'arquivo': (_csv('nome_cliente,contato', [f'{prefixo},c@x']), 'clientes.csv')})
+    assert resposta.status_code == 200
+    assert '1 registro(s) importado(s)' in resposta.get_data(as_text=True)
+    assert [cliente['nome_cliente'] for cliente in database.listar_clientes(prefixo=prefixo)] == [prefixo]
@@ -0,0 +1,111 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as modulo_app
+import limitador
+import senhas
+
+def _hash_antigo(banco, id_usuario, senha):
+    senha_hash = generate_password_hash(senha, method='pbkdf2:sha256')
+    banco.execute("UPDATE usuarios SET senha = ? WHERE id_usuario = ?", (senha_hash, id_usuario))
+    return senha_hash
+
+def _hash_atual(banco, id_usuario):
+    return banco.execute("SELECT senha FROM usuarios WHERE id_usuario = ?", (id_usuario,)).fetchone()[0]
+
+def test_login_atualiza_hash_antigo(app, novo_usuario, banco):
+    id_usuario, email, senha = novo_usuario()
+    antigo = _hash_antigo(banco, id_usuario, senha)
+    assert app.test_client().post('/login', data={'email': email, 'senha': senha}).status_code == 302
+    novo = _hash_atual(banco, id_usuario)
+    assert novo != antigo
+    assert not senhas.precisa_atualizar(novo)
+
+def test_fila_cheia_nao_impede_login_com_hash_antigo(app, novo_usuario, banco, monkeypatch):
+    id_usuario, email, senha = novo_usuario()
+    antigo = _hash_antigo(banco, id_usuario, senha)
+
+    def fila_cheia(*args):
+        raise senhas.FilaSenhasCheia("Fila de verificação de senhas cheia.")
+    monkeypatch.setattr(senhas, 'gerar_hash', fila_cheia)
+    resposta = app.test_client().post('/login', data={'email': email, 'senha': senha})
+    assert resposta.status_code == 302
+    assert _hash_atual(banco, id_usuario) == antigo
+
+def _entrar(cliente, email, senha):
+    return cliente.post('/login', data={'email': email, 'senha': senha})
+
+def test_conta_bloqueada_apos_falhas(app, novo_usuario):
+    _, email, senha = novo_usuario()
+    _, outro_email, outra_senha = novo_usuario()
+    cliente = app.test_client()
+    for _ in range(5):
+        assert _entrar(cliente, email.upper(), 'errada').status_code == 200
+    resposta = _entrar(cliente, email, senha)
+    assert resposta.status_code == 429
+    assert int(resposta.headers['Retry-After']) > 0
+    assert _entrar(cliente, outro_email, outra_senha).status_code == 302
+
+def test_login_certo_zera_as_falhas_da_conta(app, novo_usuario):
+    _, email, senha = novo_usuario()
+    cliente = app.test_client()
+    for _ in range(4):
+        _entrar(cliente, email, 'errada')
+    assert _entrar(cliente, email, senha).status_code == 302
+    for _ in range(4):
+        _entrar(cliente, email, 'errada')
+    assert _entrar(cliente, email, senha).status_code == 302
+
+def test_limite_por_ip(app, novo_usuario, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'limite_login_ip', limitador.LimitadorTentativas(2, 60))
+    _, email, senha = novo_usuario()
+    cliente = app.test_client()
+    _entrar(cliente, 'ninguem@teste', 'x')
+    assert _entrar(cliente, email, senha).status_code == 302
+    assert _entrar(cliente, email, senha).status_code == 429
+
+def test_janela_do_limitador_desliza(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(limitador.time, 'monotonic', lambda: agora[0])
+    limite = limitador.LimitadorTentativas(2, 60, max_chaves=2)
+    limite.registrar('a')
+    agora[0] += 30
+    limite.registrar('a')
+    assert limite.espera('a') == 30
+    agora[0] += 31
+    assert limite.espera('a') == 0
+    # Com chaves demais, as menos recentes são esquecidas.
+    limite.registrar('a')
+    limite.registrar('b')
+    limite.registrar('c')
+    assert list(limite._tentativas) == ['b', 'c']
+
+def test_fila_de_senhas_cheia_responde_503(app, novo_usuario, monkeypatch):
+    _, email, senha = novo_usuario()
+
+    def fila_cheia(*args):
+        raise senhas.FilaSenhasCheia("Fila de verificação de senhas cheia.")
+    monkeypatch.setattr(senhas, 'verificar_senha', fila_cheia)
+    resposta = _entrar(app.test_client(), email, senha)
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After'] == '5'
+
+def test_pool_de_senhas_gera_e_verifica():
+    senha_hash = senhas.gerar_hash('segredo')
+    assert senha_hash.startswith(senhas.obter_configuracao()['metodo'])
+    assert senhas.verificar_senha(senha_hash, 'segredo')
+    assert not senhas.verificar_senha(senha_hash, 'outro')
+    assert not senhas.precisa_atualizar(senha_hash)
+
+def test_sem_vaga_na_fila_levanta_erro(monkeypatch):
+    senhas.iniciar()
+    monkeypatch.setattr(senhas, '_configuracao', dict(senhas.obter_configuracao(), timeout=0.05))
+    ocupadas = 0
+    while senhas._vagas.acquire(blocking=False):
+        ocupadas += 1
+    try:
+        with pytest.raises(senhas.FilaSenhasCheia):
+            senhas.verificar_senha('scrypt:1:1:1$x$y', 'senha')
+    finally:
+        for _ in range(ocupadas):
+            senhas._vagas.release()
@@ -0,0 +1,63 @@
+import logging
+import sqlite3
+
+import app as modulo_app
+import metricas
+
+def test_metrics_exige_administrador(app, novo_usuario, entrar, cliente_admin):
+    resposta = app.test_client().get('/metrics')
+    assert resposta.status_code == 302
+    assert '/login' in resposta.headers['Location']
+    _, email, senha = novo_usuario('Técnico')
+    assert entrar(email, senha).get('/metrics').status_code == 302
+    resposta = cliente_admin.get('/metrics')
+    assert resposta.status_code == 200
+    assert resposta.content_type.startswith('text/plain')
+
+def test_metrics_aceita_token(app, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'token_metricas', 'segredo')
+    cliente = app.test_client()
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer segredo'}).status_code == 200
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer errado'}).status_code == 401
+
+def test_metrics_sem_token_configurado_recusa_bearer(app):
+    assert app.test_client().get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
+
+def test_n_mais_um_e_consulta_lenta_vao_para_o_log(app, caplog):
+    observador = metricas.ObservadorConsultas(limiar_lenta=0.5, limiar_n_mais_um=3)
+    conn = sqlite3.connect(':memory:')
+    sql = "SELECT 1 WHERE ? = ?"
+    with app.test_request_context('/equipamentos'), caplog.at_level(logging.WARNING, logger='metricas'):
+        observador.iniciar_requisicao()
+        for _ in range(3):
+            observador.consulta(conn, sql, (1, 1), 0.001)
+        observador.consulta(conn, sql, (1, 1), 0.6)
+        observador.encerrar_requisicao()
+    n_mais_um, lenta = caplog.records
+    assert 'N+1' in n_mais_um.getMessage() and 'repetida 3x' in n_mais_um.getMessage()
+    assert lenta.getMessage().startswith('Consulta lenta (600.0 ms): SELECT 1 WHERE ? = ?')
+    assert {n_mais_um.levelno, lenta.levelno} == {logging.WARNING}
+
+def test_histograma_acumula_as_faixas_no_formato_prometheus():
+    registro = metricas.Registro()
+    for valor in (0.5, 2, 7, 100):
+        registro.histograma('teste_segundos', 'Teste.', (1, 5, 10), valor, rota='a"b')
+    registro.contador('teste_total', 'Contador.', rota='x')
+    registro.contador('teste_total', 'Contador.', 2, rota='x')
+    texto = registro.exportar([('teste_medidor', 'Medidor.', [({'tipo': 'livres'}, 3)])])
+    assert '# TYPE teste_segundos histogram' in texto
+    assert 'teste_segundos_bucket{rota="a\\"b",le="1"} 1' in texto
+    assert 'teste_segundos_bucket{rota="a\\"b",le="5"} 2' in texto
+    assert 'teste_segundos_bucket{rota="a\\"b",le="10"} 3' in texto
+    assert 'teste_segundos_bucket{rota="a\\"b",le="+Inf"} 4' in texto
+    assert 'teste_segundos_sum{rota="a\\"b"} 109.5' in texto
+    assert 'teste_total{rota="x"} 3' in texto
+    assert '# TYPE teste_medidor gauge\nteste_medidor{tipo="livres"} 3' in texto
+
+def test_requisicao_conta_consultas_por_rota(cliente_admin):
+    cliente_admin.get('/equipamentos?nome=medicao')
+    texto = cliente_admin.get('/metrics').get_data(as_text=True)
+    assert 'controle_http_requisicao_segundos_count{rota="listar_equipamentos"}' in texto
+    assert 'controle_db_consultas_por_requisicao_count{rota="listar_equipamentos"}' in texto
+    assert 'controle_db_funcao_segundos_count{funcao="listar_equipamentos"}' in texto
+    assert 'controle_pool_conexoes{tipo="abertas"}' in texto
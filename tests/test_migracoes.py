@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+import db as database
+
+TABELAS_EXEMPLO = ('equipamentos', 'usuarios', 'clientes', 'movimentacoes')
+
+def _contagens(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return {tabela: conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0] for tabela in TABELAS_EXEMPLO}
+    finally:
+        conn.close()
+
+def _versao(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_versoes_sao_consecutivas():
+    assert [migracao['versao'] for migracao in database.MIGRACOES] == list(range(1, len(database.MIGRACOES) + 1))
+
+def test_banco_de_exemplo_migra_ate_a_ultima_versao(banco_novo, capsys):
+    assert _versao(banco_novo) == 0
+    antes = _contagens(banco_novo)
+    database.criar_tabelas()
+    assert _versao(banco_novo) == database.MIGRACOES[-1]['versao']
+    assert capsys.readouterr().out.count('Migração ') == len(database.MIGRACOES)
+    assert _contagens(banco_novo) == antes
+    conn = sqlite3.connect(banco_novo)
+    try:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    finally:
+        conn.close()
+
+def test_migrar_de_novo_nao_faz_nada(banco_novo, capsys):
+    database.criar_tabelas()
+    capsys.readouterr()
+    database.criar_tabelas()
+    assert 'Migração' not in capsys.readouterr().out
+
+def test_dados_derivados_conferem_apos_migrar(banco_novo):
+    # Contadores, razão de estoque e planos de consulta partem do histórico que já estava no banco.
+    database.criar_tabelas()
+    assert database.reconciliar_estatisticas(corrigir=False) == {}
+    assert database.criar_snapshot_estoque(corrigir=False)['divergencias'] == {}
+    database.verificar_todos_os_planos()
+
+def test_migracao_com_erro_nao_deixa_nada_pela_metade(banco_novo, monkeypatch):
+    migracao_quebrada = {'versao': len(database.MIGRACOES) + 1, 'descricao': 'Quebrada',
+                         'comandos': ["CREATE TABLE sobra (id INTEGER)", "SELECT * FROM tabela_inexistente"],
+                         'consultas_verificadas': []}
+    monkeypatch.setattr(database, 'MIGRACOES', database.MIGRACOES + [migracao_quebrada])
+    with pytest.raises(sqlite3.Error):
+        database.criar_tabelas()
+    conn = sqlite3.connect(banco_novo)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_schema WHERE name = 'sobra'").fetchone()[0] == 0
+    finally:
+        conn.close()
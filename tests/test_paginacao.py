@@ -0,0 +1,56 @@
+import db as database
+
+def _paginas(listar, coluna_ordem, coluna_id, limite, **filtros):
+    # Percorre a listagem inteira seguindo o cursor, como os links "próxima página".
+    itens, apos = [], None
+    while True:
+        pagina = listar(apos=apos, limite=limite, **filtros)
+        assert len(pagina) <= limite
+        itens.extend(pagina)
+        cursor = database.proximo_cursor(pagina, limite, coluna_ordem, coluna_id)
+        if cursor is None:
+            return itens
+        apos = database.decodificar_cursor(cursor)
+
+def test_paginas_de_equipamentos_sem_repeticao_nem_buraco(novo_equipamento):
+    # Nomes iguais sem diferença de maiúsculas: o desempate é o id.
+    nomes = ['Keyset b', 'keyset A', 'Keyset a', 'KEYSET A', 'Keyset c', 'keyset B', 'Keyset d']
+    ids = {novo_equipamento(nome=nome): nome for nome in nomes}
+    itens = _paginas(database.listar_equipamentos, 'nome_equipamento', 'id_equipamento', 2, prefixo='keyset')
+    assert [item['id_equipamento'] for item in itens] == sorted(ids, key=lambda id_: (ids[id_].lower(), id_))
+
+def test_cadastro_entre_paginas_nao_repete_itens(novo_equipamento):
+    for nome in ('Intervalo b', 'Intervalo c', 'Intervalo d'):
+        novo_equipamento(nome=nome)
+    primeira = database.listar_equipamentos(prefixo='Intervalo', limite=2)
+    apos = database.decodificar_cursor(
+        database.proximo_cursor(primeira, 2, 'nome_equipamento', 'id_equipamento'))
+    novo_equipamento(nome='Intervalo a')
+    segunda = database.listar_equipamentos(prefixo='Intervalo', apos=apos, limite=2)
+    assert [item['nome_equipamento'] for item in primeira + segunda] == ['Intervalo b', 'Intervalo c',
+                                                                           'Intervalo d']
+
+def test_paginas_de_movimentacoes_com_o_mesmo_horario(novo_equipamento, novo_usuario, novo_cliente):
+    # Um lote grava todas as retiradas com o mesmo data_retirada.
+    ids_equipamentos = [novo_equipamento() for _ in range(5)]
+    database.registrar_retiradas_em_lote(ids_equipamentos, novo_usuario()[0], novo_cliente(), None)
+    todas = database.listar_movimentacoes_abertas()
+    itens = _paginas(database.listar_movimentacoes_abertas, 'data_retirada', 'id_movimentacao', 3)
+    assert [item['id_movimentacao'] for item in itens] == [item['id_movimentacao'] for item in todas]
+    assert len({item['id_movimentacao'] for item in itens}) == len(itens)
+
+def test_filtro_de_data_das_movimentacoes(novo_equipamento, novo_usuario, novo_cliente):
+    database.registrar_retiradas_em_lote([novo_equipamento()], novo_usuario()[0], novo_cliente(), None)
+    hoje = database.obter_hora_atual().date().isoformat()
+    assert database.listar_movimentacoes_abertas(data_inicio=hoje, data_fim=hoje)
+    assert database.listar_movimentacoes_abertas(data_inicio='1900-01-01', data_fim='1900-01-02') == []
+
+def test_cursor_invalido_volta_para_a_primeira_pagina(cliente_admin):
+    for cursor in ('lixo', database.codificar_cursor(['só um valor']), '%%%'):
+        assert database.decodificar_cursor(cursor) is None
+    assert cliente_admin.get('/equipamentos?cursor=lixo').status_code == 200
+
+def test_tamanho_de_pagina_tem_teto():
+    assert database.limitar_pagina(10 ** 6) == database.TAMANHO_PAGINA_MAXIMO
+    assert database.limitar_pagina(0) == 1
+    assert database.limitar_pagina(None) is None
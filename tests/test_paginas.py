@@ -0,0 +1,43 @@
+import gzip
+
+def test_pagina_com_mensagem_nao_e_guardada(cliente_admin):
+    resposta = cliente_admin.get('/')
+    assert 'Bem-vindo' in resposta.get_data(as_text=True)
+    assert 'ETag' not in resposta.headers
+    assert 'ETag' in cliente_admin.get('/').headers
+
+def test_etag_estavel_e_304(cliente_admin):
+    cliente_admin.get('/')
+    etag = cliente_admin.get('/equipamentos').headers['ETag']
+    assert cliente_admin.get('/equipamentos').headers['ETag'] == etag
+    resposta = cliente_admin.get('/equipamentos', headers={'If-None-Match': etag})
+    assert resposta.status_code == 304
+    assert resposta.get_data() == b''
+
+def test_escrita_muda_etag_e_conteudo(cliente_admin, novo_equipamento):
+    cliente_admin.get('/')
+    etag = cliente_admin.get('/equipamentos').headers['ETag']
+    id_equipamento = novo_equipamento(1, nome='Aaa equipamento recém-cadastrado')
+    resposta = cliente_admin.get('/equipamentos', headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    assert 'Aaa equipamento recém-cadastrado' in resposta.get_data(as_text=True)
+    assert f'/equipamentos/editar/{id_equipamento}' in resposta.get_data(as_text=True)
+
+def test_etag_depende_do_usuario(cliente_admin, novo_usuario, entrar):
+    _, email, senha = novo_usuario('Técnico')
+    tecnico = entrar(email, senha)
+    for cliente in (cliente_admin, tecnico):
+        cliente.get('/')
+    assert cliente_admin.get('/equipamentos').headers['ETag'] != tecnico.get('/equipamentos').headers['ETag']
+
+def test_resposta_comprimida_tem_etag_proprio(cliente_admin):
+    cliente_admin.get('/')
+    simples = cliente_admin.get('/equipamentos')
+    comprimida = cliente_admin.get('/equipamentos', headers={'Accept-Encoding': 'gzip'})
+    assert comprimida.headers['Content-Encoding'] == 'gzip'
+    assert comprimida.headers['ETag'] == simples.headers['ETag'][:-1] + '-gz"'
+    assert gzip.decompress(comprimida.get_data()) == simples.get_data()
+    resposta = cliente_admin.get('/equipamentos', headers={'Accept-Encoding': 'gzip',
+                                                           'If-None-Match': comprimida.headers['ETag']})
+    assert resposta.status_code == 304
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db as database
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = database.PoolConexoes(str(tmp_path / 'pool.db'), tamanho=2, timeout=0.2)
+    yield pool
+    pool.fechar_todas()
+
+def test_close_devolve_a_conexao_ao_pool(pool):
+    conn = pool.obter()
+    conn.close()
+    assert pool.obter() is conn
+    estatisticas = pool.estatisticas()
+    assert (estatisticas['misses'], estatisticas['hits'], estatisticas['abertas']) == (1, 1, 1)
+
+def test_pool_esgotado_levanta_erro(pool):
+    conexoes = [pool.obter(), pool.obter()]
+    with pytest.raises(sqlite3.OperationalError):
+        pool.obter()
+    for conn in conexoes:
+        conn.close()
+    assert pool.estatisticas()['livres'] == 2
+
+def test_espera_por_conexao_devolvida(pool):
+    conexoes = [pool.obter(), pool.obter()]
+    threading.Timer(0.05, conexoes[0].close).start()
+    assert pool.obter() is conexoes[0]
+    assert pool.estatisticas()['waits'] == 1
+
+def test_devolver_desfaz_transacao_aberta(pool):
+    conn = pool.obter()
+    conn.execute("CREATE TABLE itens (valor INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO itens VALUES (1)")
+    conn.close()
+    conn = pool.obter()
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM itens").fetchone()[0] == 0
+
+def test_conexao_quebrada_e_descartada(pool):
+    conn = pool.obter()
+    conn.close()
+    conn.fechar()
+    nova = pool.obter()
+    assert nova is not conn
+    assert pool.estatisticas()['descartadas'] == 1
+
+def test_escopo_reaproveita_a_mesma_conexao(pool):
+    pool.iniciar_escopo()
+    conn = pool.obter()
+    conn.close()
+    assert pool.obter() is conn
+    assert pool.estatisticas()['livres'] == 0
+    pool.encerrar_escopo()
+    assert pool.estatisticas()['livres'] == 1
+
+def test_escopo_e_por_thread(pool):
+    pool.iniciar_escopo()
+    conn = pool.obter()
+    outra = []
+    thread = threading.Thread(target=lambda: outra.append(pool.obter()))
+    thread.start()
+    thread.join()
+    assert outra[0] is not conn
+    outra[0].close()
+    pool.encerrar_escopo()
+
+def test_requisicao_abre_e_encerra_o_escopo(cliente_admin):
+    # O test client atende na própria thread: o escopo da requisição tem que estar fechado ao fim.
+    pool = database.obter_pool()
+    assert cliente_admin.get('/equipamentos').status_code == 200
+    assert not getattr(pool._escopo, 'ativo', False)
+    assert getattr(pool._escopo, 'conexao', None) is None
+    estatisticas = pool.estatisticas()
+    assert estatisticas['abertas'] <= estatisticas['tamanho']
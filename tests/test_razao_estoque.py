@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+import db as database
+
+def _estoque(id_equipamento):
+    return database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque']
+
+@pytest.fixture
+def pessoas(novo_usuario, novo_cliente):
+    return novo_usuario()[0], novo_cliente()
+
+def test_cada_variacao_vira_um_lancamento(novo_equipamento, pessoas, banco):
+    id_usuario, id_cliente = pessoas
+    inicio = database.obter_hora_atual()
+    id_equipamento = novo_equipamento(5)
+    database.registrar_retiradas_em_lote([id_equipamento] * 2, id_usuario, id_cliente, None)
+    id_movimentacao = banco.execute("SELECT MIN(id_movimentacao) FROM movimentacoes WHERE id_equipamento = ?",
+                                    (id_equipamento,)).fetchone()[0]
+    database.registrar_devolucoes_em_lote([id_movimentacao])
+    database.atualizar_equipamento(id_equipamento, 'Ajustado', '', 10)
+
+    saldo_inicial, pontos = database.serie_estoque(id_equipamento, inicio)
+    assert saldo_inicial == 0
+    assert [(ponto['origem'], ponto['variacao']) for ponto in pontos] == [
+        ('cadastro', 5), ('retirada', -1), ('retirada', -1), ('devolucao', 1), ('ajuste', 6)]
+    assert pontos[-1]['quantidade'] == _estoque(id_equipamento) == 10
+    assert database.obter_estoque_equipamento_em(id_equipamento) == 10
+
+def test_saldo_em_um_instante_passado(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(4)
+    momento = database.obter_hora_atual()
+    database.registrar_retiradas_em_lote([id_equipamento] * 3, id_usuario, id_cliente, None)
+    assert database.obter_estoque_equipamento_em(id_equipamento, momento) == 4
+    assert database.obter_estoque_equipamento_em(id_equipamento) == 1
+
+def test_snapshot_corrige_divergencia_e_preserva_o_historico(novo_equipamento, pessoas, banco):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(6)
+    momento = database.obter_hora_atual()
+    database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None)
+    assert id_equipamento not in database.criar_snapshot_estoque(corrigir=False)['divergencias']
+
+    # Alteração feita por fora da aplicação: o razão não a conhece.
+    banco.execute("UPDATE equipamentos SET quantidade_estoque = 9 WHERE id_equipamento = ?", (id_equipamento,))
+    divergencias = database.criar_snapshot_estoque()['divergencias']
+    assert divergencias[id_equipamento] == {'razao': 5, 'estoque': 9}
+    assert id_equipamento not in database.criar_snapshot_estoque(corrigir=False)['divergencias']
+
+    database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None)
+    database.podar_snapshots_estoque(1)
+    assert database.obter_estoque_equipamento_em(id_equipamento) == _estoque(id_equipamento) == 8
+    assert database.obter_estoque_equipamento_em(id_equipamento, momento) == 6
+
+def test_lancamentos_nao_podem_ser_alterados(novo_equipamento, banco):
+    id_equipamento = novo_equipamento(1)
+    with pytest.raises(sqlite3.IntegrityError):
+        banco.execute("UPDATE estoque_lancamentos SET variacao = 100 WHERE id_equipamento = ?", (id_equipamento,))
+    with pytest.raises(sqlite3.IntegrityError):
+        banco.execute("DELETE FROM estoque_lancamentos WHERE id_equipamento = ?", (id_equipamento,))
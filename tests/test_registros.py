@@ -0,0 +1,51 @@
+import sqlite3
+from datetime import datetime
+
+import db as database
+
+def test_registro_por_nome_indice_e_atributo():
+    registro = database.classe_registro(('id', 'nome', 'count', 'COUNT(*)'))((7, 'Notebook', 3, 9))
+    assert (registro.id, registro['nome'], registro[0], registro['COUNT(*)']) == (7, 'Notebook', 7, 9)
+    # Nomes que já são métodos de tuple continuam acessíveis pela chave, sem esconder o método.
+    assert registro['count'] == 3 and registro.count(7) == 1
+    assert registro.get('nome') == 'Notebook' and registro.get('inexistente', '-') == '-'
+    assert dict(registro) == {'id': 7, 'nome': 'Notebook', 'count': 3, 'COUNT(*)': 9}
+    assert repr(registro) == "Registro(id=7, nome='Notebook', count=3, COUNT(*)=9)"
+    assert registro == (7, 'Notebook', 3, 9)
+
+def test_registro_nao_tem_dict_por_linha():
+    classe = database.classe_registro(('a', 'b'))
+    assert database.classe_registro(('a', 'b')) is classe
+    assert database.classe_registro(('b', 'a')) is not classe
+    assert not hasattr(classe((1, 2)), '__dict__')
+
+def test_conexoes_do_pool_devolvem_registros(novo_equipamento):
+    id_equipamento = novo_equipamento(2, nome='Registro de teste')
+    conn = database.conectar()
+    try:
+        sql = "SELECT id_equipamento, nome_equipamento, data_cadastro FROM equipamentos WHERE id_equipamento = ?"
+        linha = conn.execute(sql, (id_equipamento,)).fetchone()
+        assert isinstance(linha, database.Registro)
+        assert linha.nome_equipamento == 'Registro de teste'
+        assert isinstance(linha.data_cadastro, datetime)
+        for linhas in (conn.execute(sql, (id_equipamento,)).fetchall(),
+                       conn.execute(sql, (id_equipamento,)).fetchmany(5),
+                       list(conn.execute(sql, (id_equipamento,)))):
+            assert linhas == [linha] and type(linhas[0]) is type(linha)
+        # Um row_factory explícito tem precedência sobre os registros.
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        assert isinstance(cursor.execute(sql, (id_equipamento,)).fetchone(), sqlite3.Row)
+    finally:
+        conn.close()
+
+def test_listagens_devolvem_datas_convertidas(novo_equipamento, novo_usuario, novo_cliente):
+    id_equipamento = novo_equipamento()
+    database.registrar_retiradas_em_lote([id_equipamento], novo_usuario()[0], novo_cliente(), None)
+    movimentacao = database.listar_ultimas_movimentacoes()[0]
+    assert isinstance(movimentacao['data_retirada'], datetime)
+    assert movimentacao.data_retirada == movimentacao['data_retirada']
+
+def test_data_invalida_fica_como_texto():
+    assert database.converter_data_hora(b'2024-02-30 10:00:00') == '2024-02-30 10:00:00'
+    assert database.converter_data_hora(b'2024-02-03 10:00:00.5') == datetime(2024, 2, 3, 10, 0, 0, 500000)
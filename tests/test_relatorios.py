@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+import pytest
+
+import db as database
+import relatorios
+
+def _estoque_baixo(novo_equipamento):
+    id_equipamento = novo_equipamento(0)
+    equipamento = database.obter_equipamento_por_id(id_equipamento)
+    database.atualizar_equipamento(id_equipamento, equipamento['nome_equipamento'],
+                                   equipamento['descricao_equipamento'], 0, 5)
+    return id_equipamento
+
+def test_limite_do_painel_fica_entre_1_e_o_maximo(cliente_admin, novo_equipamento):
+    for _ in range(3):
+        _estoque_baixo(novo_equipamento)
+    for limite in (0, -1):
+        itens = cliente_admin.get(f'/api/relatorios/estoque_baixo?limite={limite}').get_json()['estoque_baixo']
+        assert len(itens) == 1
+    itens = cliente_admin.get('/api/relatorios/estoque_baixo?limite=100000').get_json()['estoque_baixo']
+    assert 3 <= len(itens) <= database.TAMANHO_PAGINA_MAXIMO
+
+def test_leitura_do_painel_nao_consolida(cliente_admin, novo_equipamento):
+    novo_equipamento()
+    antes = database.obter_progresso_relatorios()
+    assert antes['pendentes']
+    for caminho in ('/relatorios', '/api/relatorios'):
+        assert cliente_admin.get(caminho).status_code == 200
+    progresso = cliente_admin.get('/api/relatorios/progresso').get_json()['progresso']
+    assert progresso == antes
+
+def _abertas(banco, id_equipamento):
+    return [linha[0] for linha in banco.execute(
+        "SELECT id_movimentacao FROM movimentacoes WHERE id_equipamento = ? AND data_devolucao IS NULL "
+        "ORDER BY id_movimentacao", (id_equipamento,))]
+
+def _por_id(linhas, chave):
+    return {linha[chave]: (linha['retiradas'], linha['quantidade_retirada'], linha['devolucoes']) for linha in linhas}
+
+def test_consolidacao_bate_com_as_contas_a_mao(novo_equipamento, novo_usuario, novo_cliente, banco):
+    relatorios.atualizar()
+    hoje = database.obter_hora_atual().date().isoformat()
+    diario_antes = {linha['dia']: dict(linha) for linha in database.relatorio_diario(hoje, hoje)}.get(hoje)
+    id_usuario = novo_usuario()[0]
+    cliente_a, cliente_b = novo_cliente(), novo_cliente()
+    furadeira, serra = novo_equipamento(10), novo_equipamento(10)
+    database.registrar_retiradas_em_lote([furadeira, serra], id_usuario, cliente_a, None, 3)
+    database.registrar_retiradas_em_lote([furadeira], id_usuario, cliente_b, None, 2)
+    database.registrar_retiradas_em_lote([serra], id_usuario, cliente_b, None, 20)  # sem estoque: não conta
+    database.registrar_devolucoes_em_lote(_abertas(banco, furadeira)[:1], id_usuario)
+    # Em lotes de um lançamento, para cobrir a soma de lotes sucessivos.
+    while database.atualizar_relatorios(relatorios.faixas_duracao, tamanho_lote=1):
+        pass
+    assert database.obter_progresso_relatorios()['pendentes'] == 0
+
+    equipamentos = _por_id(database.ranking_equipamentos(hoje, hoje, 200), 'id_equipamento')
+    assert (equipamentos[furadeira], equipamentos[serra]) == ((2, 5, 1), (1, 3, 0))
+    clientes = _por_id(database.ranking_clientes(hoje, hoje, 200), 'id_cliente')
+    assert (clientes[cliente_a], clientes[cliente_b]) == ((2, 6, 1), (1, 2, 0))
+    diario = dict(database.relatorio_diario(hoje, hoje)[-1])
+    antes = diario_antes or {'retiradas': 0, 'quantidade_retirada': 0, 'devolucoes': 0, 'quantidade_devolvida': 0}
+    assert {chave: diario[chave] - antes[chave] for chave in antes if chave != 'dia'} == {
+        'retiradas': 3, 'quantidade_retirada': 8, 'devolucoes': 1, 'quantidade_devolvida': 3}
+    # Rodar de novo sem lançamentos novos não soma nada.
+    assert relatorios.atualizar() == 0
+    assert _por_id(database.ranking_equipamentos(hoje, hoje, 200), 'id_equipamento')[furadeira] == (2, 5, 1)
+
+def test_percentis_das_duracoes():
+    # Durações de 1, 2, 4 e 8 s caem nas faixas 0, 4, 8 e 12 (4 por oitava).
+    linhas = [(7, 'Equipamento', faixa, 1, segundos) for faixa, segundos in zip((0, 4, 8, 12), (1, 2, 4, 8))]
+    assert relatorios.faixas_duracao([1, 2, 4, 8, 0.2]) == [0, 4, 8, 12, 0]
+    geral, (equipamento,) = relatorios.estatisticas_duracoes(linhas)
+    centro = relatorios._centro_faixa
+    assert geral['devolucoes'] == 4
+    assert geral['media_segundos'] == pytest.approx(15 / 4)
+    # p50 é a 2ª de 4 devoluções; p90 e p99, a 4ª.
+    assert (geral['p50_segundos'], geral['p90_segundos'], geral['p99_segundos']) == (centro(4), centro(12),
+                                                                                     centro(12))
+    assert equipamento == dict(geral, id_equipamento=7, nome_equipamento='Equipamento')
+
+def test_atrasados_contam_so_as_abertas_alem_do_prazo(novo_equipamento, novo_usuario, novo_cliente, banco):
+    antes = relatorios.atrasados(limite=200)
+    id_equipamento = novo_equipamento(5)
+    database.registrar_retiradas_em_lote([id_equipamento, id_equipamento], novo_usuario()[0], novo_cliente(),
+                                         None, 2)
+    atrasada, recente = _abertas(banco, id_equipamento)
+    prazo = database.obter_configuracao()['prazo_devolucao_dias']
+    antiga = database.obter_hora_atual() - timedelta(days=prazo + 2)
+    banco.execute("UPDATE movimentacoes SET data_retirada = ? WHERE id_movimentacao = ?",
+                  (antiga.isoformat(' '), atrasada))
+    depois = relatorios.atrasados(limite=200)
+    assert (depois['movimentacoes'] - antes['movimentacoes'], depois['quantidade'] - antes['quantidade']) == (1, 2)
+    ids = [item['id_movimentacao'] for item in depois['itens']]
+    assert atrasada in ids and recente not in ids
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+import db as database
+
+def _estoque(id_equipamento):
+    return database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque']
+
+def _abertas(id_equipamento):
+    conn = database.conectar()
+    try:
+        return conn.execute('''
+            SELECT COUNT(*) FROM movimentacoes WHERE id_equipamento = ? AND data_devolucao IS NULL
+        ''', (id_equipamento,)).fetchone()[0]
+    finally:
+        conn.close()
+
+@pytest.fixture
+def pessoas(novo_usuario, novo_cliente):
+    return novo_usuario()[0], novo_cliente()
+
+def test_lote_registra_cada_item_e_baixa_o_estoque(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    primeiro, segundo = novo_equipamento(3), novo_equipamento(1)
+    resultados = database.registrar_retiradas_em_lote([primeiro, segundo, primeiro], id_usuario, id_cliente, 'lote')
+    assert [resultado['registrado'] for resultado in resultados] == [True, True, True]
+    assert (_estoque(primeiro), _estoque(segundo)) == (1, 0)
+    assert (_abertas(primeiro), _abertas(segundo)) == (2, 1)
+
+def test_lote_recusa_itens_sem_estoque_ou_inexistentes(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(1)
+    resultados = database.registrar_retiradas_em_lote([id_equipamento, id_equipamento, 99999999, 'x'],
+                                                      id_usuario, id_cliente, None)
+    assert [resultado['motivo'] for resultado in resultados] == [None, 'sem_estoque', 'nao_encontrado', 'nao_encontrado']
+    assert _estoque(id_equipamento) == 0
+
+def test_equipamento_inativo_nao_sai(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(5)
+    database.desativar_equipamento(id_equipamento)
+    resultado = database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None)[0]
+    assert resultado['motivo'] == 'nao_encontrado'
+
+def test_retiradas_concorrentes_nunca_deixam_estoque_negativo(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(5)
+    resultados = []
+
+    def retirar():
+        resultados.extend(database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None))
+    threads = [threading.Thread(target=retirar) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for resultado in resultados if resultado['registrado']) == 5
+    assert _estoque(id_equipamento) == 0
+    assert _abertas(id_equipamento) == 5
+
+def test_retirada_de_varias_unidades_respeita_o_estoque(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(2)
+    resultado, = database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None, 3)
+    assert (resultado['registrado'], resultado['motivo']) == (False, 'sem_estoque')
+    assert _estoque(id_equipamento) == 2
+    resultado, = database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None, 2)
+    assert resultado['registrado']
+    assert _estoque(id_equipamento) == 0
+
+def test_chave_repetida_devolve_o_resultado_original(novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(5)
+    primeira = database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None, chave='r-1')
+    segunda = database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None, chave='r-1')
+    assert primeira == segunda
+    assert _estoque(id_equipamento) == 4
+    with pytest.raises(database.ErroChaveIdempotencia):
+        database.registrar_retiradas_em_lote([id_equipamento, id_equipamento], id_usuario, id_cliente, None,
+                                             chave='r-1')
+    assert _estoque(id_equipamento) == 4
+
+def test_formulario_de_retirada(cliente_admin, novo_equipamento, pessoas):
+    id_usuario, id_cliente = pessoas
+    primeiro, segundo = novo_equipamento(1), novo_equipamento(0)
+    resposta = cliente_admin.post('/movimentacoes/retirada', data={
+        'id_equipamentos': [primeiro, segundo], 'id_usuario': id_usuario, 'id_cliente': id_cliente,
+        'observacao': ''}, follow_redirects=True)
+    texto = resposta.get_data(as_text=True)
+    assert '1 equipamento(s) registrado(s) com sucesso!' in texto
+    assert 'por falta de estoque' in texto
+    assert (_estoque(primeiro), _estoque(segundo)) == (0, 0)
+
+@pytest.mark.parametrize('quantidade', [0, -1, 1.5, '2'])
+def test_quantidade_invalida_e_recusada(novo_equipamento, pessoas, quantidade):
+    id_usuario, id_cliente = pessoas
+    id_equipamento = novo_equipamento(2)
+    with pytest.raises(ValueError):
+        database.registrar_retiradas_em_lote([id_equipamento], id_usuario, id_cliente, None, quantidade)
+    assert _estoque(id_equipamento) == 2
+    assert _abertas(id_equipamento) == 0
@@ -0,0 +1,53 @@
+import db as database
+import sessoes
+
+def _sessoes_do_usuario(banco, id_usuario):
+    return banco.execute("SELECT nome_usuario, nivel_acesso FROM sessoes WHERE id_usuario = ?",
+                         (id_usuario,)).fetchall()
+
+def _token(app, cliente):
+    return cliente.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+
+def test_sessao_fica_no_banco_so_com_o_hash_do_token(app, novo_usuario, entrar, banco):
+    id_usuario, email, senha = novo_usuario()
+    cliente = entrar(email, senha)
+    token = _token(app, cliente)
+    assert sessoes.usuario_da_sessao(token) == id_usuario
+    assert banco.execute("SELECT COUNT(*) FROM sessoes WHERE id_sessao = ?", (token,)).fetchone()[0] == 0
+    assert len(_sessoes_do_usuario(banco, id_usuario)) == 1
+
+def test_login_troca_o_token(app, novo_usuario, entrar):
+    _, email, senha = novo_usuario()
+    id_outro, email_outro, senha_outro = novo_usuario()
+    cliente = entrar(email, senha)
+    anterior = _token(app, cliente)
+    cliente.post('/login', data={'email': email_outro, 'senha': senha_outro})
+    assert sessoes.usuario_da_sessao(_token(app, cliente)) == id_outro
+    assert sessoes.usuario_da_sessao(anterior) is None
+
+def test_alterar_usuario_atualiza_as_sessoes_abertas(novo_usuario, entrar, banco):
+    id_usuario, email, senha = novo_usuario('Administrador')
+    cliente = entrar(email, senha)
+    assert cliente.get('/status/banco').status_code == 200
+    database.atualizar_usuario(id_usuario, 'Nome Novo', email, '', 'Testes', 'Técnico')
+    assert _sessoes_do_usuario(banco, id_usuario) == [('Nome Novo', 'Técnico')]
+    resposta = cliente.get('/status/banco')
+    assert resposta.status_code == 302
+    assert 'Nome Novo' in cliente.get('/').get_data(as_text=True)
+
+def test_excluir_usuario_encerra_as_sessoes(app, novo_usuario, entrar, banco):
+    id_usuario, email, senha = novo_usuario()
+    cliente = entrar(email, senha)
+    token = _token(app, cliente)
+    assert database.excluir_usuario(id_usuario)
+    assert _sessoes_do_usuario(banco, id_usuario) == []
+    assert sessoes.usuario_da_sessao(token) is None
+    resposta = cliente.get('/')
+    assert resposta.status_code == 302
+    assert '/login' in resposta.headers['Location']
+
+def test_logout_apaga_a_sessao(novo_usuario, entrar, banco):
+    id_usuario, email, senha = novo_usuario()
+    cliente = entrar(email, senha)
+    cliente.get('/logout')
+    assert _sessoes_do_usuario(banco, id_usuario) == []
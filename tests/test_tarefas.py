@@ -0,0 +1,95 @@
+import json
+import logging
+
+import db as database
+import tarefas
+
+# Prioridade acima da usada pelas views, para que a tarefa do teste seja a próxima da fila.
+PRIORIDADE = 1000
+
+def _enfileirar(maximo_tentativas=3, prioridade=PRIORIDADE, tipo='backup'):
+    return database.enfileirar_tarefa(tipo, {}, prioridade, maximo_tentativas=maximo_tentativas)
+
+def test_prioridade_maior_sai_primeiro():
+    baixa = _enfileirar(prioridade=PRIORIDADE)
+    alta = _enfileirar(prioridade=PRIORIDADE + 1)
+    assert database.reservar_tarefa('t1', 60)['id_tarefa'] == alta
+    assert database.reservar_tarefa('t1', 60)['id_tarefa'] == baixa
+    assert database.concluir_tarefa(alta, 't1', None)
+    assert database.concluir_tarefa(baixa, 't1', None)
+
+def test_reserva_vencida_volta_para_a_fila():
+    id_tarefa = _enfileirar()
+    tarefa = database.reservar_tarefa('parado', -1)
+    assert (tarefa['id_tarefa'], tarefa['tentativas']) == (id_tarefa, 1)
+    tarefa = database.reservar_tarefa('vivo', 60)
+    assert (tarefa['id_tarefa'], tarefa['tentativas'], tarefa['trabalhador']) == (id_tarefa, 2, 'vivo')
+    # O trabalhador antigo perdeu a tarefa: nem progresso nem conclusão dele valem mais.
+    assert not database.atualizar_progresso_tarefa(id_tarefa, 'parado', 0.5, None, 60)
+    assert not database.concluir_tarefa(id_tarefa, 'parado', {'de': 'parado'})
+    assert database.concluir_tarefa(id_tarefa, 'vivo', {'de': 'vivo'})
+    tarefa = database.obter_tarefa(id_tarefa)
+    assert (tarefa['estado'], json.loads(tarefa['resultado'])) == ('concluida', {'de': 'vivo'})
+
+def test_reserva_vencida_na_ultima_tentativa_falha():
+    id_tarefa = _enfileirar(maximo_tentativas=1)
+    database.reservar_tarefa('parado', -1)
+    database.reservar_tarefa('outro', 60)
+    tarefa = database.obter_tarefa(id_tarefa)
+    assert tarefa['estado'] == 'falhou'
+    assert 'Reserva vencida' in tarefa['erro']
+
+def test_falha_tenta_de_novo_ate_o_maximo():
+    id_tarefa = _enfileirar(maximo_tentativas=2)
+    database.reservar_tarefa('t1', 60)
+    assert database.falhar_tarefa(id_tarefa, 't1', 'primeira', 0)['estado'] == 'pendente'
+    tarefa = database.reservar_tarefa('t1', 60)
+    assert (tarefa['id_tarefa'], tarefa['tentativas']) == (id_tarefa, 2)
+    assert database.falhar_tarefa(id_tarefa, 't1', 'segunda', 0)['estado'] == 'falhou'
+    assert database.obter_tarefa(id_tarefa)['erro'] == 'segunda'
+
+def test_nova_tentativa_espera_o_atraso():
+    id_tarefa = _enfileirar()
+    database.reservar_tarefa('t1', 60)
+    assert database.falhar_tarefa(id_tarefa, 't1', 'ocupado', 3600)['estado'] == 'pendente'
+    assert database.reservar_tarefa('t1', 60) is None
+    assert database.obter_tarefa(id_tarefa)['disponivel_em'] > database.obter_tarefa(id_tarefa)['atualizada_em']
+
+def test_falha_sem_espera_nao_tenta_de_novo():
+    id_tarefa = _enfileirar()
+    database.reservar_tarefa('t1', 60)
+    assert database.falhar_tarefa(id_tarefa, 't1', 'argumentos inválidos', None)['estado'] == 'falhou'
+
+def test_espera_cresce_e_tem_teto():
+    config = database.obter_configuracao()
+    base, maxima = config['tarefas_espera_base'], config['tarefas_espera_maxima']
+    for tentativas in range(1, 12):
+        esperada = min(base * 2 ** (tentativas - 1), maxima)
+        assert esperada / 2 <= tarefas.espera_apos_falha(tentativas) <= esperada
+
+def test_trabalhador_executa_retiradas(novo_equipamento, novo_usuario, novo_cliente):
+    id_equipamento = novo_equipamento(2)
+    id_tarefa = tarefas.enfileirar('retiradas', {'ids_equipamentos': [id_equipamento] * 3,
+                                                 'id_usuario': novo_usuario()[0], 'id_cliente': novo_cliente()},
+                                   PRIORIDADE)
+    assert tarefas.executar_proxima('trabalhador-teste')
+    tarefa = tarefas.serializavel(database.obter_tarefa(id_tarefa))
+    assert tarefa['estado'] == 'concluida'
+    assert [resultado['motivo'] for resultado in tarefa['resultado']] == [None, None, 'sem_estoque']
+    assert database.obter_equipamento_por_id(id_equipamento)['quantidade_estoque'] == 0
+
+def test_tipo_desconhecido_falha_sem_nova_tentativa():
+    id_tarefa = _enfileirar(tipo='inexistente')
+    assert tarefas.executar_proxima('trabalhador-teste')
+    tarefa = database.obter_tarefa(id_tarefa)
+    assert (tarefa['estado'], tarefa['tentativas']) == ('falhou', 1)
+    assert 'ErroTarefa' in tarefa['erro']
+
+def test_falha_vai_para_o_log(caplog):
+    _enfileirar(tipo='inexistente')
+    with caplog.at_level(logging.WARNING, logger='tarefas'):
+        assert tarefas.executar_proxima('trabalhador-teste')
+    registro, = caplog.records
+    assert registro.levelno == logging.ERROR
+    assert 'falhou sem nova tentativa' in registro.getMessage()
+    assert registro.exc_info is not None